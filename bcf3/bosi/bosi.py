@@ -1,138 +1,372 @@
+import os
 import yaml
-import Queue
+import socket
 import argparse
-import threading
+import functools
 import lib.constants as const
 import subprocess32 as subprocess
 from lib.node import Node
 from lib.helper import Helper
+from lib.journal import Journal
+from lib.tracer import Tracer
+from lib.output import OutputRenderer
+from lib.log_sink import LogSink
+from lib.scheduler import Scheduler
+from lib.simulator import Simulator
+from lib.concurrency import ConcurrencyLimiter
+from lib.rest import RestLib
+from lib.transport import Transport
+from lib.preflight import Preflight
+from lib.node_selector import NodeSelector
+from lib.straggler import Straggler
+from lib.metrics import Metrics
 from lib.environment import Environment
 
 
-# queue to store all nodes
-node_q = Queue.Queue()
+def render_node(node, force):
+    with Tracer.span(node.hostname, const.PHASE_RENDER):
+        Helper.generate_scripts(node)
+    # the deploy hash does not cover cleanup, a requested
+    # purge always runs
+    purge = node.cleanup and node.role == const.ROLE_NEUTRON_SERVER
+    node.set_unchanged(not force and not purge
+                       and node.deployed_hash == node.deploy_hash)
+    LogSink.write(str(node))
 
-# data structure to setup dhcp agent and metadata agent
-dhcp_node_q = Queue.Queue()
 
+def check_code(node, what, code):
+    if code != 0:
+        raise Exception("%(what)s failed on %(hostname)s, exit code %(code)s" %
+                        {'what' : what, 'hostname' : node.hostname, 'code' : code})
 
-def worker_setup_node():
-    while True:
-        node = node_q.get()
-        # copy ivs pkg to node
-        Helper.copy_pkg_scripts_to_remote(node)
 
-        # deploy node
-        Helper.safe_print("Start to deploy %(hostname)s\n" %
-                         {'hostname' : node.hostname})
-        if node.cleanup and node.role == const.ROLE_NEUTRON_SERVER:
-            Helper.run_command_on_remote(node,
-                (r'''/bin/bash %(dst_dir)s/%(hostname)s_ospurge.sh >> %(log)s 2>&1''' %
-                {'dst_dir'  : node.dst_dir,
-                 'hostname' : node.hostname,
-                 'log'      : node.log}))
-        Helper.run_command_on_remote(node,
-            (r'''/bin/bash %(dst_dir)s/%(hostname)s.sh >> %(log)s 2>&1''' %
+def upload_node(node):
+    with Tracer.span(node.hostname, const.PHASE_UPLOAD) as span:
+        span.add_bytes(Helper.copy_pkg_scripts_to_remote(node))
+
+
+def purge_node(node):
+    with Tracer.span(node.hostname, const.PHASE_OSPURGE):
+        Helper.run_script_on_remote(node,
+            ("bash -c 'set -o pipefail; /bin/bash %(dst_dir)s/%(hostname)s_ospurge.sh %(redirect)s'" %
             {'dst_dir'  : node.dst_dir,
              'hostname' : node.hostname,
-             'log'      : node.log}))
-        Helper.safe_print("Finish deploying %(hostname)s\n" %
+             'redirect' : Helper.get_output_redirect(node)}),
+            const.PHASE_OSPURGE)
+
+
+def run_deploy_script(node):
+    with Tracer.span(node.hostname, const.PHASE_BASH):
+        code = Helper.run_script_on_remote(node, Helper.get_deploy_cmd(node), const.PHASE_BASH)
+    check_code(node, "Deployment script", code)
+
+
+def setup_node(node):
+    if node.unchanged:
+        OutputRenderer.set_phase(node.hostname, const.PHASE_DONE)
+        Helper.safe_print("skip node %(hostname)s, unchanged since its last deployment\n" %
                          {'hostname' : node.hostname})
-        node_q.task_done()
+        return
+
+    # copy ivs pkg to node
+    Straggler.run(node.hostname, const.PHASE_UPLOAD, functools.partial(upload_node, node))
+
+    # deploy node
+    Helper.safe_print("Start to deploy %(hostname)s\n" %
+                     {'hostname' : node.hostname})
+    if node.cleanup and node.role == const.ROLE_NEUTRON_SERVER:
+        Straggler.run(node.hostname, const.PHASE_OSPURGE, functools.partial(purge_node, node))
+    Straggler.run(node.hostname, const.PHASE_BASH, functools.partial(run_deploy_script, node))
+    OutputRenderer.set_phase(node.hostname, const.PHASE_DONE)
+    Helper.safe_print("Finish deploying %(hostname)s\n" %
+                     {'hostname' : node.hostname})
 
 
-def worker_setup_dhcp_agent():
-    while True:
-        node = dhcp_node_q.get()
+def copy_agent_config(controller_node):
+    with Tracer.span(controller_node.hostname, const.PHASE_AGENT_CONFIG):
+        Helper.safe_print("Copy dhcp_agent.ini from openstack controller %(controller_node)s\n" %
+                         {'controller_node' : controller_node.hostname})
+        check_code(controller_node, "Copying dhcp_agent.ini",
+            Helper.copy_file_from_remote(controller_node, '/etc/neutron', 'dhcp_agent.ini',
+                                         controller_node.setup_node_dir))
+        Helper.safe_print("Copy metadata_agent.ini from openstack controller %(controller_node)s\n" %
+                         {'controller_node' : controller_node.hostname})
+        check_code(controller_node, "Copying metadata_agent.ini",
+            Helper.copy_file_from_remote(controller_node, '/etc/neutron', 'metadata_agent.ini',
+                                         controller_node.setup_node_dir))
+
+
+def fetch_agent_config(controller_node):
+    Straggler.run(controller_node.hostname, const.PHASE_AGENT_CONFIG,
+                  functools.partial(copy_agent_config, controller_node))
+    OutputRenderer.set_phase(controller_node.hostname, const.PHASE_DONE)
+
+
+def deploy_dhcp_agent(node):
+    with Tracer.span(node.hostname, const.PHASE_DHCP_AGENT):
         Helper.safe_print("Copy dhcp_agent.ini to %(hostname)s\n" %
                          {'hostname' : node.hostname})
-        Helper.copy_file_to_remote(node, r'''%(dir)s/dhcp_agent.ini''' % {'dir' : node.setup_node_dir},
-                                   '/etc/neutron', 'dhcp_agent.ini')
+        check_code(node, "Copying dhcp_agent.ini",
+            Helper.copy_file_to_remote(node, r'''%(dir)s/dhcp_agent.ini''' % {'dir' : node.setup_node_dir},
+                                       '/etc/neutron', 'dhcp_agent.ini'))
         Helper.safe_print("Copy metadata_agent.ini to %(hostname)s\n" %
                          {'hostname' : node.hostname})
-        Helper.copy_file_to_remote(node, r'''%(dir)s/metadata_agent.ini''' % {'dir': node.setup_node_dir},
-                                   '/etc/neutron', 'metadata_agent.ini')
+        check_code(node, "Copying metadata_agent.ini",
+            Helper.copy_file_to_remote(node, r'''%(dir)s/metadata_agent.ini''' % {'dir': node.setup_node_dir},
+                                       '/etc/neutron', 'metadata_agent.ini'))
         Helper.safe_print("Restart neutron-metadata-agent and neutron-dhcp-agent on %(hostname)s\n" %
                          {'hostname' : node.hostname})
-        Helper.run_command_on_remote(node, 'service neutron-metadata-agent restart')
-        Helper.run_command_on_remote(node, 'service neutron-dhcp-agent restart')
-        Helper.safe_print("Finish deploying dhcp agent and metadata agent on %(hostname)s\n" %
-                         {'hostname' : node.hostname})
-        dhcp_node_q.task_done()
+        check_code(node, "Restarting neutron-metadata-agent",
+            Helper.run_command_on_remote(node, 'service neutron-metadata-agent restart'))
+        check_code(node, "Restarting neutron-dhcp-agent",
+            Helper.run_command_on_remote(node, 'service neutron-dhcp-agent restart'))
 
 
-def deploy_bcf(config, fuel_cluster_id, tag, cleanup):
-    # Deploy setup node
-    Helper.safe_print("Start to prepare setup node\n")
-    env = Environment(config, fuel_cluster_id, tag, cleanup)
-    Helper.common_setup_node_preparation(env)
-    controller_node = None
+def setup_dhcp_agent(node):
+    if node.unchanged:
+        return
+    Straggler.run(node.hostname, const.PHASE_DHCP_AGENT, functools.partial(deploy_dhcp_agent, node))
+    OutputRenderer.set_phase(node.hostname, const.PHASE_DONE)
+    Helper.safe_print("Finish deploying dhcp agent and metadata agent on %(hostname)s\n" %
+                     {'hostname' : node.hostname})
 
-    # Generate detailed node information
-    Helper.safe_print("Start to setup Big Cloud Fabric\n")
-    nodes_config = None
-    if 'nodes' in config:
-        nodes_yaml_config = config['nodes']
-    node_dic = Helper.load_nodes(nodes_yaml_config, env)
 
-    # Generate scripts for each node
+def add_deploy_tasks(scheduler, node_dic, force):
+    """
+    Add render, deploy, agent-config and dhcp-agent tasks of
+    all nodes to the scheduler.
+    """
+    controller_node = None
+    dhcp_nodes = []
+
+    # Scripts of a node are rendered by the worker pool, right
+    # before the node is deployed, rendered scripts stay in memory
     for hostname, node in node_dic.iteritems():
-        if node.os == const.CENTOS:
-            Helper.generate_scripts_for_centos(node)
-        elif node.os == const.UBUNTU:
-            Helper.generate_scripts_for_ubuntu(node)
-        with open(const.LOG_FILE, "a") as log_file:
-            log_file.write(str(node))
         if node.skip:
+            LogSink.write(str(node))
             Helper.safe_print("skip node %(hostname)s due to %(error)s\n" %
                              {'hostname' : hostname,
                               'error'    : node.error})
             continue
         if node.tag != node.env_tag:
+            LogSink.write(str(node))
             Helper.safe_print("skip node %(hostname)s due to mismatched tag\n" %
                              {'hostname' : hostname})
             continue
-        node_q.put(node)
+        render_task = Scheduler.task_name(const.PHASE_RENDER, hostname)
+        scheduler.add_task(render_task, functools.partial(render_node, node, force),
+                           journaled=False, limited=False)
+        scheduler.add_task(Scheduler.task_name(const.PHASE_DEPLOY, hostname),
+                           functools.partial(setup_node, node), [render_task],
+                           noop=node.is_unchanged)
 
         if node.role == const.ROLE_NEUTRON_SERVER:
             controller_node = node
         elif node.deploy_dhcp_agent:
-            dhcp_node_q.put(node)
+            dhcp_nodes.append(node)
 
-    # Use multiple threads to setup nodes
-    for i in range(const.MAX_WORKERS):
-        t = threading.Thread(target=worker_setup_node)
-        t.daemon = True
-        t.start()
-    node_q.join()
-
-    # Use multiple threads to setup up dhcp agent and metadata agent
-    if controller_node:
-        Helper.safe_print("Copy dhcp_agent.ini from openstack controller %(controller_node)s\n" %
-                         {'controller_node' : controller_node.hostname})
-        Helper.copy_file_from_remote(controller_node, '/etc/neutron', 'dhcp_agent.ini',
-                                     controller_node.setup_node_dir)
-        Helper.safe_print("Copy metadata_agent.ini from openstack controller %(controller_node)s\n" %
-                         {'controller_node' : controller_node.hostname})
-        Helper.copy_file_from_remote(controller_node, '/etc/neutron', 'metadata_agent.ini',
-                                     controller_node.setup_node_dir)
-    for i in range(const.MAX_WORKERS):
-        t = threading.Thread(target=worker_setup_dhcp_agent)
-        t.daemon = True
-        t.start()
-    dhcp_node_q.join()
+    # dhcp agent and metadata agent of a node are set up as soon as
+    # the node itself and the openstack controller are deployed
+    agent_config_deps = []
+    if controller_node and dhcp_nodes:
+        agent_config_task = Scheduler.task_name(const.PHASE_AGENT_CONFIG,
+                                                controller_node.hostname)
+        scheduler.add_task(agent_config_task,
+                           functools.partial(fetch_agent_config, controller_node),
+                           [Scheduler.task_name(const.PHASE_DEPLOY, controller_node.hostname)])
+        agent_config_deps.append(agent_config_task)
+    for node in dhcp_nodes:
+        scheduler.add_task(Scheduler.task_name(const.PHASE_DHCP_AGENT, node.hostname),
+                           functools.partial(setup_dhcp_agent, node),
+                           [Scheduler.task_name(const.PHASE_DEPLOY, node.hostname)] + agent_config_deps,
+                           noop=node.is_unchanged)
 
-    Helper.safe_print("Big Cloud Fabric deployment finished! Check %(log)s on each node for details.\n" %
-                     {'log' : const.LOG_FILE})
 
+def plan_bcf(config, fuel_cluster_id, tag, cleanup, selector=None):
+    """
+    Print nodes, rendered scripts, transfers, controller requests
+    and the task graph of a deployment without contacting any
+    node or bcf controller. Fuel clusters need the inventory
+    cached by an earlier run.
+    """
+    env = Environment(config, fuel_cluster_id, tag, cleanup, offline=True)
+    selector = selector or NodeSelector(tag)
+    subprocess.call("mkdir -p %(setup_node_dir)s/%(generated_script)s" %
+                   {'setup_node_dir'   : env.setup_node_dir,
+                    'generated_script' : const.GENERATED_SCRIPT_DIR}, shell=True)
+    node_yaml_config_map = Helper.get_node_yaml_config_map(config.get('nodes'))
+    membership_rules = {}
+    if env.fuel_cluster_id == None:
+        node_dic = Helper.load_nodes_from_yaml(node_yaml_config_map, env, selector)
+    else:
+        node_dic, membership_rules = Helper.load_nodes_from_fuel(node_yaml_config_map, env, selector)
 
-if __name__=='__main__':
+    scheduler = Scheduler()
+    add_deploy_tasks(scheduler, node_dic, True)
 
-    # Check if network is working properly
-    code = subprocess.call("ping www.bigswitch.com -c1", shell=True)
-    if code != 0:
-        Helper.safe_print("Network is not working properly, quit deployment\n")
+    Helper.safe_print("\nNodes:\n")
+    for hostname, node in sorted(node_dic.iteritems()):
+        state = "deploy"
+        if node.skip:
+            state = "skip, %(error)s" % {'error' : node.error}
+        elif node.tag != node.env_tag:
+            state = "skip, mismatched tag"
+        Helper.safe_print("  %(hostname)-20s %(role)-12s %(os)s %(os_version)s: %(state)s\n" %
+                         {'hostname'   : hostname,
+                          'role'       : node.role,
+                          'os'         : node.os,
+                          'os_version' : node.os_version,
+                          'state'      : state})
+
+    Helper.safe_print("\nScripts and transfers:\n")
+    for hostname, node in sorted(node_dic.iteritems()):
+        if Scheduler.task_name(const.PHASE_RENDER, hostname) not in scheduler.tasks:
+            continue
+        Helper.generate_scripts(node)
+        for src_dir, file_name in Helper.get_pkg_scripts_for_remote(node):
+            if src_dir is None:
+                size = "%d bytes, rendered" % len(node.rendered_scripts[file_name])
+            elif os.path.isfile(os.path.join(src_dir, file_name)):
+                size = "%d bytes" % os.path.getsize(os.path.join(src_dir, file_name))
+            else:
+                size = "not on setup node yet"
+            Helper.safe_print("  %(hostname)-20s %(dst_dir)s/%(file_name)s (%(size)s)\n" %
+                             {'hostname'  : hostname,
+                              'dst_dir'   : node.dst_dir,
+                              'file_name' : file_name,
+                              'size'      : size})
+
+    if membership_rules:
+        Helper.safe_print("\nBCF controller requests, before reconciliation:\n")
+        tenant = env.bcf_openstack_management_tenant
+        changes = RestLib.get_membership_rule_changes({}, membership_rules.values(), tenant)
+        for segment_changes in changes:
+            for method, url, data, description in segment_changes:
+                Helper.safe_print("  %(method)s %(url)s\n" %
+                                 {'method' : method, 'url' : url})
+
+    Helper.safe_print("\nTasks:\n")
+    for name, task in sorted(scheduler.tasks.iteritems()):
+        Helper.safe_print("  %(name)s%(deps)s\n" %
+                         {'name' : name,
+                          'deps' : (" after " + ", ".join(task.deps)) if task.deps else ''})
+    OutputRenderer.stop()
+
+
+def simulate_bcf(config, tag, trace_file, num_nodes, speedup):
+    """
+    Deploy num_nodes synthetic nodes through the real task graph,
+    over a transport replaying the phase latencies of trace_file.
+    """
+    env = Environment(config, None, tag, False, offline=True)
+    Straggler.configure(env.straggler_percentile, env.straggler_multiple,
+                        env.straggler_retry, env.straggler_retry_phases,
+                        env.straggler_max_retries)
+    simulator = Simulator(trace_file, speedup)
+    node_dic = simulator.load_nodes(env, num_nodes)
+    limiter = ConcurrencyLimiter(env.min_workers, env.max_workers)
+    scheduler = Scheduler(limiter.max_limit, limiter)
+    add_deploy_tasks(scheduler, node_dic, True)
+    simulator.run(scheduler, limiter)
+    Straggler.stop()
+    Helper.safe_print(Tracer.get_summary())
+    Helper.safe_print(Straggler.get_summary())
+    LogSink.stop()
+    OutputRenderer.stop()
+
+
+def deploy_bcf(config, fuel_cluster_id, tag, cleanup, trace_file=None, resume=False,
+               force=False, skip_preflight=False, selector=None, metrics_port=None):
+    # Deploy setup node
+    Helper.safe_print("Start to prepare setup node\n")
+    env = Environment(config, fuel_cluster_id, tag, cleanup)
+    LogSink.set_max_body(env.log_max_body)
+    if Transport.select(env.ssh_transport) != env.ssh_transport:
+        Helper.safe_print("%(transport)s is not available, use the ssh cli to reach nodes\n" %
+                         {'transport' : env.ssh_transport})
+    Straggler.configure(env.straggler_percentile, env.straggler_multiple,
+                        env.straggler_retry, env.straggler_retry_phases,
+                        env.straggler_max_retries)
+    if metrics_port is not None:
+        env.metrics_port = metrics_port
+    if env.metrics_port:
+        try:
+            Metrics.start(env.metrics_address, env.metrics_port)
+            Helper.safe_print("Serve metrics on http://%(address)s:%(port)d/metrics\n" %
+                             {'address' : env.metrics_address, 'port' : env.metrics_port})
+        except socket.error as e:
+            Helper.safe_print("Failed to serve metrics on %(address)s:%(port)d: %(e)s\n" %
+                             {'address' : env.metrics_address, 'port' : env.metrics_port, 'e' : e})
+    Helper.common_setup_node_preparation(env, resume)
+    journal = Journal(os.path.join(env.setup_node_dir, const.JOURNAL_FILE),
+                      Journal.get_config_hash(config, fuel_cluster_id, tag, cleanup),
+                      resume)
+    if journal.done:
+        Helper.safe_print("Resume deployment, %(count)d tasks already finished\n" %
+                         {'count' : len(journal.done)})
+    elif resume:
+        Helper.safe_print("No journal of this configuration to resume, deploy from scratch\n")
+
+    # Generate detailed node information
+    Helper.safe_print("Start to setup Big Cloud Fabric\n")
+    nodes_config = None
+    if 'nodes' in config:
+        nodes_yaml_config = config['nodes']
+    node_dic = Helper.load_nodes(nodes_yaml_config, env, selector or NodeSelector(tag))
+
+    # find unreachable and misconfigured nodes before heavy work
+    if not skip_preflight and not Preflight.run(node_dic):
+        Helper.safe_print("No node passed pre-flight checks, quit deployment\n")
         exit(1)
+    Helper.download_packages(env, resume)
+
+    limiter = ConcurrencyLimiter(env.min_workers, env.max_workers)
+    scheduler = Scheduler(limiter.max_limit, limiter, journal)
+    add_deploy_tasks(scheduler, node_dic, force)
+    Metrics.watch(scheduler, limiter)
+
+    # Use multiple threads to setup nodes
+    unfinished_tasks = scheduler.run()
+    Straggler.stop()
+
+    # stop package relay servers on nodes
+    Helper.stop_relay_servers()
+
+    # tear down ssh connections to all nodes
+    Transport.get().close()
+
+    # close keep-alive connections to bcf controllers
+    RestLib.close_connections()
+
+    # timing summary and trace
+    Helper.safe_print(Tracer.get_summary())
+    if trace_file:
+        Tracer.export(trace_file)
+        Helper.safe_print("Timing trace written to %(trace_file)s\n" %
+                         {'trace_file' : trace_file})
+
+    # nodes which straggled or failed
+    Helper.safe_print(Straggler.get_summary())
+    for task in sorted(unfinished_tasks, key=lambda task: task.name):
+        Helper.safe_print("%(name)s %(state)s: %(error)s\n" %
+                         {'name'  : task.name,
+                          'state' : task.state,
+                          'error' : task.error})
+
+    if unfinished_tasks:
+        Helper.safe_print("Big Cloud Fabric deployment finished with %(count)d failed or skipped tasks! "
+                          "Check %(log)s on each node for details.\n" %
+                         {'count' : len(unfinished_tasks), 'log' : const.LOG_FILE})
+    else:
+        Helper.safe_print("Big Cloud Fabric deployment finished! Check %(log)s on each node for details.\n" %
+                         {'log' : const.LOG_FILE})
+    Metrics.stop()
+    LogSink.stop()
+    OutputRenderer.stop()
+    return not unfinished_tasks
+
+
+if __name__=='__main__':
 
     # Parse configuration
     parser = argparse.ArgumentParser()
@@ -142,12 +376,60 @@ if __name__=='__main__':
                         help="Fuel cluster ID. Fuel settings may override YAML configuration. Please refer to config.yaml")
     parser.add_argument('-t', "--tag", required=False,
                         help="Deploy to tagged nodes only.")
+    parser.add_argument('--role', action='append',
+                        help="Deploy to nodes of this role only, can be given more than once.")
+    parser.add_argument('--os', action='append',
+                        help="Deploy to nodes running this os only, can be given more than once.")
+    parser.add_argument('--hostname', action='append', metavar='PATTERN',
+                        help="Deploy to nodes whose ip or configured name matches this glob only, "
+                             "can be given more than once.")
+    parser.add_argument('--nodes', required=False, metavar='HOST[,HOST...]',
+                        help="Deploy to these nodes only.")
     parser.add_argument('--cleanup', action='store_true', default=False,
                         help="Clean up existing routers, networks and projects.")
+    parser.add_argument('--status-view', action='store_true', default=False,
+                        help="Show a live per-node status table instead of interleaved messages.")
+    parser.add_argument('--trace-file', required=False,
+                        help="Write per-node, per-phase timing as a json trace to this file.")
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help="Skip node phases finished by an interrupted run with the same configuration.")
+    parser.add_argument('--force', action='store_true', default=False,
+                        help="Redeploy nodes even if unchanged since their last deployment.")
+    parser.add_argument('--skip-preflight', action='store_true', default=False,
+                        help="Do not check reachability, login, disk space and os of nodes before deploying.")
+    parser.add_argument('--metrics-port', type=int, required=False,
+                        help="Serve prometheus metrics of the deployment on this port, 0 disables it.")
+    parser.add_argument('--plan', action='store_true', default=False,
+                        help="Print what would be deployed without contacting any node or controller.")
+    parser.add_argument('--simulate', required=False, metavar='TRACE_FILE',
+                        help="Replay phase latencies of a --trace-file trace on synthetic nodes instead of deploying.")
+    parser.add_argument('--simulate-nodes', type=int, default=const.SIMULATION_NODES,
+                        help="Number of synthetic nodes to simulate.")
+    parser.add_argument('--simulate-speedup', type=float, default=const.SIMULATION_SPEEDUP,
+                        help="Replay recorded latencies this many times faster.")
     args = parser.parse_args()
+    if args.status_view:
+        OutputRenderer.enable_status_view()
     with open(args.config_file, 'r') as config_file:
         config = yaml.load(config_file)
-    deploy_bcf(config, args.fuel_cluster_id, args.tag, args.cleanup)
+    selector = NodeSelector(args.tag, args.role, args.os, args.hostname,
+                            args.nodes.split(',') if args.nodes else None)
 
+    if args.plan:
+        plan_bcf(config, args.fuel_cluster_id, args.tag, args.cleanup, selector)
+        exit(0)
+    if args.simulate:
+        simulate_bcf(config, args.tag, args.simulate, args.simulate_nodes,
+                     args.simulate_speedup)
+        exit(0)
 
+    # Check if network is working properly
+    code = subprocess.call("ping www.bigswitch.com -c1", shell=True)
+    if code != 0:
+        Helper.safe_print("Network is not working properly, quit deployment\n")
+        exit(1)
 
+    if not deploy_bcf(config, args.fuel_cluster_id, args.tag, args.cleanup, args.trace_file,
+                      args.resume, args.force, args.skip_preflight, selector,
+                      args.metrics_port):
+        exit(1)
@@ -0,0 +1,155 @@
+import os
+import time
+import resource
+import collections
+import threading
+import constants as const
+from helper import Helper
+from log_sink import LogSink
+from run_stats import RunStats
+
+
+class ConcurrencyLimiter(object):
+    """
+    Limit the number of tasks running at the same time and adjust
+    the limit with additive-increase/multiplicative-decrease.
+    After every CONCURRENCY_WINDOW finished tasks, the limit is
+    halved if the error/timeout rate, task latency, transfer
+    throughput or local load/fd usage says the setup node, the
+    network or the nodes are saturated, otherwise it grows by one.
+    Latency of a phase is compared to the median of its recent
+    windows, so one unusually fast window does not stick.
+    """
+    def __init__(self, min_limit, max_limit, limit=const.MAX_WORKERS):
+        self.min_limit      = min_limit
+        self.max_limit      = max(min_limit, max_limit)
+        self.limit          = min(max(limit, self.min_limit), self.max_limit)
+        self.in_flight      = 0
+        self.cond           = threading.Condition()
+
+        # (phase, latency, success) of tasks finished in this window
+        self.window          = []
+        self.window_start    = time.time()
+        self.window_bytes    = RunStats.get(const.STAT_BYTES_SENT)
+        self.window_timeouts = RunStats.get(const.STAT_TIMEOUTS)
+
+        # mean latency of the recent windows per phase
+        self.latency_history = {}
+        self.last_throughput = None
+        self.increased       = False
+        Helper.safe_print("Worker concurrency starts at %(limit)d (min %(min)d, max %(max)d)\n" %
+                         {'limit' : self.limit,
+                          'min'   : self.min_limit,
+                          'max'   : self.max_limit})
+
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= self.limit:
+                self.cond.wait()
+            self.in_flight += 1
+
+
+    def release(self, phase, latency, success):
+        with self.cond:
+            self.in_flight -= 1
+            self.window.append((phase, latency, success))
+            if len(self.window) >= const.CONCURRENCY_WINDOW:
+                self.__adjust__()
+            self.cond.notify_all()
+
+
+    @staticmethod
+    def __median__(values):
+        values = sorted(values)
+        middle = len(values) / 2
+        if len(values) % 2:
+            return values[middle]
+        return (values[middle - 1] + values[middle]) / 2.0
+
+
+    def __get_saturation__(self):
+        """
+        Return why the current limit is too high, or None.
+        """
+        now = time.time()
+        elapsed = max(now - self.window_start, 0.001)
+        sent = RunStats.get(const.STAT_BYTES_SENT)
+        timeouts = RunStats.get(const.STAT_TIMEOUTS)
+        uploaded = sent > self.window_bytes
+        throughput = (sent - self.window_bytes) / elapsed
+        errors = (len([w for w in self.window if not w[2]])
+                  + timeouts - self.window_timeouts)
+        self.window_start = now
+        self.window_bytes = sent
+        self.window_timeouts = timeouts
+
+        # latency relative to the recent windows of the same phase,
+        # failed tasks often end early and are counted as errors
+        phase_latencies = {}
+        for phase, latency, success in self.window:
+            if success:
+                phase_latencies.setdefault(phase, []).append(latency)
+        latency_ratio = 0
+        latency_phase = None
+        for phase, latencies in phase_latencies.iteritems():
+            mean = sum(latencies) / len(latencies)
+            if mean < const.CONCURRENCY_MIN_LATENCY:
+                continue
+            history = self.latency_history.setdefault(
+                phase, collections.deque(maxlen=const.CONCURRENCY_BASELINE_WINDOWS))
+            if len(history) >= const.CONCURRENCY_BASELINE_MIN_WINDOWS:
+                ratio = mean / ConcurrencyLimiter.__median__(history)
+                if ratio > latency_ratio:
+                    latency_ratio = ratio
+                    latency_phase = phase
+            history.append(mean)
+
+        # windows without uploads say nothing about throughput
+        last_throughput = self.last_throughput
+        if uploaded:
+            self.last_throughput = throughput
+        else:
+            last_throughput = None
+
+        error_rate = float(errors) / len(self.window)
+        if error_rate > const.CONCURRENCY_MAX_ERROR_RATE:
+            return "error/timeout rate %(rate).0f%%" % {'rate' : error_rate * 100}
+        load = os.getloadavg()[0]
+        cpus = os.sysconf('SC_NPROCESSORS_ONLN')
+        if load > const.CONCURRENCY_MAX_LOAD_PER_CPU * cpus:
+            return "load average %(load).1f on %(cpus)d cpus" % {'load' : load, 'cpus' : cpus}
+        try:
+            fds = len(os.listdir('/proc/self/fd'))
+            fd_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+            if fds > const.CONCURRENCY_MAX_FD_RATIO * fd_limit:
+                return "%(fds)d of %(fd_limit)d fds in use" % {'fds' : fds, 'fd_limit' : fd_limit}
+        except OSError:
+            pass
+        if latency_ratio > const.CONCURRENCY_MAX_LATENCY_RATIO:
+            return ("%(phase)s latency %(ratio).1fx its recent median" %
+                    {'phase' : latency_phase, 'ratio' : latency_ratio})
+        if (self.increased and last_throughput
+            and throughput < const.CONCURRENCY_MIN_THROUGHPUT_RATIO * last_throughput):
+            return ("throughput dropped from %(last).0f to %(now).0f KB/s" %
+                    {'last' : last_throughput / 1024, 'now' : throughput / 1024})
+        return None
+
+
+    def __adjust__(self):
+        reason = self.__get_saturation__()
+        self.window = []
+        old_limit = self.limit
+        if reason:
+            self.limit = max(self.min_limit, int(self.limit * const.CONCURRENCY_DECREASE_FACTOR))
+            self.increased = False
+        else:
+            reason = "no saturation"
+            self.limit = min(self.max_limit, self.limit + 1)
+            self.increased = self.limit > old_limit
+        if self.limit == old_limit:
+            return
+        msg = ("Worker concurrency %(old)d -> %(new)d: %(reason)s\n" %
+               {'old' : old_limit, 'new' : self.limit, 'reason' : reason})
+        Helper.safe_print(msg)
+        LogSink.write(msg)
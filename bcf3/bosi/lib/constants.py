@@ -2,6 +2,105 @@
 # max number of threads, each thread sets up one node
 MAX_WORKERS = 20
 
+# default bounds of the adaptive worker concurrency,
+# can be overridden by min_workers/max_workers in yaml config
+MIN_WORKERS_BOUND = 4
+MAX_WORKERS_BOUND = 100
+
+# adaptive worker concurrency, re-evaluated every CONCURRENCY_WINDOW
+# finished tasks with additive-increase/multiplicative-decrease
+CONCURRENCY_WINDOW               = 5
+CONCURRENCY_DECREASE_FACTOR      = 0.5
+CONCURRENCY_MAX_ERROR_RATE       = 0.2
+CONCURRENCY_MAX_LATENCY_RATIO    = 2.0
+CONCURRENCY_MIN_THROUGHPUT_RATIO = 0.8
+CONCURRENCY_MAX_LOAD_PER_CPU     = 2.0
+CONCURRENCY_MAX_FD_RATIO         = 0.8
+# latency of a phase is compared to the median of its last
+# CONCURRENCY_BASELINE_WINDOWS windows, once it has at least
+# CONCURRENCY_BASELINE_MIN_WINDOWS, phases faster than
+# CONCURRENCY_MIN_LATENCY seconds are not compared
+CONCURRENCY_BASELINE_WINDOWS     = 5
+CONCURRENCY_BASELINE_MIN_WINDOWS = 2
+CONCURRENCY_MIN_LATENCY          = 0.5
+
+# names of run statistics counters
+STAT_BYTES_SENT     = 'bytes_sent'
+STAT_TIMEOUTS       = 'timeouts'
+STAT_CANCELLED      = 'cancelled'
+STAT_SSH_HANDSHAKES = 'ssh_handshakes'
+STAT_REST_CALLS     = 'rest_calls'
+STAT_REST_ERRORS    = 'rest_errors'
+STAT_REST_LATENCY   = 'rest_latency'
+
+# upper bounds in seconds of the controller request latency histogram
+REST_LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+# optional prometheus metrics endpoint served during deployment,
+# disabled with port 0, can be overridden by metrics_address and
+# metrics_port in yaml config or --metrics-port
+METRICS_ADDRESS = '127.0.0.1'
+METRICS_PORT    = 0
+METRICS_PREFIX  = 'bosi_'
+
+# max number of threads probing nodes during discovery
+MAX_DISCOVERY_WORKERS = 50
+
+# task states of the deployment scheduler
+TASK_PENDING = 'pending'
+TASK_READY   = 'ready'
+TASK_DONE    = 'done'
+TASK_FAILED  = 'failed'
+TASK_SKIPPED = 'skipped'
+
+# per-node deployment phases
+PHASE_DISCOVERY    = 'discovery'
+PHASE_PREFLIGHT    = 'preflight'
+PHASE_RENDER       = 'render'
+PHASE_DEPLOY       = 'deploy'
+PHASE_AGENT_CONFIG = 'agent-config'
+PHASE_DHCP_AGENT   = 'dhcp-agent'
+PHASE_UPLOAD       = 'upload'
+PHASE_OSPURGE      = 'ospurge'
+PHASE_BASH         = 'bash'
+PHASE_DONE         = 'done'
+
+# straggler detection, a node is a straggler once a phase takes
+# STRAGGLER_MULTIPLE times the STRAGGLER_PERCENTILE latency of the
+# phase across at least STRAGGLER_MIN_SAMPLES nodes, and at least
+# STRAGGLER_MIN_SECONDS. Only phases which are safe to run again
+# are retried.
+STRAGGLER_PERCENTILE     = 90
+STRAGGLER_MULTIPLE       = 3.0
+STRAGGLER_MIN_SAMPLES    = 5
+STRAGGLER_MIN_SECONDS    = 60
+STRAGGLER_CHECK_INTERVAL = 5
+STRAGGLER_MAX_RETRIES    = 2
+STRAGGLER_BACKOFF        = 10
+STRAGGLER_RETRY_PHASES   = [PHASE_UPLOAD, PHASE_AGENT_CONFIG, PHASE_DHCP_AGENT]
+
+# compact live status view
+STATUS_VIEW_REFRESH    = 1
+STATUS_VIEW_MAX_NODES  = 30
+STATUS_VIEW_MESSAGES   = 5
+# characters of a node's last output line in the status view
+STATUS_VIEW_LINE_WIDTH = 60
+
+# lines of streamed remote output kept per node
+STREAM_BUFFER_LINES    = 100
+# messages waiting for the output thread, streamed remote
+# output beyond it is dropped instead of queued
+OUTPUT_QUEUE_SIZE      = 10000
+
+# number of slowest nodes listed in the timing summary
+TRACE_SUMMARY_NODES    = 10
+
+# replay of recorded phase latencies, see Simulator
+SIMULATION_NODES       = 2000
+SIMULATION_SPEEDUP     = 100.0
+SIMULATION_SEED        = 0
+SIMULATION_DIR_PREFIX  = 'bosi_simulation_'
+
 # root access to all the nodes is required
 DEFAULT_USER = 'root'
 
@@ -33,12 +132,73 @@ HORIZON_BASE_DIR = '/usr/share/openstack-dashboard'
 PRE_REQUEST_BASH     = 'pre_request.sh'
 DST_DIR              = '/tmp'
 GENERATED_SCRIPT_DIR = 'generated_script'
+JOURNAL_FILE         = 'bosi_journal.json'
+# bcf controller config hash seen after the last membership
+# rule programming, per tenant
+BCF_HASH_FILE        = 'bosi_bcf_hash.json'
+# bcf controller session cookies, reused by the next run
+BCF_COOKIE_FILE      = 'bosi_bcf_cookie.json'
+# fuel settings, node list and per node astute.yaml, per cluster
+FUEL_CACHE_FILE      = 'bosi_fuel_cache.json'
+FUEL_CACHE_TTL       = 3600
 BASH_TEMPLATE_DIR    = 'bash_template'
 PUPPET_TEMPLATE_DIR  = 'puppet_template'
 SELINUX_TEMPLATE_DIR = 'selinux_template'
 OSPURGE_TEMPLATE_DIR = 'ospurge_template'
 LOG_FILE             = "/var/log/bcf_setup.log"
 
+# bosi's own log writer, see LogSink
+LOG_MAX_BYTES        = 100 * 1024 * 1024
+LOG_BACKUP_COUNT     = 3
+LOG_MAX_BODY         = 4096
+LOG_QUEUE_SIZE       = 10000
+LOG_BATCH_SIZE       = 500
+
+# marker on each node holding the hash of the last successful deployment
+DEPLOY_MARKER_DIR    = '/var/lib/bosi'
+DEPLOY_MARKER        = '/var/lib/bosi/deployed.md5'
+
+# ssh connection multiplexing, one master connection per node
+SSH_CONTROL_DIR_PREFIX = 'bosi_ssh_'
+SSH_CONTROL_PERSIST    = 600
+SSH_CONNECT_TIMEOUT    = 10
+
+# backends to reach nodes, the ssh cli or in-process paramiko
+TRANSPORT_CLI          = 'cli'
+TRANSPORT_PARAMIKO     = 'paramiko'
+SSH_KEEPALIVE_INTERVAL = 30
+TRANSPORT_RECV_SIZE    = 32768
+# sudo prompt on a pty, the password is sent once it shows up
+TRANSPORT_SUDO_PROMPT  = '[bosi] sudo password:'
+# seconds between checks of a running command's cancel event
+TRANSPORT_POLL_INTERVAL = 2
+
+# timeout in seconds of a command run on a node
+REMOTE_COMMAND_TIMEOUT = 1800
+
+# pre-flight checks of all nodes before deployment, a node needs
+# ssh, a working login and PREFLIGHT_MIN_DISK_MB free in DST_DIR
+SSH_PORT               = 22
+PREFLIGHT_TIMEOUT      = 15
+PREFLIGHT_MIN_DISK_MB  = 512
+MAX_PREFLIGHT_WORKERS  = 100
+
+# timeout in seconds to stream the per-node artifact bundle
+BUNDLE_COPY_TIMEOUT    = 1800
+# dir under DST_DIR a non-root login user unpacks the bundle to
+BUNDLE_STAGING_DIR     = 'bosi_bundle_%(user)s'
+
+# tree fan-out distribution of ivs packages, nodes which have the
+# packages serve them over http to at most PACKAGE_RELAY_FANOUT
+# nodes at a time
+PACKAGE_RELAY_DIR           = 'bosi_relay'
+PACKAGE_RELAY_PORT          = 8765
+PACKAGE_RELAY_FANOUT        = 2
+PACKAGE_RELAY_TIMEOUT       = 60
+PACKAGE_RELAY_TTL           = 7200
+# seconds to wait for a relay server to answer after its start
+PACKAGE_RELAY_START_TIMEOUT = 5
+
 # constants for ivs config
 INBAND_VLAN     = 4092
 IVS_DAEMON_ARGS = (r'''DAEMON_ARGS=\"--syslog --inband-vlan %(inband_vlan)d%(uplink_interfaces)s%(internal_ports)s\"''')
@@ -59,6 +219,13 @@ NETWORK_VLAN_RANGE_EXPRESSION   = '^\s*(\S*)\s*:\s*(\S*)\s*:\s*(\S*)\s*$'
 VLAN_RANGE_CONFIG_PATH          = '/etc/neutron/plugins/ml2/ml2_conf.ini'
 SELINUX_MODE_EXPRESSION         = '^\s*SELINUX\s*=\s*(\S*)\s*$'
 SELINUX_CONFIG_PATH             = '/etc/selinux/config'
+MD5SUM_EXPRESSION               = '^([0-9a-f]{32})\s+\*?(\S+)$'
+# df -Pk line, the 4th column is the available space in KB
+DF_EXPRESSION                   = '^\S+\s+\d+\s+\d+\s+(\d+)\s+\d+%\s+\S+\s*$'
+OS_RELEASE_EXPRESSION           = '^\s*(ID|VERSION_ID)\s*=\s*"?([^"\s]*)"?\s*$'
+
+# separates the outputs of commands combined into one node probe
+PROBE_SEPARATOR                 = '__BOSI_PROBE_SEPARATOR__'
 
 
 # openrc
@@ -77,3 +244,14 @@ HASH_HEADER            = 'BCF-SETUP'
 BCF_CONTROLLER_PORT    = 8443
 ANY                    = 'any'
 
+
+# idle keep-alive connections kept per controller, also the
+# number of membership rules programmed at the same time
+BCF_MAX_CONNECTIONS    = 8
+BCF_REQUEST_TIMEOUT    = 30
+# timeout of logins and role queries while looking for
+# the active controller
+BCF_PROBE_TIMEOUT      = 5
+# responses after which bosi checks whether the controller
+# is still the active one
+BCF_FAILOVER_STATUS    = [401, 403, 500, 502, 503]
@@ -0,0 +1,15 @@
+class CountingWriter(object):
+    """
+    Wrap a writable file object and count the bytes written,
+    used to measure per-node transfer throughput.
+    """
+    def __init__(self, fileobj):
+        self.fileobj       = fileobj
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.bytes_written += len(data)
+
+    def flush(self):
+        self.fileobj.flush()
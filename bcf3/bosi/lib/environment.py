@@ -6,7 +6,10 @@ from helper import Helper
 from rest import RestLib
 
 class Environment(object):
-    def __init__(self, config, fuel_cluster_id, tag, cleanup):
+    def __init__(self, config, fuel_cluster_id, tag, cleanup, offline=False):
+        # do not contact nodes or bcf controllers, for --plan
+        self.offline = offline
+
         # fuel cluster id
         self.fuel_cluster_id = fuel_cluster_id
 
@@ -24,8 +27,49 @@ class Environment(object):
         # flags for dhcp and metadata agent
         self.deploy_dhcp_agent = config.get('default_deploy_dhcp_agent')
 
+        # bounds of the adaptive worker concurrency
+        self.min_workers = config.get('min_workers', const.MIN_WORKERS_BOUND)
+        self.max_workers = config.get('max_workers', const.MAX_WORKERS_BOUND)
+
+        # controller request and response bodies in the log are
+        # truncated to this many bytes, 0 keeps them whole
+        self.log_max_body = config.get('log_max_body', const.LOG_MAX_BODY)
+
+        # nodes serve ivs packages to each other instead of all
+        # pulling them from the setup node
+        self.package_relay = config.get('package_relay', False)
+
+        # seconds cached fuel settings and node list are used
+        # before asking fuel again, 0 disables the cache
+        self.fuel_cache_ttl = config.get('fuel_cache_ttl', const.FUEL_CACHE_TTL)
+
+        # stream output of deployment scripts on nodes back to
+        # the setup node while they run
+        self.stream_output = config.get('stream_output', False)
+
+        # reach nodes with the ssh cli or in-process with paramiko
+        self.ssh_transport = config.get('ssh_transport', const.TRANSPORT_CLI)
+
+        # flag nodes much slower than the others in a phase,
+        # optionally abort and retry the phase
+        self.straggler_percentile = config.get('straggler_percentile', const.STRAGGLER_PERCENTILE)
+        self.straggler_multiple = config.get('straggler_multiple', const.STRAGGLER_MULTIPLE)
+        self.straggler_retry = config.get('straggler_retry', False)
+        self.straggler_retry_phases = config.get('straggler_retry_phases', const.STRAGGLER_RETRY_PHASES)
+        self.straggler_max_retries = config.get('straggler_max_retries', const.STRAGGLER_MAX_RETRIES)
+
+        # prometheus metrics endpoint, disabled with port 0
+        self.metrics_address = config.get('metrics_address', const.METRICS_ADDRESS)
+        self.metrics_port = config.get('metrics_port', const.METRICS_PORT)
+
         # setup node ip and directory
-        self.setup_node_ip  = Helper.get_setup_node_ip()
+        try:
+            self.setup_node_ip = Helper.get_setup_node_ip()
+        except socket.error:
+            if not offline:
+                raise
+            # planning works without a route to the outside
+            self.setup_node_ip = '127.0.0.1'
         self.setup_node_dir = os.getcwd()
 
         # t5 or t6 mode
@@ -71,6 +115,10 @@ class Environment(object):
         self.bcf_controller_passwd = config['bcf_controller_passwd']
         self.bcf_openstack_management_tenant = config.get('bcf_openstack_management_tenant')
 
+        # only write the difference between the segments on the
+        # controller and the ones derived from fuel
+        self.reconcile_membership_rules = config.get('reconcile_membership_rules', False)
+
         # ivs pkg and debug pkg
         self.ivs_pkg_map = {}
         self.ivs_url_map = {}
@@ -112,9 +160,10 @@ class Environment(object):
         # mast bcf controller and cookie
         self.bcf_master = None
         self.bcf_cookie = None
-        if fuel_cluster_id:
+        if fuel_cluster_id and not offline:
             self.bcf_master, self.bcf_cookie = RestLib.get_active_bcf_controller(self.bcf_controller_ips,
-                self.bcf_controller_user, self.bcf_controller_passwd)
+                self.bcf_controller_user, self.bcf_controller_passwd,
+                cookie_file=os.path.join(self.setup_node_dir, const.BCF_COOKIE_FILE))
             if (not self.bcf_master) or (not self.bcf_cookie):
                 raise Exception("Failed to connect to master BCF controller, quit setup.")
 
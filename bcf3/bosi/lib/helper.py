@@ -1,11 +1,16 @@
 import os
+import re
 import sys
 import time
 import json
 import yaml
+import Queue
+import StringIO
 import socket
+import hashlib
 import string
 import netaddr
+import tarfile
 import threading
 import constants as const
 import subprocess32 as subprocess
@@ -13,13 +18,26 @@ from node import Node
 from rest import RestLib
 from bridge import Bridge
 from threading import Lock
+from output import OutputRenderer
+from tracer import Tracer
+from log_sink import LogSink
+from remote_output import RemoteOutput
+from run_stats import RunStats
+from transport import Transport, TransportTimeout, TransportCancelled
+from package_relay import PackageRelay
+from counting_writer import CountingWriter
 from membership_rule import MembershipRule
 
 
 class Helper(object):
 
-    # lock to serialize stdout of different threads
-    __print_lock = Lock()
+    # md5 of local packages, keyed by (path, size, mtime)
+    __md5_lock = Lock()
+    __md5_cache = {}
+
+    # content of script templates, read once per run
+    __template_lock = Lock()
+    __template_cache = {}
 
     @staticmethod
     def get_setup_node_ip():
@@ -45,52 +63,183 @@ class Helper(object):
         """
         Run cmd on remote node.
         """
-        local_cmd = (r'''ssh -t -oStrictHostKeyChecking=no -o LogLevel=quiet %(hostname)s "%(remote_cmd)s"''' %
-                    {'hostname'   : node_ip,
-                     'remote_cmd' : command,
-                    })
-        return Helper.run_command_on_local_without_timeout(local_cmd)
+        code, output, errors = Transport.get().run(node_ip, None, None, command)
+        return output, errors
 
 
     @staticmethod
-    def run_command_on_local(command, timeout=1800):
+    def run_concurrently(keys, func, max_workers=const.MAX_DISCOVERY_WORKERS):
         """
-        Use subprocess to run a shell command on local node.
+        Call func(key) for every key with at most max_workers
+        threads, return a dictionary from key to result.
+        A key whose call raises is missing from the dictionary.
         """
-        def target():
-            try:
-                p = subprocess.Popen(
-                    command, shell=True, stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE, close_fds=True, bufsize=1)
-            except Exception as e:
-                msg = "Error opening process %s: %s\n" % (command, e)
-                Helper.safe_print(msg)
-                return
-            p.communicate()
+        results = {}
+        key_q = Queue.Queue()
+
+        def worker():
+            while True:
+                key = key_q.get()
+                if key is None:
+                    key_q.task_done()
+                    return
+                try:
+                    results[key] = func(key)
+                except Exception as e:
+                    Helper.safe_print("Error processing %(key)s: %(e)s\n" %
+                                     {'key' : key, 'e' : e})
+                key_q.task_done()
+
+        keys = list(keys)
+        for key in keys:
+            key_q.put(key)
+        num_workers = min(max_workers, len(keys))
+        for i in range(num_workers):
+            key_q.put(None)
+        for i in range(num_workers):
+            t = threading.Thread(target=worker)
+            t.daemon = True
+            t.start()
+        key_q.join()
+        return results
+
 
-        thread = threading.Thread(target=target)
-        thread.start()
-        thread.join(timeout)
-        if thread.is_alive():
+    @staticmethod
+    def run_command_on_local(command, timeout=const.REMOTE_COMMAND_TIMEOUT):
+        """
+        Use subprocess to run a shell command on local node.
+        """
+        try:
+            p = subprocess.Popen(
+                command, shell=True, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, close_fds=True)
+        except Exception as e:
+            msg = "Error opening process %s: %s\n" % (command, e)
+            Helper.safe_print(msg)
+            return
+        try:
+            p.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
             p.terminate()
-            thread.join()
+            p.communicate()
+            RunStats.increment(const.STAT_TIMEOUTS)
             msg = "Timed out waiting for command %s to finish." % command
             Helper.safe_print(msg)
 
 
+    @staticmethod
+    def run_command_on_remote_streaming(node, command, phase):
+        """
+        Run cmd on remote node and hand every line of its
+        output to RemoteOutput as soon as it arrives,
+        cmd must send its output to stdout. Return the exit
+        code, None if cmd timed out or was cancelled.
+        """
+        user, passwd = Helper.get_login(node)
+        try:
+            code, output, errors = Transport.get().run(
+                node.hostname, user, passwd, command,
+                timeout=const.REMOTE_COMMAND_TIMEOUT,
+                line_func=lambda line: RemoteOutput.append(node.hostname, phase, line))
+            return code
+        except TransportCancelled as e:
+            Helper.__cancelled__(e)
+        except TransportTimeout as e:
+            RunStats.increment(const.STAT_TIMEOUTS)
+            msg = ("%(e)s Last output of %(hostname)s:\n%(tail)s\n" %
+                  {'e'        : e,
+                   'hostname' : node.hostname,
+                   'tail'     : '\n'.join([line for phase, line in RemoteOutput.get_tail(node.hostname)])})
+            Helper.safe_print(msg)
+
+
+    @staticmethod
+    def get_output_redirect(node):
+        """
+        Shell redirect for scripts run on node, append to the
+        node's log and, when streaming, copy to stdout as well.
+        """
+        if node.stream_output:
+            return "2>&1 | tee -a %(log)s" % {'log' : node.log}
+        return ">> %(log)s 2>&1" % {'log' : node.log}
+
+
+    @staticmethod
+    def run_script_on_remote(node, command, phase):
+        """
+        Run a command built with get_output_redirect on node,
+        return its exit code.
+        """
+        if node.stream_output:
+            return Helper.run_command_on_remote_streaming(node, command, phase)
+        return Helper.run_command_on_remote(node, command)
+
+
     @staticmethod
     def safe_print(message):
         """
-        Grab the lock and print to stdout.
-        The lock is to serialize messages from
-        different thread. 'stty sane' is to
-        clean up any hiden space.
+        Hand the message to the output renderer thread,
+        which serializes messages from different threads.
+        """
+        OutputRenderer.write(message)
+
+
+    @staticmethod
+    def get_login(node):
+        """
+        Return the user and password to log into node with,
+        both None for fuel nodes, which take the setup node's key.
+        """
+        if node.fuel_cluster_id:
+            return None, None
+        return node.user, node.passwd
+
+
+    @staticmethod
+    def __cancelled__(e):
+        """
+        Count a command aborted through its cancel event, e.g. a
+        straggler, which is reported by whoever cancelled it.
+        """
+        RunStats.increment(const.STAT_CANCELLED)
+        LogSink.write("%(e)s\n" % {'e' : e})
+
+
+    @staticmethod
+    def __run_on_remote__(node, user, passwd, command):
+        """
+        Run cmd on remote node, append its output to the
+        node's log. Return the exit code, None if cmd timed
+        out or was cancelled.
+        """
+        try:
+            code, output, errors = Transport.get().run(
+                node.hostname, user, passwd, command,
+                timeout=const.REMOTE_COMMAND_TIMEOUT, log=node.log)
+            return code
+        except TransportCancelled as e:
+            Helper.__cancelled__(e)
+        except TransportTimeout as e:
+            RunStats.increment(const.STAT_TIMEOUTS)
+            Helper.safe_print("%(e)s\n" % {'e' : e})
+
+
+    @staticmethod
+    def __copy_with_remote__(node, user, passwd, src_file, dst_file, to_remote):
         """
-        with Helper.__print_lock:
-            subprocess.call('stty sane', shell=True)
-            sys.stdout.write(message)
-            sys.stdout.flush()
-            subprocess.call('stty sane', shell=True)
+        Copy a file to or from remote node, log to the node's log.
+        Return the exit code, None if the copy timed out.
+        """
+        transport = Transport.get()
+        copy = transport.put if to_remote else transport.get_file
+        try:
+            return copy(node.hostname, user, passwd, src_file, dst_file,
+                        node.log, const.REMOTE_COMMAND_TIMEOUT)
+        except TransportCancelled as e:
+            Helper.__cancelled__(e)
+        except TransportTimeout as e:
+            RunStats.increment(const.STAT_TIMEOUTS)
+            Helper.safe_print("%(e)s\n" % {'e' : e})
 
 
     @staticmethod
@@ -98,26 +247,13 @@ class Helper(object):
         """
         Run cmd on remote node.
         """
-        local_cmd = (r'''sshpass -p %(pwd)s ssh -t -oStrictHostKeyChecking=no -o LogLevel=quiet %(user)s@%(hostname)s >> %(log)s 2>&1 "echo %(pwd)s | sudo -S %(remote_cmd)s"''' %
-                   {'user'       : node.user,
-                    'hostname'   : node.hostname,
-                    'pwd'        : node.passwd,
-                    'log'        : node.log,
-                    'remote_cmd' : command,
-                   })
-        Helper.run_command_on_local(local_cmd)
+        return Helper.__run_on_remote__(node, node.user, node.passwd, command)
 
 
     @staticmethod
     def run_command_on_remote_with_passwd_without_timeout(hostname, user, passwd, command):
-        local_cmd = (r'''sshpass -p %(pwd)s ssh -t -oStrictHostKeyChecking=no -o LogLevel=quiet %(user)s@%(hostname)s "echo %(pwd)s | sudo -S %(remote_cmd)s"''' %
-                   {'user'       : user,
-                    'hostname'   : hostname,
-                    'pwd'        : passwd,
-                    'log'        : const.LOG_FILE,
-                    'remote_cmd' : command,
-                   })
-        return Helper.run_command_on_local_without_timeout(local_cmd)
+        code, output, errors = Transport.get().run(hostname, user, passwd, command)
+        return output, errors
 
 
     @staticmethod
@@ -126,25 +262,19 @@ class Helper(object):
         Copy file from local node to remote node,
         create directory if remote directory doesn't exist,
         change the file mode as well.
+        Return the exit code of the copy.
         """
         mkdir_cmd = (r'''mkdir -p %(dst_dir)s''' % {'dst_dir' : dst_dir})
         Helper.run_command_on_remote_with_passwd(node, mkdir_cmd)
-        scp_cmd = (r'''sshpass -p %(pwd)s scp -oStrictHostKeyChecking=no -o LogLevel=quiet -r %(src_file)s  %(user)s@%(hostname)s:%(dst_dir)s/%(dst_file)s >> %(log)s 2>&1''' %
-                  {'user'       : node.user,
-                   'hostname'   : node.hostname,
-                   'pwd'        : node.passwd,
-                   'log'        : node.log,
-                   'src_file'   : src_file,
-                   'dst_dir'    : dst_dir,
-                   'dst_file'   : dst_file
-                  })
-        Helper.run_command_on_local(scp_cmd)
+        code = Helper.__copy_with_remote__(node, node.user, node.passwd, src_file,
+            r'''%(dst_dir)s/%(dst_file)s''' % {'dst_dir' : dst_dir, 'dst_file' : dst_file}, True)
         chmod_cmd = (r'''chmod -R %(mode)d %(dst_dir)s/%(dst_file)s''' %
                     {'mode'     : mode,
                      'dst_dir'  : dst_dir,
                      'dst_file' : dst_file
                     })
         Helper.run_command_on_remote_with_passwd(node, chmod_cmd)
+        return code
 
 
     @staticmethod
@@ -153,25 +283,20 @@ class Helper(object):
         Copy file from remote node to local node,
         create directory if local directory doesn't exist,
         change the file mode as well.
+        Return the exit code of the copy.
         """
         mkdir_cmd = (r'''mkdir -p %(dst_dir)s''' % {'dst_dir' : dst_dir})
         Helper.run_command_on_local(mkdir_cmd)
-        scp_cmd = (r'''sshpass -p %(pwd)s scp -oStrictHostKeyChecking=no -o LogLevel=quiet %(user)s@%(hostname)s:%(src_dir)s/%(src_file)s %(dst_dir)s/%(src_file)s >> %(log)s 2>&1''' %
-                  {'pwd'        : node.passwd,
-                   'user'       : node.user,
-                   'hostname'   : node.hostname,
-                   'log'        : node.log,
-                   'src_dir'    : src_dir,
-                   'dst_dir'    : dst_dir,
-                   'src_file'   : src_file
-                  })
-        Helper.run_command_on_local(scp_cmd)
+        code = Helper.__copy_with_remote__(node, node.user, node.passwd,
+            r'''%(src_dir)s/%(src_file)s''' % {'src_dir' : src_dir, 'src_file' : src_file},
+            r'''%(dst_dir)s/%(src_file)s''' % {'dst_dir' : dst_dir, 'src_file' : src_file}, False)
         chmod_cmd = (r'''chmod -R %(mode)d %(dst_dir)s/%(src_file)s''' %
                     {'mode'     : mode,
                      'dst_dir'  : dst_dir,
                      'src_file' : src_file
                     })
         Helper.run_command_on_local(chmod_cmd)
+        return code
 
 
     @staticmethod
@@ -179,12 +304,7 @@ class Helper(object):
         """
         Run cmd on remote node.
         """
-        local_cmd = (r'''ssh -t -oStrictHostKeyChecking=no -o LogLevel=quiet %(hostname)s >> %(log)s 2>&1 "%(remote_cmd)s"''' %
-                   {'hostname'   : node.hostname,
-                    'log'        : node.log,
-                    'remote_cmd' : command
-                   })
-        Helper.run_command_on_local(local_cmd)
+        return Helper.__run_on_remote__(node, None, None, command)
 
 
     @staticmethod
@@ -193,23 +313,19 @@ class Helper(object):
         Copy file from local node to remote node,
         create directory if remote directory doesn't exist,
         change the file mode as well.
+        Return the exit code of the copy.
         """
         mkdir_cmd = (r'''mkdir -p %(dst_dir)s''' % {'dst_dir' : dst_dir})
         Helper.run_command_on_remote_with_key(node, mkdir_cmd)
-        scp_cmd = (r'''scp -oStrictHostKeyChecking=no -o LogLevel=quiet -r %(src_file)s %(hostname)s:%(dst_dir)s/%(dst_file)s >> %(log)s 2>&1''' %
-                  {'hostname'   : node.hostname,
-                   'log'        : node.log,
-                   'src_file'   : src_file,
-                   'dst_dir'    : dst_dir,
-                   'dst_file'   : dst_file
-                  })
-        Helper.run_command_on_local(scp_cmd)
+        code = Helper.__copy_with_remote__(node, None, None, src_file,
+            r'''%(dst_dir)s/%(dst_file)s''' % {'dst_dir' : dst_dir, 'dst_file' : dst_file}, True)
         chmod_cmd = (r'''chmod -R %(mode)d %(dst_dir)s/%(dst_file)s''' %
                     {'mode'     : mode,
                      'dst_dir'  : dst_dir,
                      'dst_file' : dst_file
                     })
         Helper.run_command_on_remote_with_key(node, chmod_cmd)
+        return code
 
 
     @staticmethod
@@ -218,70 +334,100 @@ class Helper(object):
         Copy file from remote node to local node,
         create directory if local directory doesn't exist,
         change the file mode as well.
+        Return the exit code of the copy.
         """
         mkdir_cmd = (r'''mkdir -p %(dst_dir)s''' % {'dst_dir' : dst_dir})
         Helper.run_command_on_local(mkdir_cmd)
-        scp_cmd = (r'''scp -oStrictHostKeyChecking=no -o LogLevel=quiet %(hostname)s:%(src_dir)s/%(src_file)s %(dst_dir)s/%(src_file)s >> %(log)s 2>&1''' %
-                  {'hostname'   : node.hostname,
-                   'log'        : node.log,
-                   'src_dir'    : src_dir,
-                   'dst_dir'    : dst_dir,
-                   'src_file'   : src_file
-                  })
-        Helper.run_command_on_local(scp_cmd)
+        code = Helper.__copy_with_remote__(node, None, None,
+            r'''%(src_dir)s/%(src_file)s''' % {'src_dir' : src_dir, 'src_file' : src_file},
+            r'''%(dst_dir)s/%(src_file)s''' % {'dst_dir' : dst_dir, 'src_file' : src_file}, False)
         chmod_cmd = (r'''chmod -R %(mode)d %(dst_dir)s/%(src_file)s''' %
                     {'mode'     : mode,
                      'dst_dir'  : dst_dir,
                      'src_file' : src_file
                     })
         Helper.run_command_on_local(chmod_cmd)
+        return code
+
+
+    @staticmethod
+    def __get_template__(path):
+        """
+        Return the content of a template, each template file
+        is read from disk only once no matter how many nodes
+        are rendered from it.
+        """
+        with Helper.__template_lock:
+            if path not in Helper.__template_cache:
+                with open(path, "r") as template_file:
+                    Helper.__template_cache[path] = template_file.read()
+            return Helper.__template_cache[path]
+
+
+    @staticmethod
+    def __save_script__(node, script_path, script):
+        """
+        Keep a rendered script in memory for the upload and
+        leave a copy in the generated script dir for reference.
+        """
+        node.add_rendered_script(os.path.basename(script_path), script)
+        with open(script_path, "w") as script_file:
+            script_file.write(script)
+
+
+    @staticmethod
+    def generate_scripts(node):
+        if node.os == const.CENTOS:
+            Helper.generate_scripts_for_centos(node)
+        elif node.os == const.UBUNTU:
+            Helper.generate_scripts_for_ubuntu(node)
+        node.set_deploy_hash(Helper.get_deploy_hash(node))
 
 
     @staticmethod
     def generate_scripts_for_ubuntu(node):
         # generate bash script
-        with open((r'''%(setup_node_dir)s/%(deploy_mode)s/%(bash_template_dir)s/%(bash_template)s_%(os_version)s.sh''' %
-                  {'setup_node_dir'    : node.setup_node_dir,
-                   'deploy_mode'       : node.deploy_mode,
-                   'bash_template_dir' : const.BASH_TEMPLATE_DIR,
-                   'bash_template'     : const.UBUNTU,
-                   'os_version'        : node.os_version}), "r") as bash_template_file:
-            bash_template = bash_template_file.read()
-            is_controller = False
-            if node.role == const.ROLE_NEUTRON_SERVER:
-                is_controller = True
-            bash = (bash_template %
-                   {'install_ivs'         : str(node.install_ivs).lower(),
-                    'install_bsnstacklib' : str(node.install_bsnstacklib).lower(),
-                    'install_all'         : str(node.install_all).lower(),
-                    'deploy_dhcp_agent'   : str(node.deploy_dhcp_agent).lower(),
-                    'is_controller'       : str(is_controller).lower(),
-                    'deploy_horizon_patch': str(node.deploy_horizon_patch).lower(),
-                    'ivs_version'         : node.ivs_version,
-                    'bsnstacklib_version' : node.bsnstacklib_version,
-                    'dst_dir'             : node.dst_dir,
-                    'hostname'            : node.hostname,
-                    'ivs_pkg'             : node.ivs_pkg,
-                    'horizon_patch'       : node.horizon_patch,
-                    'horizon_patch_dir'   : node.horizon_patch_dir,
-                    'horizon_base_dir'    : node.horizon_base_dir,
-                    'ivs_debug_pkg'       : node.ivs_debug_pkg,
-                    'ovs_br'              : node.get_all_ovs_brs(),
-                    'bonds'               : node.get_all_bonds(),
-                    'br-int'              : const.BR_NAME_INT,
-                    'fuel_cluster_id'     : str(node.fuel_cluster_id),
-                    'interfaces'          : node.get_all_interfaces(),
-                    'br_fw_admin'         : node.br_fw_admin,
-                    'pxe_interface'       : node.pxe_interface,
-                    'br_fw_admin_address' : node.br_fw_admin_address,
-                    'br_fw_admin_gw'      : node.setup_node_ip,
-                    'uplinks'             : node.get_all_uplinks()})
+        bash_template = Helper.__get_template__(
+            (r'''%(setup_node_dir)s/%(deploy_mode)s/%(bash_template_dir)s/%(bash_template)s_%(os_version)s.sh''' %
+             {'setup_node_dir'    : node.setup_node_dir,
+              'deploy_mode'       : node.deploy_mode,
+              'bash_template_dir' : const.BASH_TEMPLATE_DIR,
+              'bash_template'     : const.UBUNTU,
+              'os_version'        : node.os_version}))
+        is_controller = False
+        if node.role == const.ROLE_NEUTRON_SERVER:
+            is_controller = True
+        bash = (bash_template %
+               {'install_ivs'         : str(node.install_ivs).lower(),
+                'install_bsnstacklib' : str(node.install_bsnstacklib).lower(),
+                'install_all'         : str(node.install_all).lower(),
+                'deploy_dhcp_agent'   : str(node.deploy_dhcp_agent).lower(),
+                'is_controller'       : str(is_controller).lower(),
+                'deploy_horizon_patch': str(node.deploy_horizon_patch).lower(),
+                'ivs_version'         : node.ivs_version,
+                'bsnstacklib_version' : node.bsnstacklib_version,
+                'dst_dir'             : node.dst_dir,
+                'hostname'            : node.hostname,
+                'ivs_pkg'             : node.ivs_pkg,
+                'horizon_patch'       : node.horizon_patch,
+                'horizon_patch_dir'   : node.horizon_patch_dir,
+                'horizon_base_dir'    : node.horizon_base_dir,
+                'ivs_debug_pkg'       : node.ivs_debug_pkg,
+                'ovs_br'              : node.get_all_ovs_brs(),
+                'bonds'               : node.get_all_bonds(),
+                'br-int'              : const.BR_NAME_INT,
+                'fuel_cluster_id'     : str(node.fuel_cluster_id),
+                'interfaces'          : node.get_all_interfaces(),
+                'br_fw_admin'         : node.br_fw_admin,
+                'pxe_interface'       : node.pxe_interface,
+                'br_fw_admin_address' : node.br_fw_admin_address,
+                'br_fw_admin_gw'      : node.setup_node_ip,
+                'uplinks'             : node.get_all_uplinks()})
         bash_script_path = (r'''%(setup_node_dir)s/%(generated_script_dir)s/%(hostname)s.sh''' %
                            {'setup_node_dir'       : node.setup_node_dir,
                             'generated_script_dir' : const.GENERATED_SCRIPT_DIR,
                             'hostname'             : node.hostname})
-        with open(bash_script_path, "w") as bash_file:
-            bash_file.write(bash)
+        Helper.__save_script__(node, bash_script_path, bash)
         node.set_bash_script_path(bash_script_path)
 
         # generate puppet script
@@ -289,27 +435,26 @@ class Helper(object):
                           {'inband_vlan'       : const.INBAND_VLAN,
                            'internal_ports'    : node.get_ivs_internal_ports(),
                            'uplink_interfaces' : node.get_uplink_intfs_for_ivs()})
-        with open((r'''%(setup_node_dir)s/%(deploy_mode)s/%(puppet_template_dir)s/%(puppet_template)s_%(role)s.pp''' %
-                  {'setup_node_dir'      : node.setup_node_dir,
-                   'deploy_mode'         : node.deploy_mode,
-                   'puppet_template_dir' : const.PUPPET_TEMPLATE_DIR,
-                   'puppet_template'     : const.UBUNTU,
-                   'role'                : node.role}), "r") as puppet_template_file:
-            puppet_template = puppet_template_file.read()
-            puppet = (puppet_template %
-                     {'ivs_daemon_args'       : ivs_daemon_args,
-                      'network_vlan_ranges'   : node.get_network_vlan_ranges(),
-                      'bcf_controllers'       : node.get_controllers_for_neutron(),
-                      'bcf_controller_user'   : node.bcf_controller_user,
-                      'bcf_controller_passwd' : node.bcf_controller_passwd,
-                      'port_ips'              : node.get_ivs_internal_port_ips(),
-                      'setup_node_ip'         : node.setup_node_ip})
+        puppet_template = Helper.__get_template__(
+            (r'''%(setup_node_dir)s/%(deploy_mode)s/%(puppet_template_dir)s/%(puppet_template)s_%(role)s.pp''' %
+             {'setup_node_dir'      : node.setup_node_dir,
+              'deploy_mode'         : node.deploy_mode,
+              'puppet_template_dir' : const.PUPPET_TEMPLATE_DIR,
+              'puppet_template'     : const.UBUNTU,
+              'role'                : node.role}))
+        puppet = (puppet_template %
+                 {'ivs_daemon_args'       : ivs_daemon_args,
+                  'network_vlan_ranges'   : node.get_network_vlan_ranges(),
+                  'bcf_controllers'       : node.get_controllers_for_neutron(),
+                  'bcf_controller_user'   : node.bcf_controller_user,
+                  'bcf_controller_passwd' : node.bcf_controller_passwd,
+                  'port_ips'              : node.get_ivs_internal_port_ips(),
+                  'setup_node_ip'         : node.setup_node_ip})
         puppet_script_path = (r'''%(setup_node_dir)s/%(generated_script_dir)s/%(hostname)s.pp''' %
                              {'setup_node_dir'       : node.setup_node_dir,
                               'generated_script_dir' : const.GENERATED_SCRIPT_DIR,
                               'hostname'             : node.hostname})
-        with open(puppet_script_path, "w") as puppet_file:
-            puppet_file.write(puppet)
+        Helper.__save_script__(node, puppet_script_path, puppet)
         node.set_puppet_script_path(puppet_script_path)
 
         # generate ospurge script
@@ -318,19 +463,18 @@ class Helper(object):
         openrc = const.MANUAL_OPENRC
         if node.fuel_cluster_id:
             openrc = const.FUEL_OPENRC
-        with open((r'''%(setup_node_dir)s/%(deploy_mode)s/%(ospurge_template_dir)s/%(ospurge_template)s.sh''' %
-                  {'setup_node_dir'       : node.setup_node_dir,
-                   'deploy_mode'          : node.deploy_mode,
-                   'ospurge_template_dir' : const.OSPURGE_TEMPLATE_DIR,
-                   'ospurge_template'     : "purge_all"}), "r") as ospurge_template_file:
-            ospurge_template = ospurge_template_file.read()
-            ospurge = (ospurge_template % {'openrc' : openrc})
+        ospurge_template = Helper.__get_template__(
+            (r'''%(setup_node_dir)s/%(deploy_mode)s/%(ospurge_template_dir)s/%(ospurge_template)s.sh''' %
+             {'setup_node_dir'       : node.setup_node_dir,
+              'deploy_mode'          : node.deploy_mode,
+              'ospurge_template_dir' : const.OSPURGE_TEMPLATE_DIR,
+              'ospurge_template'     : "purge_all"}))
+        ospurge = (ospurge_template % {'openrc' : openrc})
         ospurge_script_path = (r'''%(setup_node_dir)s/%(generated_script_dir)s/%(hostname)s_ospurge.sh''' %
                               {'setup_node_dir'       : node.setup_node_dir,
                                'generated_script_dir' : const.GENERATED_SCRIPT_DIR,
                                'hostname'             : node.hostname})
-        with open(ospurge_script_path, "w") as ospurge_file:
-            ospurge_file.write(ospurge)
+        Helper.__save_script__(node, ospurge_script_path, ospurge)
         node.set_ospurge_script_path(ospurge_script_path)
 
 
@@ -338,41 +482,40 @@ class Helper(object):
     def generate_scripts_for_centos(node):
 
         # generate bash script
-        with open((r'''%(setup_node_dir)s/%(deploy_mode)s/%(bash_template_dir)s/%(bash_template)s_%(os_version)s.sh''' %
-                  {'setup_node_dir'    : node.setup_node_dir,
-                   'deploy_mode'       : node.deploy_mode,
-                   'bash_template_dir' : const.BASH_TEMPLATE_DIR,
-                   'bash_template'     : const.CENTOS,
-                   'os_version'        : node.os_version}), "r") as bash_template_file:
-            bash_template = bash_template_file.read()
-            is_controller = False
-            if node.role == const.ROLE_NEUTRON_SERVER:
-                is_controller = True
-            bash = (bash_template %
-                   {'install_ivs'         : str(node.install_ivs).lower(),
-                    'install_bsnstacklib' : str(node.install_bsnstacklib).lower(),
-                    'install_all'         : str(node.install_all).lower(),
-                    'deploy_dhcp_agent'   : str(node.deploy_dhcp_agent).lower(),
-                    'is_controller'       : str(is_controller).lower(),
-                    'deploy_horizon_patch': str(node.deploy_horizon_patch).lower(),
-                    'ivs_version'         : node.ivs_version,
-                    'bsnstacklib_version' : node.bsnstacklib_version,
-                    'dst_dir'             : node.dst_dir,
-                    'hostname'            : node.hostname,
-                    'ivs_pkg'             : node.ivs_pkg,
-                    'horizon_patch'       : node.horizon_patch,
-                    'horizon_patch_dir'   : node.horizon_patch_dir,
-                    'horizon_base_dir'    : node.horizon_base_dir,
-                    'ivs_debug_pkg'       : node.ivs_debug_pkg,
-                    'ovs_br'              : node.get_all_ovs_brs(),
-                    'bonds'               : node.get_all_bonds(),
-                    'br-int'              : const.BR_NAME_INT})
+        bash_template = Helper.__get_template__(
+            (r'''%(setup_node_dir)s/%(deploy_mode)s/%(bash_template_dir)s/%(bash_template)s_%(os_version)s.sh''' %
+             {'setup_node_dir'    : node.setup_node_dir,
+              'deploy_mode'       : node.deploy_mode,
+              'bash_template_dir' : const.BASH_TEMPLATE_DIR,
+              'bash_template'     : const.CENTOS,
+              'os_version'        : node.os_version}))
+        is_controller = False
+        if node.role == const.ROLE_NEUTRON_SERVER:
+            is_controller = True
+        bash = (bash_template %
+               {'install_ivs'         : str(node.install_ivs).lower(),
+                'install_bsnstacklib' : str(node.install_bsnstacklib).lower(),
+                'install_all'         : str(node.install_all).lower(),
+                'deploy_dhcp_agent'   : str(node.deploy_dhcp_agent).lower(),
+                'is_controller'       : str(is_controller).lower(),
+                'deploy_horizon_patch': str(node.deploy_horizon_patch).lower(),
+                'ivs_version'         : node.ivs_version,
+                'bsnstacklib_version' : node.bsnstacklib_version,
+                'dst_dir'             : node.dst_dir,
+                'hostname'            : node.hostname,
+                'ivs_pkg'             : node.ivs_pkg,
+                'horizon_patch'       : node.horizon_patch,
+                'horizon_patch_dir'   : node.horizon_patch_dir,
+                'horizon_base_dir'    : node.horizon_base_dir,
+                'ivs_debug_pkg'       : node.ivs_debug_pkg,
+                'ovs_br'              : node.get_all_ovs_brs(),
+                'bonds'               : node.get_all_bonds(),
+                'br-int'              : const.BR_NAME_INT})
         bash_script_path = (r'''%(setup_node_dir)s/%(generated_script_dir)s/%(hostname)s.sh''' %
                            {'setup_node_dir'       : node.setup_node_dir,
                             'generated_script_dir' : const.GENERATED_SCRIPT_DIR,
                             'hostname'             : node.hostname})
-        with open(bash_script_path, "w") as bash_file:
-            bash_file.write(bash)
+        Helper.__save_script__(node, bash_script_path, bash)
         node.set_bash_script_path(bash_script_path)
 
         # generate puppet script
@@ -380,27 +523,26 @@ class Helper(object):
                           {'inband_vlan'       : const.INBAND_VLAN,
                            'internal_ports'    : node.get_ivs_internal_ports(),
                            'uplink_interfaces' : node.get_uplink_intfs_for_ivs()})
-        with open((r'''%(setup_node_dir)s/%(deploy_mode)s/%(puppet_template_dir)s/%(puppet_template)s_%(role)s.pp''' %
-                  {'setup_node_dir'      : node.setup_node_dir,
-                   'deploy_mode'         : node.deploy_mode,
-                   'puppet_template_dir' : const.PUPPET_TEMPLATE_DIR,
-                   'puppet_template'     : const.CENTOS,
-                   'role'                : node.role}), "r") as puppet_template_file:
-            puppet_template = puppet_template_file.read()
-            puppet = (puppet_template %
-                     {'ivs_daemon_args'       : ivs_daemon_args,
-                      'network_vlan_ranges'   : node.get_network_vlan_ranges(),
-                      'bcf_controllers'       : node.get_controllers_for_neutron(),
-                      'bcf_controller_user'   : node.bcf_controller_user,
-                      'bcf_controller_passwd' : node.bcf_controller_passwd,
-                      'selinux_mode'          : node.selinux_mode,
-                      'port_ips'              : node.get_ivs_internal_port_ips()})
+        puppet_template = Helper.__get_template__(
+            (r'''%(setup_node_dir)s/%(deploy_mode)s/%(puppet_template_dir)s/%(puppet_template)s_%(role)s.pp''' %
+             {'setup_node_dir'      : node.setup_node_dir,
+              'deploy_mode'         : node.deploy_mode,
+              'puppet_template_dir' : const.PUPPET_TEMPLATE_DIR,
+              'puppet_template'     : const.CENTOS,
+              'role'                : node.role}))
+        puppet = (puppet_template %
+                 {'ivs_daemon_args'       : ivs_daemon_args,
+                  'network_vlan_ranges'   : node.get_network_vlan_ranges(),
+                  'bcf_controllers'       : node.get_controllers_for_neutron(),
+                  'bcf_controller_user'   : node.bcf_controller_user,
+                  'bcf_controller_passwd' : node.bcf_controller_passwd,
+                  'selinux_mode'          : node.selinux_mode,
+                  'port_ips'              : node.get_ivs_internal_port_ips()})
         puppet_script_path = (r'''%(setup_node_dir)s/%(generated_script_dir)s/%(hostname)s.pp''' %
                              {'setup_node_dir'       : node.setup_node_dir,
                               'generated_script_dir' : const.GENERATED_SCRIPT_DIR,
                               'hostname'             : node.hostname})
-        with open(puppet_script_path, "w") as puppet_file:
-            puppet_file.write(puppet)
+        Helper.__save_script__(node, puppet_script_path, puppet)
         node.set_puppet_script_path(puppet_script_path)
 
         # generate selinux script
@@ -408,12 +550,13 @@ class Helper(object):
                               {'setup_node_dir'       : node.setup_node_dir,
                                'generated_script_dir' : const.GENERATED_SCRIPT_DIR,
                                'hostname'             : node.hostname})
-        subprocess.call(r'''cp %(setup_node_dir)s/%(deploy_mode)s/%(selinux_template_dir)s/%(selinux_template)s.te %(selinux_script_path)s''' %
-                       {'setup_node_dir'       : node.setup_node_dir,
-                        'deploy_mode'          : node.deploy_mode,
-                        'selinux_template_dir' : const.SELINUX_TEMPLATE_DIR,
-                        'selinux_template'     : const.CENTOS,
-                        'selinux_script_path'  : selinux_script_path}, shell=True)
+        selinux = Helper.__get_template__(
+            (r'''%(setup_node_dir)s/%(deploy_mode)s/%(selinux_template_dir)s/%(selinux_template)s.te''' %
+             {'setup_node_dir'       : node.setup_node_dir,
+              'deploy_mode'          : node.deploy_mode,
+              'selinux_template_dir' : const.SELINUX_TEMPLATE_DIR,
+              'selinux_template'     : const.CENTOS}))
+        Helper.__save_script__(node, selinux_script_path, selinux)
         node.set_selinux_script_path(selinux_script_path)
 
         # generate ospurge script
@@ -422,21 +565,53 @@ class Helper(object):
         openrc = const.PACKSTACK_OPENRC
         if node.fuel_cluster_id:
             openrc = const.FUEL_OPENRC
-        with open((r'''%(setup_node_dir)s/%(deploy_mode)s/%(ospurge_template_dir)s/%(ospurge_template)s.sh''' %
-                  {'setup_node_dir'       : node.setup_node_dir,
-                   'deploy_mode'          : node.deploy_mode,
-                   'ospurge_template_dir' : const.OSPURGE_TEMPLATE_DIR,
-                   'ospurge_template'     : "purge_all"}), "r") as ospurge_template_file:
-            ospurge_template = ospurge_template_file.read()
-            ospurge = (ospurge_template % {'openrc' : openrc})
+        ospurge_template = Helper.__get_template__(
+            (r'''%(setup_node_dir)s/%(deploy_mode)s/%(ospurge_template_dir)s/%(ospurge_template)s.sh''' %
+             {'setup_node_dir'       : node.setup_node_dir,
+              'deploy_mode'          : node.deploy_mode,
+              'ospurge_template_dir' : const.OSPURGE_TEMPLATE_DIR,
+              'ospurge_template'     : "purge_all"}))
+        ospurge = (ospurge_template % {'openrc' : openrc})
         ospurge_script_path = (r'''%(setup_node_dir)s/%(generated_script_dir)s/%(hostname)s_ospurge.sh''' %
                               {'setup_node_dir'       : node.setup_node_dir,
                                'generated_script_dir' : const.GENERATED_SCRIPT_DIR,
                                'hostname'             : node.hostname})
-        with open(ospurge_script_path, "w") as ospurge_file:
-            ospurge_file.write(ospurge)
+        Helper.__save_script__(node, ospurge_script_path, ospurge)
         node.set_ospurge_script_path(ospurge_script_path)
-        
+
+
+    @staticmethod
+    def get_deploy_hash(node):
+        """
+        Hash everything that determines what a node deployment
+        does: the generated scripts and the packages.
+        """
+        digest = hashlib.md5()
+        for file_name, script in sorted(node.rendered_scripts.iteritems()):
+            digest.update(file_name)
+            digest.update(script)
+        for pkg in (node.ivs_pkg, node.ivs_debug_pkg, node.horizon_patch):
+            path = os.path.join(node.setup_node_dir, pkg or '')
+            if pkg and os.path.isfile(path):
+                digest.update(pkg)
+                digest.update(Helper.get_local_md5(path))
+        digest.update(str(node.bsnstacklib_version))
+        return digest.hexdigest()
+
+
+    @staticmethod
+    def get_deploy_cmd(node):
+        """
+        Run the node's bash script and, if it succeeds,
+        record the deployment hash on the node.
+        """
+        return ("bash -c 'set -o pipefail; /bin/bash %(dst_dir)s/%(hostname)s.sh %(redirect)s && mkdir -p %(marker_dir)s && echo %(deploy_hash)s > %(marker)s'" %
+               {'dst_dir'     : node.dst_dir,
+                'hostname'    : node.hostname,
+                'redirect'    : Helper.get_output_redirect(node),
+                'marker_dir'  : const.DEPLOY_MARKER_DIR,
+                'deploy_hash' : node.deploy_hash,
+                'marker'      : const.DEPLOY_MARKER})
 
 
     @staticmethod
@@ -469,24 +644,49 @@ class Helper(object):
 
 
     @staticmethod
-    def load_nodes_from_yaml(node_yaml_config_map, env):
+    def load_nodes_from_yaml(node_yaml_config_map, env, selector):
         """
         Parse yaml file and return a dictionary
+        of the nodes selected by selector.
         """
         node_dic = {}
         if node_yaml_config_map == None:
             return node_dic
         for hostname, node_yaml_config in node_yaml_config_map.iteritems():
-            node_yaml_config = Helper.__load_node_yaml_config__(node_yaml_config, env)
+            Helper.__load_node_yaml_config__(node_yaml_config, env)
+        selected = selector.select(node_yaml_config_map)
+        Helper.safe_print("Selected %(selected)d of %(count)d nodes, %(selector)s\n" %
+                         {'selected' : len(selected),
+                          'count'    : len(node_yaml_config_map),
+                          'selector' : selector})
+        node_yaml_config_map = dict([(hostname, node_yaml_config_map[hostname])
+                                     for hostname in selected])
+
+        # get existing ivs version from all nodes concurrently
+        def probe(hostname):
+            node_yaml_config = node_yaml_config_map[hostname]
+            probe_cmd = (r'''ivs --version; echo %(sep)s; cat %(marker)s 2>/dev/null''' %
+                        {'sep'    : const.PROBE_SEPARATOR,
+                         'marker' : const.DEPLOY_MARKER})
+            with Tracer.span(hostname, const.PHASE_DISCOVERY):
+                return Helper.run_command_on_remote_with_passwd_without_timeout(
+                    node_yaml_config['hostname'],
+                    node_yaml_config['user'],
+                    node_yaml_config['passwd'],
+                    probe_cmd)
+        # offline, nodes are assumed to have no ivs yet
+        probe_results = {}
+        if not env.offline:
+            probe_results = Helper.run_concurrently(node_yaml_config_map.keys(), probe)
 
-            # get existing ivs version
+        for hostname, node_yaml_config in node_yaml_config_map.iteritems():
             node_yaml_config['old_ivs_version'] = None
-            output,errors = Helper.run_command_on_remote_with_passwd_without_timeout(
-                node_yaml_config['hostname'],
-                node_yaml_config['user'],
-                node_yaml_config['passwd'],
-                'ivs --version')
-            if errors or not output:
+            output, errors = probe_results.get(hostname, (None, None))
+            if output and const.PROBE_SEPARATOR in output:
+                output, deployed_hash = output.split(const.PROBE_SEPARATOR, 1)
+                node_yaml_config['deployed_hash'] = deployed_hash.strip() or None
+                output = output.strip()
+            if (errors or not output) and not env.offline:
                 node_yaml_config['skip'] = True
                 node_yaml_config['error'] = ("Fail to retrieve ivs version from %(hostname)s" %
                                             {'hostname' : node_yaml_config['hostname']})
@@ -526,7 +726,111 @@ class Helper(object):
 
 
     @staticmethod
-    def __load_fuel_node__(hostname, role, node_yaml_config, env):
+    def __load_fuel_node_list__(fuel_cluster_id):
+        Helper.safe_print("Retrieving list of Fuel nodes\n")
+        cmd = (r'''fuel nodes --env %(fuel_cluster_id)s''' %
+              {'fuel_cluster_id' : str(fuel_cluster_id)})
+        node_list, errors = Helper.run_command_on_local_without_timeout(cmd)
+        if errors and 'DEPRECATION WARNING' not in errors:
+            raise Exception("Error Loading node list %(fuel_cluster_id)s:\n%(errors)s\n"
+                            % {'fuel_cluster_id' : fuel_cluster_id,
+                               'errors'          : errors})
+        return node_list
+
+
+    @staticmethod
+    def __load_fuel_cache__(env):
+        """
+        Return the cached fuel inventory of the cluster, an empty
+        dictionary if there is none or it is older than the ttl.
+        Offline, the cache is used however old it is. Online, the
+        caller still checks the cached node list against fuel's
+        and the nodes' astute.yaml against the cached ones.
+        """
+        path = os.path.join(env.setup_node_dir, const.FUEL_CACHE_FILE)
+        if not os.path.isfile(path):
+            return {}
+        if not env.fuel_cache_ttl and not env.offline:
+            return {}
+        try:
+            with open(path, "r") as cache_file:
+                cache = json.load(cache_file).get(str(env.fuel_cluster_id), {})
+        except ValueError:
+            return {}
+        if not env.offline and time.time() - cache.get('time', 0) > env.fuel_cache_ttl:
+            return {}
+        return cache
+
+
+    @staticmethod
+    def __save_fuel_cache__(env, cache):
+        if not env.fuel_cache_ttl:
+            return
+        path = os.path.join(env.setup_node_dir, const.FUEL_CACHE_FILE)
+        caches = {}
+        try:
+            with open(path, "r") as cache_file:
+                caches = json.load(cache_file)
+        except (IOError, ValueError):
+            pass
+        caches[str(env.fuel_cluster_id)] = cache
+        # fuel settings hold passwords
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as cache_file:
+            json.dump(caches, cache_file)
+
+
+    @staticmethod
+    def __probe_fuel_node_offline__(hostname, cached):
+        """
+        Probe result of a fuel node made up from the cache,
+        without ivs and deployment marker.
+        """
+        if not cached:
+            return None, "No cached probe of %(hostname)s" % {'hostname' : hostname}, None
+        output = const.PROBE_SEPARATOR.join([cached['os_info'], cached['astute'],
+                                             'ivs: command not found', ''])
+        return output, None, cached
+
+
+    @staticmethod
+    def __probe_fuel_node__(hostname, cached=None):
+        """
+        Collect operating system, /etc/astute.yaml, ivs version and
+        deployment marker of a fuel node in one remote call.
+        If the node's astute.yaml md5 matches the cached one, only
+        ivs version and marker are read and the operating system
+        and astute.yaml come from the cache.
+        Return the probe output, errors and what to cache.
+        """
+        with Tracer.span(hostname, const.PHASE_DISCOVERY):
+            if cached:
+                probe_cmd = (r'''md5sum /etc/astute.yaml; echo %(sep)s; ivs --version; echo %(sep)s; cat %(marker)s 2>/dev/null''' %
+                            {'sep'    : const.PROBE_SEPARATOR,
+                             'marker' : const.DEPLOY_MARKER})
+                output, errors = Helper.run_command_on_remote_with_key_without_timeout(hostname, probe_cmd)
+                sections = [section.strip() for section in (output or '').split(const.PROBE_SEPARATOR)]
+                if (not errors and len(sections) == 3 and sections[0]
+                    and sections[0].split()[0] == cached['md5']):
+                    output = const.PROBE_SEPARATOR.join([cached['os_info'], cached['astute'],
+                                                         sections[1], sections[2]])
+                    return output, errors, cached
+
+            probe_cmd = (r'''md5sum /etc/astute.yaml; echo %(sep)s; python -mplatform; echo %(sep)s; cat /etc/astute.yaml; echo %(sep)s; ivs --version; echo %(sep)s; cat %(marker)s 2>/dev/null''' %
+                        {'sep'    : const.PROBE_SEPARATOR,
+                         'marker' : const.DEPLOY_MARKER})
+            output, errors = Helper.run_command_on_remote_with_key_without_timeout(hostname, probe_cmd)
+        sections = [section.strip() for section in (output or '').split(const.PROBE_SEPARATOR)]
+        if errors or len(sections) != 5 or not sections[0]:
+            return output, errors, None
+        node_cache = {'md5'     : sections[0].split()[0],
+                      'os_info' : sections[1],
+                      'astute'  : sections[2]}
+        return const.PROBE_SEPARATOR.join(sections[1:]), errors, node_cache
+
+
+    @staticmethod
+    def __load_fuel_node__(hostname, role, node_yaml_config, env, probe_result):
         node_config = {}
         if node_yaml_config:
             node_config = Helper.__load_node_yaml_config__(node_yaml_config, env)
@@ -535,10 +839,23 @@ class Helper(object):
         node_config['hostname'] = hostname
         node_config['role'] = role
 
+        # split the probe output into operating system information,
+        # /etc/astute.yaml and ivs version
+        output, errors = probe_result
+        if errors or (not output):
+            Helper.safe_print("Error probing node %(hostname)s:\n%(errors)s\n"
+                              % {'hostname' : node_config['hostname'], 'errors' : errors})
+            return None
+        sections = [section.strip() for section in output.split(const.PROBE_SEPARATOR)]
+        if len(sections) != 4:
+            Helper.safe_print("Error parsing probe output of node %(hostname)s:\n%(output)s\n"
+                              % {'hostname' : node_config['hostname'], 'output' : output})
+            return None
+        os_info, node_yaml, output, deployed_hash = sections
+        node_config['deployed_hash'] = deployed_hash or None
+
         # get node operating system information
-        os_info, errors = Helper.run_command_on_remote_with_key_without_timeout(node_config['hostname'],
-            'python -mplatform')
-        if errors or (not os_info):
+        if not os_info:
             Helper.safe_print("Error retrieving operating system info from node %(hostname)s:\n%(errors)s\n"
                               % {'hostname' : node_config['hostname'], 'errors' : errors})
             return None
@@ -552,9 +869,7 @@ class Helper(object):
             return None
 
         # get node /etc/astute.yaml
-        node_yaml, errors = Helper.run_command_on_remote_with_key_without_timeout(node_config['hostname'],
-            'cat /etc/astute.yaml')
-        if errors or not node_yaml:
+        if not node_yaml:
             Helper.safe_print("Error retrieving config for node %(hostname)s:\n%(errors)s\n"
                               % {'hostname' : node_config['hostname'], 'errors' : errors})
             return None
@@ -567,9 +882,7 @@ class Helper(object):
 
         # get existing ivs version
         node_config['old_ivs_version'] = None
-        output, errors = Helper.run_command_on_remote_with_key_without_timeout(node_config['hostname'],
-            'ivs --version')
-        if errors or not output:
+        if not output:
             Helper.safe_print("Error retrieving ivs version from node %(hostname)s:\n%(errors)s\n"
                               % {'hostname' : node_config['hostname'], 'errors' : errors})
             return None
@@ -680,30 +993,96 @@ class Helper(object):
 
 
     @staticmethod
-    def load_nodes_from_fuel(node_yaml_config_map, env):
-        fuel_settings = Helper.__load_fuel_evn_setting__(env.fuel_cluster_id)
-        Helper.safe_print("Retrieving list of Fuel nodes\n")
-        cmd = (r'''fuel nodes --env %(fuel_cluster_id)s''' %
-              {'fuel_cluster_id' : str(env.fuel_cluster_id)})
-        node_list, errors = Helper.run_command_on_local_without_timeout(cmd)
-        if errors and 'DEPRECATION WARNING' not in errors:
-            raise Exception("Error Loading node list %(fuel_cluster_id)s:\n%(errors)s\n"
-                            % {'fuel_cluster_id' : env.fuel_cluster_id,
-                               'errors'          : errors})
+    def load_nodes_from_fuel(node_yaml_config_map, env, selector):
+        cache = Helper.__load_fuel_cache__(env)
+        if env.offline and not cache:
+            raise Exception("No cached Fuel inventory of cluster %(fuel_cluster_id)s, run bosi with -f once first\n"
+                            % {'fuel_cluster_id' : env.fuel_cluster_id})
+        # the node list is cheap to get and tells whether nodes were
+        # added or changed since the cache was written
+        if env.offline:
+            node_list = cache['node_list']
+        else:
+            node_list = Helper.__load_fuel_node_list__(env.fuel_cluster_id)
+            if cache and cache.get('node_list') != node_list:
+                Helper.safe_print("Fuel node list changed since it was cached, reload Fuel settings\n")
+                cache = {}
+        settings_cached = bool(cache)
+        if settings_cached:
+            Helper.safe_print("Using Fuel settings cached %(age)ds ago\n" %
+                             {'age' : time.time() - cache['time']})
+            fuel_settings = cache['settings']
+        else:
+            cache = {'time' : time.time()}
+            fuel_settings = Helper.__load_fuel_evn_setting__(env.fuel_cluster_id)
+        cached_nodes = cache.get('nodes', {})
 
         node_dic = {}
         membership_rules = {}
         try:
             lines = [l for l in node_list.splitlines()
                      if '----' not in l and 'pending_roles' not in l]
+            hostname_roles = []
+            inventory = {}
             for line in lines:
                 hostname = str(netaddr.IPAddress(line.split('|')[4].strip()))
                 role = str(line.split('|')[6].strip())
+                hostname_roles.append((hostname, role))
+                node_yaml_config = node_yaml_config_map.get(hostname) or {}
+                inventory[hostname] = {'tag'  : node_yaml_config.get('tag'),
+                                       'role' : role,
+                                       'os'   : None,
+                                       'name' : line.split('|')[2].strip()}
+
+            # only probe the selected nodes, their os is not known yet
+            selected = selector.select(inventory)
+            Helper.safe_print("Selected %(selected)d of %(count)d Fuel nodes, %(selector)s\n" %
+                             {'selected' : len(selected),
+                              'count'    : len(hostname_roles),
+                              'selector' : selector})
+            hostname_roles = [(hostname, role) for hostname, role in hostname_roles
+                              if hostname in selected]
+
+            # probe all nodes concurrently
+            Helper.safe_print("Probing %(count)d Fuel nodes\n" %
+                             {'count' : len(hostname_roles)})
+            probe = Helper.__probe_fuel_node__
+            if env.offline:
+                probe = Helper.__probe_fuel_node_offline__
+            probe_results = Helper.run_concurrently(
+                [hostname for hostname, role in hostname_roles],
+                lambda hostname: probe(hostname, cached_nodes.get(hostname)))
+            if not env.offline:
+                # fuel writes its settings into astute.yaml of the nodes,
+                # a changed or unknown astute.yaml means they may be stale
+                changed = [hostname for hostname, result in probe_results.iteritems()
+                           if result[2] and (hostname not in cached_nodes
+                                             or cached_nodes[hostname]['md5'] != result[2]['md5'])]
+                if settings_cached and changed:
+                    Helper.safe_print("astute.yaml of %(count)d Fuel nodes changed since it was cached, "
+                                      "reload Fuel settings\n" % {'count' : len(changed)})
+                    cache['time'] = time.time()
+                    fuel_settings = Helper.__load_fuel_evn_setting__(env.fuel_cluster_id)
+                # keep cached nodes which were not selected this time
+                cached_nodes.update([(hostname, result[2])
+                                     for hostname, result in probe_results.iteritems()
+                                     if result[2]])
+                Helper.__save_fuel_cache__(env,
+                    {'time'      : cache['time'],
+                     'settings'  : fuel_settings,
+                     'node_list' : node_list,
+                     'nodes'     : cached_nodes})
+
+            for hostname, role in hostname_roles:
                 node_yaml_config = None
                 node_yaml_config = node_yaml_config_map.get(hostname)
-                node = Helper.__load_fuel_node__(hostname, role, node_yaml_config, env)
+                output, errors, node_cache = probe_results.get(hostname, (None, None, None))
+                node = Helper.__load_fuel_node__(hostname, role, node_yaml_config, env,
+                                                 (output, errors))
                 if (not node) or (not node.hostname):
                     continue
+                if not selector.matches_os(node.os):
+                    continue
                 node_dic[node.hostname] = node
                 
                 # get node bridges
@@ -721,48 +1100,146 @@ class Helper(object):
 
 
     @staticmethod
-    def load_nodes(nodes_yaml_config, env):
+    def get_node_yaml_config_map(nodes_yaml_config):
         node_yaml_config_map = {}
         if nodes_yaml_config != None:
             for node_yaml_config in nodes_yaml_config:
-                # we always use ip address as the hostname
+                # we always use ip address as the hostname,
+                # the configured name is kept for node selection
+                node_yaml_config.setdefault('name', node_yaml_config['hostname'])
                 node_yaml_config['hostname'] = socket.gethostbyname(node_yaml_config['hostname'])
                 node_yaml_config_map[node_yaml_config['hostname']] = node_yaml_config
+        return node_yaml_config_map
+
+
+    @staticmethod
+    def load_nodes(nodes_yaml_config, env, selector):
+        node_yaml_config_map = Helper.get_node_yaml_config_map(nodes_yaml_config)
         if env.fuel_cluster_id == None:
-            return Helper.load_nodes_from_yaml(node_yaml_config_map, env)
+            return Helper.load_nodes_from_yaml(node_yaml_config_map, env, selector)
         else:
-            node_dic, membership_rules = Helper.load_nodes_from_fuel(node_yaml_config_map, env)
+            node_dic, membership_rules = Helper.load_nodes_from_fuel(node_yaml_config_map, env, selector)
             # program membership rules to controller
-            for br_key, rule in membership_rules.iteritems():
-                RestLib.program_segment_and_membership_rule(env.bcf_master, env.bcf_cookie, rule,
-                                                            env.bcf_openstack_management_tenant)
+            Helper.program_membership_rules(env, membership_rules.values())
             return node_dic
 
 
     @staticmethod
-    def common_setup_node_preparation(env):
-        # clean up from previous installation
+    def get_membership_rules_hash(rules):
+        digest = hashlib.md5()
+        digest.update(json.dumps(sorted([(rule.br_key,
+                                          sorted(rule.get_switch_port_rules()),
+                                          sorted(rule.get_port_group_rules()))
+                                         for rule in rules])))
+        return digest.hexdigest()
+
+
+    @staticmethod
+    def __load_bcf_hashes__(path):
+        if not os.path.isfile(path):
+            return {}
+        try:
+            with open(path, "r") as hash_file:
+                return json.load(hash_file)
+        except ValueError:
+            return {}
+
+
+    @staticmethod
+    def __get_bcf_config_hash__(env, tenant):
+        """
+        Return the controller's config hash of tenant, None if
+        it cannot be read, so that rules are programmed in full.
+        """
+        try:
+            return RestLib.get_config_hash(env.bcf_master, env.bcf_cookie, tenant)
+        except Exception as e:
+            LogSink.write("Failed to read BCF config hash of %(tenant)s: %(e)s\n" %
+                          {'tenant' : tenant, 'e' : e})
+            return None
+
+
+    @staticmethod
+    def program_membership_rules(env, rules):
+        """
+        Program segments and membership rules to the bcf controller.
+        Skip it if neither the rules nor the controller's config hash
+        of the tenant changed since the last run which programmed them.
+        """
+        tenant = env.bcf_openstack_management_tenant
+        hash_path = os.path.join(env.setup_node_dir, const.BCF_HASH_FILE)
+        hashes = Helper.__load_bcf_hashes__(hash_path)
+        rules_hash = Helper.get_membership_rules_hash(rules)
+        config_hash = Helper.__get_bcf_config_hash__(env, tenant)
+        if config_hash and hashes.get(tenant) == {'config_hash' : config_hash,
+                                                  'rules_hash'  : rules_hash}:
+            Helper.safe_print("BCF controller: membership rules of %(tenant)s unchanged, skip programming\n" %
+                             {'tenant' : tenant})
+            return
+
+        if env.reconcile_membership_rules:
+            changes = RestLib.reconcile_membership_rules(env.bcf_master, env.bcf_cookie,
+                                                         rules, tenant)
+            for change in changes:
+                Helper.safe_print("BCF controller: %(change)s\n" % {'change' : change})
+            Helper.safe_print("BCF controller: %(changes)d membership changes, %(segments)d segments checked\n" %
+                             {'changes'  : len(changes),
+                              'segments' : len(rules)})
+        else:
+            RestLib.program_membership_rules(env.bcf_master, env.bcf_cookie,
+                                             rules, tenant)
+
+        # remember the hash which includes our own writes
+        config_hash = Helper.__get_bcf_config_hash__(env, tenant)
+        if not config_hash:
+            return
+        hashes[tenant] = {'config_hash' : config_hash, 'rules_hash' : rules_hash}
+        with open(hash_path, "w") as hash_file:
+            json.dump(hashes, hash_file)
+
+
+    @staticmethod
+    def common_setup_node_preparation(env, resume=False):
+        """
+        Clean up from previous installation. A resumed run keeps
+        the log, the downloaded packages and the generated scripts
+        of the interrupted run.
+        """
         setup_node_dir = os.getcwd()
         subprocess.call("rm -rf ~/.ssh/known_hosts", shell=True)
-        subprocess.call("rm -rf %(log)s" %
-                       {'log' : const.LOG_FILE}, shell=True)
-        subprocess.call("rm -rf %(setup_node_dir)s/*ivs*.rpm" %
-                       {'setup_node_dir' : setup_node_dir}, shell=True)
-        subprocess.call("rm -rf %(setup_node_dir)s/*ivs*.deb" %
-                       {'setup_node_dir' : setup_node_dir}, shell=True)
-        subprocess.call("rm -rf %(setup_node_dir)s/*.tar.gz" %
-                       {'setup_node_dir' : setup_node_dir}, shell=True)
+        if not resume:
+            subprocess.call("rm -rf %(log)s" %
+                           {'log' : const.LOG_FILE}, shell=True)
+            subprocess.call("rm -rf %(setup_node_dir)s/*ivs*.rpm" %
+                           {'setup_node_dir' : setup_node_dir}, shell=True)
+            subprocess.call("rm -rf %(setup_node_dir)s/*ivs*.deb" %
+                           {'setup_node_dir' : setup_node_dir}, shell=True)
+            subprocess.call("rm -rf %(setup_node_dir)s/*.tar.gz" %
+                           {'setup_node_dir' : setup_node_dir}, shell=True)
         subprocess.call("mkdir -p %(setup_node_dir)s/%(generated_script)s" %
                        {'setup_node_dir'   : setup_node_dir,
                         'generated_script' : const.GENERATED_SCRIPT_DIR}, shell=True)
-        subprocess.call("rm -rf %(setup_node_dir)s/%(generated_script)s/*" %
-                       {'setup_node_dir'   : setup_node_dir,
-                        'generated_script' : const.GENERATED_SCRIPT_DIR}, shell=True)
+        if not resume:
+            subprocess.call("rm -rf %(setup_node_dir)s/%(generated_script)s/*" %
+                           {'setup_node_dir'   : setup_node_dir,
+                            'generated_script' : const.GENERATED_SCRIPT_DIR}, shell=True)
+
+
+    @staticmethod
+    def download_packages(env, resume=False):
+        """
+        Download ivs packages and the horizon patch,
+        a resumed run keeps the packages it already has.
+        """
+        setup_node_dir = os.getcwd()
 
         # wget ivs packages
         code_web = 1
         code_local = 1
         for pkg_type, url in env.ivs_url_map.iteritems():
+            if resume and os.path.isfile(os.path.join(setup_node_dir, os.path.basename(url))):
+                code_web = 0
+                continue
             if 'http://' in url or 'https://' in url:
                 code_web = subprocess.call("wget --no-check-certificate %(url)s -P %(setup_node_dir)s" %
                                           {'url' : url, 'setup_node_dir' : setup_node_dir},
@@ -781,7 +1258,9 @@ class Helper(object):
         code_web = 1
         code_local = 1
         url = env.horizon_patch_url
-        if 'http://' in url or 'https://' in url:
+        if resume and os.path.isfile(os.path.join(setup_node_dir, os.path.basename(url))):
+            code_web = 0
+        elif 'http://' in url or 'https://' in url:
             code_web = subprocess.call("wget --no-check-certificate %(url)s -P %(setup_node_dir)s" %
                                           {'url' : url, 'setup_node_dir' : setup_node_dir},
                                            shell=True)
@@ -797,105 +1276,354 @@ class Helper(object):
     @staticmethod
     def run_command_on_remote(node, command):
         if node.fuel_cluster_id:
-            Helper.run_command_on_remote_with_key(node, command)
-        else:
-            Helper.run_command_on_remote_with_passwd(node, command)
+            return Helper.run_command_on_remote_with_key(node, command)
+        return Helper.run_command_on_remote_with_passwd(node, command)
 
 
     @staticmethod
     def copy_file_from_remote(node, src_dir, src_file, dst_dir, mode=777):
         if node.fuel_cluster_id:
-            Helper.copy_file_from_remote_with_key(node, src_dir, src_file, dst_dir, mode)
-        else:
-            Helper.copy_file_from_remote_with_passwd(node, src_dir, src_file, dst_dir, mode)
+            return Helper.copy_file_from_remote_with_key(node, src_dir, src_file, dst_dir, mode)
+        return Helper.copy_file_from_remote_with_passwd(node, src_dir, src_file, dst_dir, mode)
 
 
     @staticmethod
     def copy_file_to_remote(node, src_file, dst_dir, dst_file, mode=777):
         if node.fuel_cluster_id:
-            Helper.copy_file_to_remote_with_key(node, src_file, dst_dir, dst_file, mode)
-        else:
-            Helper.copy_file_to_remote_with_passwd(node, src_file, dst_dir, dst_file, mode)
+            return Helper.copy_file_to_remote_with_key(node, src_file, dst_dir, dst_file, mode)
+        return Helper.copy_file_to_remote_with_passwd(node, src_file, dst_dir, dst_file, mode)
 
 
     @staticmethod
-    def copy_pkg_scripts_to_remote(node):
-        # copy ivs to node
+    def get_pkg_scripts_for_remote(node):
+        """
+        Return the (src_dir, file_name) of every artifact
+        the node needs, each lands in node.dst_dir under
+        the same file name. src_dir is None for scripts,
+        which are sent from node.rendered_scripts.
+        """
+        artifacts = []
+
+        # ivs packages
         if node.deploy_mode == const.T6:
-            Helper.safe_print("Copy %(ivs_pkg)s to %(hostname)s\n" %
-                              {'ivs_pkg'  : node.ivs_pkg,
-                               'hostname' : node.hostname})
-            Helper.copy_file_to_remote(node,
-                (r'''%(src_dir)s/%(ivs_pkg)s''' %
-                {'src_dir' : node.setup_node_dir,
-                 'ivs_pkg' : node.ivs_pkg}),
-                node.dst_dir,
-                node.ivs_pkg)
+            artifacts.append((node.setup_node_dir, node.ivs_pkg))
             if node.ivs_debug_pkg != None:
-                Helper.safe_print("Copy %(ivs_debug_pkg)s to %(hostname)s\n" %
-                                 {'ivs_debug_pkg'  : node.ivs_debug_pkg,
-                                  'hostname'       : node.hostname})
-                Helper.copy_file_to_remote(node,
-                    (r'''%(src_dir)s/%(ivs_debug_pkg)s''' %
-                    {'src_dir'       : node.setup_node_dir,
-                     'ivs_debug_pkg' : node.ivs_debug_pkg}),
-                    node.dst_dir,
-                    node.ivs_debug_pkg)
-
-        # copy bash script to node
-        Helper.safe_print("Copy bash script to %(hostname)s\n" %
-                         {'hostname' : node.hostname})
-        Helper.copy_file_to_remote(node,
-           node.bash_script_path,
-           node.dst_dir,
-           "%(hostname)s.sh" % {'hostname' : node.hostname})
-
-        # copy puppet script to node
-        Helper.safe_print("Copy puppet script to %(hostname)s\n" %
-                         {'hostname' : node.hostname})
-        Helper.copy_file_to_remote(node,
-           node.puppet_script_path,
-           node.dst_dir,
-           "%(hostname)s.pp" % {'hostname' : node.hostname})
-
-        # copy selinux script to node
+                artifacts.append((node.setup_node_dir, node.ivs_debug_pkg))
+
+        # bash and puppet scripts
+        artifacts.append((None, os.path.basename(node.bash_script_path)))
+        artifacts.append((None, os.path.basename(node.puppet_script_path)))
+
+        # selinux script
         if node.os in const.RPM_OS_SET:
-            Helper.safe_print("Copy bsn selinux policy to %(hostname)s\n" %
-                             {'hostname' : node.hostname})
-            Helper.copy_file_to_remote(node,
-               node.selinux_script_path,
-               node.dst_dir,
-               "%(hostname)s.te" % {'hostname' : node.hostname})
-
-        # copy ospurge script to node
+            artifacts.append((None, os.path.basename(node.selinux_script_path)))
+
+        # ospurge script
         if node.role == const.ROLE_NEUTRON_SERVER:
-            Helper.safe_print("Copy ospurge script to %(hostname)s\n" %
-                             {'hostname' : node.hostname})
-            Helper.copy_file_to_remote(node,
-               node.ospurge_script_path,
-               node.dst_dir,
-               "%(hostname)s_ospurge.sh" % {'hostname' : node.hostname})
-
-        # copy horizon patch to node
+            artifacts.append((None, os.path.basename(node.ospurge_script_path)))
+
+        # horizon patch
         if node.role == const.ROLE_NEUTRON_SERVER and node.deploy_horizon_patch:
-            Helper.safe_print("Copy horizon patch to %(hostname)s\n" %
-                             {'hostname' : node.hostname})
-            Helper.copy_file_to_remote(node,
-                (r'''%(src_dir)s/%(horizon_patch)s''' %
-                {'src_dir' : node.setup_node_dir,
-                 'horizon_patch' : node.horizon_patch}),
-                node.dst_dir,
-                node.horizon_patch)
-
-        # copy rootwrap to remote
+            artifacts.append((node.setup_node_dir, node.horizon_patch))
+
+        # rootwrap
+        if node.fuel_cluster_id:
+            artifacts.append((node.setup_node_dir, "rootwrap"))
+        return artifacts
+
+
+    @staticmethod
+    def copy_bundle_to_remote(node, artifacts, mode=777):
+        """
+        Pack all artifacts into one tar stream, send it over
+        a single ssh connection and unpack it into node.dst_dir.
+        Return the exit code, the number of bytes sent and
+        the elapsed seconds.
+        """
+        file_names = []
+        for src_dir, file_name in artifacts:
+            if src_dir is None and file_name in node.rendered_scripts:
+                file_names.append(file_name)
+                continue
+            if src_dir is None or not os.path.exists(os.path.join(src_dir, file_name)):
+                Helper.safe_print("%(file_name)s not found, skip copying it to %(hostname)s\n" %
+                                 {'file_name' : file_name, 'hostname' : node.hostname})
+                continue
+            file_names.append(file_name)
+        if not file_names:
+            return 0, 0, 0
+
+        # tar reads the stream without sudo, a non-root user unpacks
+        # into a staging dir of its own and the files are moved to
+        # dst_dir with sudo, which may hold root-owned files
+        user, passwd = Helper.get_login(node)
+        install_cmd = (r'''mkdir -p %(dst_dir)s && tar -xf - -C %(dst_dir)s && cd %(dst_dir)s && chmod -R %(mode)d %(file_names)s''' %
+                      {'dst_dir'    : node.dst_dir,
+                       'mode'       : mode,
+                       'file_names' : ' '.join(file_names)})
+        remote_cmd = install_cmd
+        staging_dir = None
+        if user and user != 'root':
+            staging_dir = os.path.join(node.dst_dir, const.BUNDLE_STAGING_DIR % {'user' : user})
+            remote_cmd = (r'''rm -rf %(staging_dir)s && mkdir -p %(staging_dir)s && tar -xf - -C %(staging_dir)s''' %
+                         {'staging_dir' : staging_dir})
+            install_cmd = ("bash -c 'mkdir -p %(dst_dir)s && cd %(staging_dir)s && mv -f %(file_names)s %(dst_dir)s && cd %(dst_dir)s && chmod -R %(mode)d %(file_names)s && rm -rf %(staging_dir)s'" %
+                          {'dst_dir'     : node.dst_dir,
+                           'staging_dir' : staging_dir,
+                           'mode'        : mode,
+                           'file_names'  : ' '.join(file_names)})
+        streams = []
+        def write_bundle(stdin):
+            stream = CountingWriter(stdin)
+            streams.append(stream)
+            try:
+                with tarfile.open(fileobj=stream, mode='w|') as bundle:
+                    for src_dir, file_name in artifacts:
+                        if file_name not in file_names:
+                            continue
+                        if src_dir is None:
+                            script = node.rendered_scripts[file_name]
+                            info = tarfile.TarInfo(file_name)
+                            info.size = len(script)
+                            info.mtime = time.time()
+                            bundle.addfile(info, StringIO.StringIO(script))
+                        else:
+                            bundle.add(os.path.join(src_dir, file_name), arcname=file_name)
+            except (IOError, OSError) as e:
+                Helper.safe_print("Error streaming bundle to %(hostname)s: %(e)s\n" %
+                                 {'hostname' : node.hostname, 'e' : e})
+
+        start = time.time()
+        try:
+            code, output, errors = Transport.get().run(
+                node.hostname, user, passwd, remote_cmd,
+                timeout=const.BUNDLE_COPY_TIMEOUT, log=node.log,
+                stdin_func=write_bundle, sudo=False)
+            if code == 0 and staging_dir:
+                code = Helper.run_command_on_remote(node, install_cmd)
+        except TransportCancelled as e:
+            Helper.__cancelled__(e)
+            code = -1
+        except TransportTimeout:
+            RunStats.increment(const.STAT_TIMEOUTS)
+            code = -1
+        elapsed = time.time() - start
+        bytes_written = sum([stream.bytes_written for stream in streams])
+        RunStats.increment(const.STAT_BYTES_SENT, bytes_written)
+        if code != 0:
+            Helper.safe_print("Failed to copy bundle to %(hostname)s, exit code %(code)s\n" %
+                             {'hostname' : node.hostname, 'code' : code})
+        return code, bytes_written, elapsed
+
+
+    @staticmethod
+    def get_local_md5(path):
+        """
+        Return the md5 of a local file, computed once per run
+        unless the file changes.
+        """
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime)
+        with Helper.__md5_lock:
+            if key in Helper.__md5_cache:
+                return Helper.__md5_cache[key]
+        md5 = hashlib.md5()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                md5.update(chunk)
+        with Helper.__md5_lock:
+            Helper.__md5_cache[key] = md5.hexdigest()
+        return md5.hexdigest()
+
+
+    @staticmethod
+    def get_remote_md5s(node, file_names):
+        """
+        Checksum file_names under node.dst_dir in one remote call,
+        return a dictionary from file name to md5.
+        Missing files are not in the dictionary.
+        """
+        remote_cmd = (r'''md5sum %(files)s''' %
+                     {'files' : ' '.join(["%s/%s" % (node.dst_dir, f) for f in file_names])})
         if node.fuel_cluster_id:
-            Helper.safe_print("Copy rootwrap to %(hostname)s\n" %
-                             {'hostname' : node.hostname})
-            Helper.copy_file_to_remote(node,
-                (r'''%(src_dir)s/rootwrap''' %
-                {'src_dir' : node.setup_node_dir}),
-                node.dst_dir,
-                "rootwrap")
+            output, errors = Helper.run_command_on_remote_with_key_without_timeout(
+                node.hostname, remote_cmd)
+        else:
+            output, errors = Helper.run_command_on_remote_with_passwd_without_timeout(
+                node.hostname, node.user, node.passwd, remote_cmd)
+        md5s = {}
+        md5_pattern = re.compile(const.MD5SUM_EXPRESSION)
+        for line in (output or '').splitlines():
+            match = md5_pattern.match(line.strip())
+            if match:
+                md5s[os.path.basename(match.group(2))] = match.group(1)
+        return md5s
+
+
+    @staticmethod
+    def get_cached_artifacts(node, artifacts):
+        """
+        Return names of the packages which are already on
+        node.dst_dir with identical content. Only regular files
+        from the setup node directory (ivs packages, horizon
+        patch) are worth checking, scripts are regenerated
+        every run and are small.
+        """
+        local_md5s = {}
+        for src_dir, file_name in artifacts:
+            if src_dir != node.setup_node_dir:
+                continue
+            path = os.path.join(src_dir, file_name)
+            if not os.path.isfile(path):
+                continue
+            local_md5s[file_name] = Helper.get_local_md5(path)
+        if not local_md5s:
+            return set()
+        remote_md5s = Helper.get_remote_md5s(node, local_md5s.keys())
+        return set([f for f, md5 in local_md5s.iteritems()
+                    if remote_md5s.get(f) == md5])
+
+
+    @staticmethod
+    def pull_pkgs_from_relay(node, seeder, file_names):
+        """
+        Download file_names from the relay server on seeder into
+        node.dst_dir. A package is moved in place only if its md5
+        matches the one on the setup node.
+        """
+        user, passwd = Helper.get_login(node)
+        cmds = []
+        for file_name in file_names:
+            cmd = (r'''wget -q -T %(timeout)d -O %(dst_dir)s/%(file_name)s.part http://%(seeder)s:%(port)d/%(file_name)s && md5sum %(dst_dir)s/%(file_name)s.part | grep -q ^%(md5)s && mv -f %(dst_dir)s/%(file_name)s.part %(dst_dir)s/%(file_name)s && chmod 777 %(dst_dir)s/%(file_name)s''' %
+                  {'timeout'   : const.PACKAGE_RELAY_TIMEOUT,
+                   'dst_dir'   : node.dst_dir,
+                   'file_name' : file_name,
+                   'seeder'    : seeder,
+                   'port'      : const.PACKAGE_RELAY_PORT,
+                   'md5'       : Helper.get_local_md5(os.path.join(node.setup_node_dir, file_name))})
+            # wget runs through sudo, hand the package to the login
+            # user like a copy from the setup node does
+            if user and user != 'root':
+                cmd += (r''' && chown %(user)s %(dst_dir)s/%(file_name)s''' %
+                       {'user' : user, 'dst_dir' : node.dst_dir, 'file_name' : file_name})
+            cmds.append(cmd)
+        Helper.run_command_on_remote(node, "bash -c '%(cmds)s'" % {'cmds' : '; '.join(cmds)})
+
+
+    @staticmethod
+    def start_relay_server(node, file_names):
+        """
+        Serve file_names from a dedicated directory on node,
+        so that later nodes can pull them from it.
+        """
+        links = []
+        for file_name in file_names:
+            links.append(r'''ln -f %(dst_dir)s/%(file_name)s %(relay_dir)s/%(file_name)s''' %
+                        {'dst_dir'   : node.dst_dir,
+                         'relay_dir' : os.path.join(node.dst_dir, const.PACKAGE_RELAY_DIR),
+                         'file_name' : file_name})
+        # a relay left over by an earlier run holds the port
+        Helper.__stop_relay_server__(node)
+        server_cmd = ("bash -c 'mkdir -p %(relay_dir)s && %(links)s && cd %(relay_dir)s && (setsid nohup timeout %(ttl)d python -m SimpleHTTPServer %(port)d > /dev/null 2>&1 &) && for i in %(tries)s; do sleep 1; wget -q -T 1 -O /dev/null http://127.0.0.1:%(port)d/ && exit 0; done; exit 1'" %
+                     {'relay_dir' : os.path.join(node.dst_dir, const.PACKAGE_RELAY_DIR),
+                      'links'     : ' && '.join(links),
+                      'ttl'       : const.PACKAGE_RELAY_TTL,
+                      'port'      : const.PACKAGE_RELAY_PORT,
+                      'tries'     : ' '.join([str(i) for i in range(const.PACKAGE_RELAY_START_TIMEOUT)])})
+        code = Helper.run_command_on_remote(node, server_cmd)
+        if code != 0:
+            Helper.safe_print("Failed to start package relay on %(hostname)s, exit code %(code)s\n" %
+                             {'hostname' : node.hostname, 'code' : code})
+            return
+        PackageRelay.add_seeder(node)
 
 
+    @staticmethod
+    def __stop_relay_server__(node):
+        # [S] keeps pkill from matching the shell running it
+        Helper.run_command_on_remote(node,
+            ("pkill -f '[S]impleHTTPServer %(port)d'" %
+            {'port' : const.PACKAGE_RELAY_PORT}))
+
+
+    @staticmethod
+    def stop_relay_servers():
+        for node in PackageRelay.pop_seeders():
+            Helper.__stop_relay_server__(node)
+
 
+    @staticmethod
+    def copy_pkg_scripts_to_remote(node):
+        """
+        Copy everything the node needs to node.dst_dir,
+        return the number of bytes sent from the setup node.
+        """
+        artifacts = Helper.get_pkg_scripts_for_remote(node)
+
+        # skip packages which are already on the node
+        cached = Helper.get_cached_artifacts(node, artifacts)
+        if cached:
+            Helper.safe_print("%(file_names)s unchanged on %(hostname)s, skip copying\n" %
+                             {'file_names' : ', '.join(sorted(cached)),
+                              'hostname'   : node.hostname})
+            artifacts = [(d, f) for d, f in artifacts if f not in cached]
+
+        # get ivs packages from a node which already has them, try
+        # the next source if a seeder fails, until the setup node
+        # has a free slot to send the rest
+        relay_pkgs = []
+        if node.package_relay and node.deploy_mode == const.T6:
+            relay_pkgs = [f for d, f in artifacts
+                          if f in (node.ivs_pkg, node.ivs_debug_pkg)]
+        setup_node_slot = False
+        while relay_pkgs:
+            source = PackageRelay.acquire()
+            if source == PackageRelay.SETUP_NODE:
+                setup_node_slot = True
+                break
+            Helper.safe_print("Pull %(file_names)s from %(seeder)s to %(hostname)s\n" %
+                             {'file_names' : ', '.join(relay_pkgs),
+                              'seeder'     : source,
+                              'hostname'   : node.hostname})
+            try:
+                Helper.pull_pkgs_from_relay(node, source, relay_pkgs)
+            finally:
+                PackageRelay.release(source)
+            pulled = Helper.get_cached_artifacts(node,
+                [(node.setup_node_dir, f) for f in relay_pkgs])
+            if len(pulled) != len(relay_pkgs):
+                Helper.safe_print("Failed to pull packages from %(seeder)s to %(hostname)s\n" %
+                                 {'seeder' : source, 'hostname' : node.hostname})
+                PackageRelay.remove_seeder(source)
+            artifacts = [(d, f) for d, f in artifacts if f not in pulled]
+            relay_pkgs = [f for f in relay_pkgs if f not in pulled]
+
+        code = 0
+        size = 0
+        try:
+            if artifacts:
+                Helper.safe_print("Copy %(file_names)s to %(hostname)s\n" %
+                                 {'file_names' : ', '.join([f for d, f in artifacts]),
+                                  'hostname'   : node.hostname})
+                code, size, elapsed = Helper.copy_bundle_to_remote(node, artifacts)
+                rate = 0
+                if elapsed:
+                    rate = size / 1024.0 / elapsed
+                Helper.safe_print("Copied %(size)d bytes to %(hostname)s in %(elapsed).1fs (%(rate).1f KB/s)\n" %
+                                 {'size'     : size,
+                                  'hostname' : node.hostname,
+                                  'elapsed'  : elapsed,
+                                  'rate'     : rate})
+        finally:
+            if setup_node_slot:
+                PackageRelay.release(PackageRelay.SETUP_NODE)
+
+        if code != 0:
+            raise Exception("Failed to copy files to %(hostname)s, exit code %(code)s" %
+                            {'hostname' : node.hostname, 'code' : code})
+
+        # serve ivs packages to later nodes
+        if node.package_relay and node.deploy_mode == const.T6:
+            Helper.start_relay_server(node,
+                [f for f in (node.ivs_pkg, node.ivs_debug_pkg) if f])
+        return size
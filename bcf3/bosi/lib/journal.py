@@ -0,0 +1,75 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import constants as const
+
+
+class Journal(object):
+    """
+    Persistent record of the tasks (node/phase pairs) finished
+    successfully for one configuration. A resumed run with the
+    same configuration hash skips the recorded tasks.
+    The file holds one json object per line, the first line
+    carries the configuration hash.
+    """
+    def __init__(self, path, config_hash, resume=False):
+        self.path        = path
+        self.config_hash = config_hash
+        self.done        = set()
+        self.lock        = threading.Lock()
+
+        if resume:
+            self.done = self.__load__()
+        if not resume or self.done is None:
+            self.done = set()
+            with open(self.path, "w") as journal_file:
+                journal_file.write(json.dumps({'config_hash' : self.config_hash}) + '\n')
+
+
+    @staticmethod
+    def get_config_hash(config, fuel_cluster_id, tag, cleanup):
+        digest = hashlib.md5()
+        digest.update(json.dumps(config, sort_keys=True))
+        digest.update(json.dumps([fuel_cluster_id, tag, cleanup]))
+        return digest.hexdigest()
+
+
+    def __load__(self):
+        """
+        Return the recorded tasks, or None if there is no journal
+        for this configuration.
+        """
+        if not os.path.isfile(self.path):
+            return None
+        done = set()
+        with open(self.path, "r") as journal_file:
+            lines = journal_file.readlines()
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            return None
+        if header.get('config_hash') != self.config_hash:
+            return None
+        for line in lines[1:]:
+            try:
+                done.add(json.loads(line)['task'])
+            except (ValueError, KeyError):
+                # the last line may be cut short if bosi died writing it
+                continue
+        return done
+
+
+    def is_done(self, task_name):
+        with self.lock:
+            return task_name in self.done
+
+
+    def mark_done(self, task_name):
+        with self.lock:
+            self.done.add(task_name)
+            with open(self.path, "a") as journal_file:
+                journal_file.write(json.dumps({'task' : task_name, 'time' : time.time()}) + '\n')
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
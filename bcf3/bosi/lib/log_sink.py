@@ -0,0 +1,127 @@
+import os
+import Queue
+import atexit
+import threading
+import constants as const
+
+
+class LogSink(object):
+    """
+    Single thread appending all bosi log messages to LOG_FILE.
+    Other threads only put messages on a bounded queue. The file
+    stays open, is written in batches and rotated once it grows
+    past LOG_MAX_BYTES. Request and response bodies can be
+    truncated to keep large controller responses out of the log.
+    """
+
+    __lock = threading.Lock()
+    __msg_q = Queue.Queue(maxsize=const.LOG_QUEUE_SIZE)
+    __thread = None
+    __stopped = False
+    __stop_msg = object()
+
+    # bodies longer than this are truncated, 0 keeps them whole
+    __max_body = const.LOG_MAX_BODY
+    __path = const.LOG_FILE
+
+
+    @staticmethod
+    def set_max_body(max_body):
+        LogSink.__max_body = max_body
+
+
+    @staticmethod
+    def set_path(path):
+        """
+        Log to path instead of LOG_FILE, call before any write.
+        """
+        LogSink.__path = path
+
+
+    @staticmethod
+    def truncate(body):
+        if not body or not LogSink.__max_body or len(body) <= LogSink.__max_body:
+            return body
+        return ("%(body)s... (%(size)d bytes truncated)" %
+               {'body' : body[:LogSink.__max_body],
+                'size' : len(body) - LogSink.__max_body})
+
+
+    @staticmethod
+    def write(message):
+        with LogSink.__lock:
+            if LogSink.__stopped:
+                return
+            if not LogSink.__thread:
+                LogSink.__thread = threading.Thread(target=LogSink.__write_loop__)
+                LogSink.__thread.daemon = True
+                LogSink.__thread.start()
+                atexit.register(LogSink.stop)
+        LogSink.__msg_q.put(message)
+
+
+    @staticmethod
+    def stop():
+        """
+        Write all queued messages and close the log.
+        """
+        with LogSink.__lock:
+            if LogSink.__stopped:
+                return
+            LogSink.__stopped = True
+            thread = LogSink.__thread
+        if thread:
+            LogSink.__msg_q.put(LogSink.__stop_msg)
+            thread.join()
+
+
+    @staticmethod
+    def __open__(log_file):
+        """
+        Return log_file if it can still be used, otherwise the
+        reopened, and if needed rotated, log.
+        """
+        stat = None
+        if log_file:
+            stat = os.fstat(log_file.fileno())
+        if stat and stat.st_nlink == 0:
+            # the log was removed under us, e.g. by the setup
+            # node preparation
+            log_file.close()
+            log_file = None
+        elif stat and stat.st_size >= const.LOG_MAX_BYTES:
+            log_file.close()
+            log_file = None
+            for i in range(const.LOG_BACKUP_COUNT - 1, 0, -1):
+                src = "%s.%d" % (LogSink.__path, i)
+                if os.path.exists(src):
+                    os.rename(src, "%s.%d" % (LogSink.__path, i + 1))
+            os.rename(LogSink.__path, LogSink.__path + ".1")
+        if not log_file:
+            log_file = open(LogSink.__path, "a")
+        return log_file
+
+
+    @staticmethod
+    def __write_loop__():
+        log_file = None
+        while True:
+            messages = [LogSink.__msg_q.get()]
+            while len(messages) < const.LOG_BATCH_SIZE:
+                try:
+                    messages.append(LogSink.__msg_q.get_nowait())
+                except Queue.Empty:
+                    break
+            stop = LogSink.__stop_msg in messages
+            messages = [m for m in messages if m is not LogSink.__stop_msg]
+            try:
+                log_file = LogSink.__open__(log_file)
+                log_file.write(''.join(messages))
+                log_file.flush()
+            except (IOError, OSError):
+                # logging must never break a deployment
+                pass
+            if stop:
+                if log_file:
+                    log_file.close()
+                return
@@ -15,4 +15,24 @@ class MembershipRule(object):
     def __repr__(self):
         return self.__str__()
 
+    def get_vlan(self):
+        if self.br_vlan:
+            return int(self.br_vlan)
+        return -1
+
+    def get_switch_port_rules(self):
+        """
+        (interface, switch, vlan) of every switch port
+        membership rule of the segment.
+        """
+        return [(const.ANY, const.ANY, self.get_vlan()),
+                (self.br_key, const.ANY, -1)]
+
+    def get_port_group_rules(self):
+        """
+        (port-group, vlan) of every port group membership
+        rule of the segment.
+        """
+        return [(const.ANY, self.get_vlan())]
+
 
@@ -0,0 +1,163 @@
+import threading
+import BaseHTTPServer
+import constants as const
+from run_stats import RunStats
+from straggler import Straggler
+from tracer import Tracer
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = Metrics.render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        # keep scrapes out of the deployment output
+        pass
+
+
+class Metrics(object):
+    """
+    Serve the state of a running deployment on /metrics in the
+    prometheus text format: task queue depth and task states,
+    nodes in flight per phase, finished phases, bytes sent, ssh
+    handshakes, controller requests and their latency, worker
+    concurrency and stragglers. Everything is read from the
+    existing run statistics when scraped.
+    """
+
+    __lock = threading.Lock()
+    __server = None
+    __scheduler = None
+    __limiter = None
+
+
+    @staticmethod
+    def start(address, port):
+        """
+        Serve metrics on address:port in a daemon thread.
+        """
+        server = BaseHTTPServer.HTTPServer((address, port), MetricsHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        with Metrics.__lock:
+            Metrics.__server = server
+
+
+    @staticmethod
+    def watch(scheduler, limiter):
+        with Metrics.__lock:
+            Metrics.__scheduler = scheduler
+            Metrics.__limiter = limiter
+
+
+    @staticmethod
+    def stop():
+        with Metrics.__lock:
+            server = Metrics.__server
+            Metrics.__server = None
+        if server:
+            server.shutdown()
+            server.server_close()
+
+
+    @staticmethod
+    def __add_samples__(lines, name, samples):
+        """
+        samples is a list of (labels, value),
+        labels a list of (label, value).
+        """
+        for labels, value in samples:
+            label_text = ''
+            if labels:
+                label_text = '{%s}' % ','.join(['%s="%s"' % (label, str(label_value).replace('"', '\\"'))
+                                                for label, label_value in labels])
+            lines.append("%(name)s%(labels)s %(value)s" %
+                         {'name' : const.METRICS_PREFIX + name,
+                          'labels' : label_text,
+                          'value' : repr(float(value))})
+
+
+    @staticmethod
+    def __add_metric__(lines, name, metric_type, help_text, samples):
+        lines.append("# HELP %(name)s %(help)s" %
+                     {'name' : const.METRICS_PREFIX + name, 'help' : help_text})
+        lines.append("# TYPE %(name)s %(type)s" %
+                     {'name' : const.METRICS_PREFIX + name, 'type' : metric_type})
+        Metrics.__add_samples__(lines, name, samples)
+
+
+    @staticmethod
+    def __add_histogram__(lines, name, help_text, stat):
+        histogram = RunStats.get_histogram(stat)
+        if not histogram:
+            return
+        bounds, counts, total, count = histogram
+        buckets = []
+        cumulative = 0
+        for bound, bucket_count in zip(bounds + ['+Inf'], counts):
+            cumulative += bucket_count
+            buckets.append(([('le', bound)], cumulative))
+        Metrics.__add_metric__(lines, name, 'histogram', help_text, [])
+        Metrics.__add_samples__(lines, name + '_bucket', buckets)
+        Metrics.__add_samples__(lines, name + '_sum', [([], total)])
+        Metrics.__add_samples__(lines, name + '_count', [([], count)])
+
+
+    @staticmethod
+    def render():
+        with Metrics.__lock:
+            scheduler = Metrics.__scheduler
+            limiter = Metrics.__limiter
+        lines = []
+
+        if scheduler:
+            counts, queued = scheduler.get_counts()
+            Metrics.__add_metric__(lines, 'task_queue_depth', 'gauge',
+                                   'Tasks ready and waiting for a worker.', [([], queued)])
+            Metrics.__add_metric__(lines, 'tasks', 'gauge', 'Deployment tasks by phase and state.',
+                                   [([('phase', phase), ('state', state)], count)
+                                    for (phase, state), count in sorted(counts.items())])
+        if limiter:
+            Metrics.__add_metric__(lines, 'worker_concurrency', 'gauge',
+                                   'Current limit of tasks running at the same time.', [([], limiter.limit)])
+            Metrics.__add_metric__(lines, 'workers_busy', 'gauge',
+                                   'Tasks running right now.', [([], limiter.in_flight)])
+
+        Metrics.__add_metric__(lines, 'nodes_in_flight', 'gauge', 'Nodes currently in each phase.',
+                               [([('phase', phase)], count)
+                                for phase, count in sorted(Tracer.get_in_flight().items())])
+        finished = {}
+        for span in Tracer.get_spans():
+            key = (span.phase, 'success' if span.success else 'failure')
+            finished[key] = finished.get(key, 0) + 1
+        Metrics.__add_metric__(lines, 'phases_total', 'counter', 'Node phases finished, by result.',
+                               [([('phase', phase), ('result', result)], count)
+                                for (phase, result), count in sorted(finished.items())])
+
+        for name, stat, help_text in (
+                ('bytes_sent_total', const.STAT_BYTES_SENT, 'Bytes sent to nodes.'),
+                ('command_timeouts_total', const.STAT_TIMEOUTS, 'Commands which timed out.'),
+                ('command_cancels_total', const.STAT_CANCELLED, 'Commands aborted, e.g. of stragglers.'),
+                ('ssh_handshakes_total', const.STAT_SSH_HANDSHAKES, 'Ssh connections opened to nodes.'),
+                ('rest_requests_total', const.STAT_REST_CALLS, 'Requests sent to BCF controllers.'),
+                ('rest_errors_total', const.STAT_REST_ERRORS, 'Requests to BCF controllers which failed.')):
+            Metrics.__add_metric__(lines, name, 'counter', help_text, [([], RunStats.get(stat))])
+        Metrics.__add_histogram__(lines, 'rest_request_duration_seconds',
+                                  'Latency of requests to BCF controllers.', const.STAT_REST_LATENCY)
+
+        stragglers, retries = Straggler.get_counts()
+        Metrics.__add_metric__(lines, 'stragglers_total', 'counter',
+                               'Node phases flagged as stragglers.', [([], stragglers)])
+        Metrics.__add_metric__(lines, 'straggler_retries_total', 'counter',
+                               'Straggling node phases aborted and retried.', [([], retries)])
+        return '\n'.join(lines) + '\n'
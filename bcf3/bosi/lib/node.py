@@ -8,6 +8,9 @@ class Node(object):
         self.puppet_script_path    = None
         self.selinux_script_path   = None
         self.ospurge_script_path   = None
+        self.deploy_hash           = None
+        self.rendered_scripts      = {}
+        self.unchanged             = False
         self.log                   = const.LOG_FILE
         self.hostname              = node_config['hostname']
         self.role                  = node_config['role'].lower()
@@ -52,6 +55,8 @@ class Node(object):
         self.selinux_mode          = env.selinux_mode
         self.fuel_cluster_id       = env.fuel_cluster_id
         self.deploy_horizon_patch  = env.deploy_horizon_patch
+        self.package_relay         = env.package_relay
+        self.stream_output         = env.stream_output
         self.horizon_patch_url     = env.horizon_patch_url
         self.horizon_patch         = env.horizon_patch
         self.horizon_patch_dir     = env.horizon_patch_dir
@@ -61,6 +66,7 @@ class Node(object):
         self.ivs_debug_pkg         = None
         self.ivs_version           = None
         self.old_ivs_version       = node_config.get('old_ivs_version')
+        self.deployed_hash         = node_config.get('deployed_hash')
         if self.os in const.RPM_OS_SET:
             self.ivs_pkg           = self.ivs_pkg_map['rpm']
             self.ivs_debug_pkg     = self.ivs_pkg_map['debug_rpm']
@@ -125,6 +131,22 @@ class Node(object):
         self.ospurge_script_path = ospurge_script_path
 
 
+    def set_deploy_hash(self, deploy_hash):
+        self.deploy_hash = deploy_hash
+
+
+    def add_rendered_script(self, file_name, script):
+        self.rendered_scripts[file_name] = script
+
+
+    def set_unchanged(self, unchanged):
+        self.unchanged = unchanged
+
+
+    def is_unchanged(self):
+        return self.unchanged
+
+
     def get_network_vlan_ranges(self):
         return (r'''%(physnet)s:%(lower_vlan)s:%(upper_vlan)s''' %
                {'physnet'    : self.physnet,
@@ -259,10 +281,15 @@ horizon_patch_url      : %(horizon_patch_url)s,
 horizon_patch          : %(horizon_patch)s,
 horizon_patch_dir      : %(horizon_patch_dir)s,
 horizon_base_dir       : %(horizon_base_dir)s,
+package_relay          : %(package_relay)s,
+stream_output          : %(stream_output)s,
 ivs_pkg                : %(ivs_pkg)s,
 ivs_debug_pkg          : %(ivs_debug_pkg)s,
 ivs_version            : %(ivs_version)s,
 old_ivs_version        : %(old_ivs_version)s,
+deploy_hash            : %(deploy_hash)s,
+deployed_hash          : %(deployed_hash)s,
+unchanged              : %(unchanged)s,
 error                  : %(error)s,
 ''' %
 {
@@ -315,10 +342,15 @@ error                  : %(error)s,
 'horizon_patch'         : self.horizon_patch,
 'horizon_patch_dir'     : self.horizon_patch_dir,
 'horizon_base_dir'      : self.horizon_base_dir,
+'package_relay'         : self.package_relay,
+'stream_output'         : self.stream_output,
 'ivs_pkg'               : self.ivs_pkg,
 'ivs_debug_pkg'         : self.ivs_debug_pkg,
 'ivs_version'           : self.ivs_version,
 'old_ivs_version'       : self.old_ivs_version,
+'deploy_hash'           : self.deploy_hash,
+'deployed_hash'         : self.deployed_hash,
+'unchanged'             : self.unchanged,
 'error'                 : self.error,
 })
 
@@ -0,0 +1,91 @@
+import socket
+import fnmatch
+
+
+class NodeSelector(object):
+    """
+    Pick the nodes of a run from the yaml or fuel node list before
+    any node is probed. A node is selected if its tag equals the
+    run's tag, like deploy_bcf always required, and it matches
+    every other criterion given: one of roles, one of oses, one
+    of the hostname patterns and one of the listed hostnames.
+    Patterns are shell globs matched against the ip address and
+    the configured name of a node.
+    """
+    def __init__(self, tag=None, roles=None, oses=None, patterns=None, hostnames=None):
+        self.tag       = tag
+        self.roles     = set([role.lower() for role in roles or []])
+        self.oses      = set([os.lower() for os in oses or []])
+        self.patterns  = patterns or []
+        # we always use ip address as the hostname
+        self.hostnames = set([socket.gethostbyname(hostname)
+                              for hostname in hostnames or []])
+
+
+    def __str__(self):
+        criteria = []
+        for name, values in (('tag', [self.tag] if self.tag else []),
+                             ('role', sorted(self.roles)),
+                             ('os', sorted(self.oses)),
+                             ('hostname', self.patterns + sorted(self.hostnames))):
+            if values:
+                criteria.append("%(name)s %(values)s" %
+                                {'name' : name, 'values' : '|'.join(values)})
+        return ', '.join(criteria) or 'all nodes'
+
+
+    @staticmethod
+    def __build_index__(inventory):
+        """
+        Index hostnames by tag, role and os.
+        """
+        index = {'tag' : {}, 'role' : {}, 'os' : {}}
+        for hostname, node_config in inventory.iteritems():
+            index['tag'].setdefault(node_config.get('tag'), set()).add(hostname)
+            roles = str(node_config.get('role') or '').lower().split(',')
+            for role in roles:
+                index['role'].setdefault(role.strip(), set()).add(hostname)
+            node_os = node_config.get('os')
+            if node_os:
+                node_os = node_os.lower()
+            index['os'].setdefault(node_os, set()).add(hostname)
+        return index
+
+
+    def select(self, inventory):
+        """
+        inventory maps hostname to the node's yaml config, or the
+        part of it known before probing, with tag, role, os and
+        name. Return the selected hostnames. A node without an os
+        is selected by os for now, call matches_os once it is known.
+        """
+        index = NodeSelector.__build_index__(inventory)
+        selected = set(index['tag'].get(self.tag, set()))
+        for field, values in (('role', self.roles), ('os', self.oses)):
+            if not values:
+                continue
+            matched = set()
+            for value in values:
+                matched |= index[field].get(value, set())
+            if field == 'os':
+                matched |= index['os'].get(None, set())
+            selected &= matched
+        if self.hostnames:
+            selected &= self.hostnames
+        if self.patterns:
+            selected = set([hostname for hostname in selected
+                            if self.matches_pattern(hostname, inventory[hostname].get('name'))])
+        return selected
+
+
+    def matches_pattern(self, hostname, name=None):
+        for pattern in self.patterns:
+            if fnmatch.fnmatch(hostname, pattern):
+                return True
+            if name and fnmatch.fnmatch(name, pattern):
+                return True
+        return False
+
+
+    def matches_os(self, node_os):
+        return not self.oses or (node_os or '').lower() in self.oses
@@ -0,0 +1,180 @@
+import sys
+import time
+import Queue
+import atexit
+import threading
+import collections
+import constants as const
+import subprocess32 as subprocess
+
+
+class OutputRenderer(object):
+    """
+    Single thread writing all bosi output to stdout. Other threads
+    only put messages on a bounded queue, so they do not block on
+    the terminal, and streamed remote output which does not fit is
+    dropped and counted instead of filling memory. Lines end with '\r\n' on a terminal, so output stays
+    readable while ssh -t has the terminal in raw mode, and the
+    terminal is fixed up with 'stty sane' once at the end.
+
+    With the status view enabled, the renderer redraws a compact
+    table of per-node phase and elapsed time, followed by the most
+    recent messages, instead of printing interleaved lines.
+    """
+
+    __lock = threading.Lock()
+    __msg_q = Queue.Queue(const.OUTPUT_QUEUE_SIZE)
+    __dropped = 0
+    __thread = None
+    __stopped = False
+    __stop_msg = object()
+
+    __status_view = False
+    # hostname -> (phase, phase start time)
+    __phases = {}
+    # hostname -> last line of streamed remote output
+    __last_lines = {}
+    __recent = collections.deque(maxlen=const.STATUS_VIEW_MESSAGES)
+    __drawn_lines = 0
+
+
+    @staticmethod
+    def enable_status_view():
+        OutputRenderer.__status_view = sys.stdout.isatty()
+
+
+    @staticmethod
+    def is_status_view():
+        return OutputRenderer.__status_view
+
+
+    @staticmethod
+    def write(message, droppable=False):
+        """
+        Queue message for output. A droppable message is
+        dropped if the queue is full.
+        """
+        with OutputRenderer.__lock:
+            if OutputRenderer.__stopped:
+                OutputRenderer.__write__(message)
+                return
+            if not OutputRenderer.__thread:
+                OutputRenderer.__thread = threading.Thread(target=OutputRenderer.__render__)
+                OutputRenderer.__thread.daemon = True
+                OutputRenderer.__thread.start()
+                atexit.register(OutputRenderer.stop)
+        if not droppable:
+            OutputRenderer.__msg_q.put(message)
+            return
+        try:
+            OutputRenderer.__msg_q.put_nowait(message)
+        except Queue.Full:
+            with OutputRenderer.__lock:
+                OutputRenderer.__dropped += 1
+
+
+    @staticmethod
+    def set_phase(hostname, phase):
+        with OutputRenderer.__lock:
+            OutputRenderer.__phases[hostname] = (phase, time.time())
+
+
+    @staticmethod
+    def set_last_line(hostname, line):
+        with OutputRenderer.__lock:
+            OutputRenderer.__last_lines[hostname] = line
+
+
+    @staticmethod
+    def stop():
+        """
+        Drain all queued messages, then fix up the terminal.
+        """
+        with OutputRenderer.__lock:
+            if OutputRenderer.__stopped:
+                return
+            OutputRenderer.__stopped = True
+            thread = OutputRenderer.__thread
+        if thread:
+            OutputRenderer.__msg_q.put(OutputRenderer.__stop_msg)
+            thread.join()
+        if sys.stdout.isatty():
+            subprocess.call('stty sane', shell=True)
+
+
+    @staticmethod
+    def __write__(message):
+        if sys.stdout.isatty():
+            message = message.replace('\r\n', '\n').replace('\n', '\r\n')
+        sys.stdout.write(message)
+        sys.stdout.flush()
+
+
+    @staticmethod
+    def __get_dropped__():
+        """
+        Return a note on messages dropped since the last call, or None.
+        """
+        with OutputRenderer.__lock:
+            dropped = OutputRenderer.__dropped
+            OutputRenderer.__dropped = 0
+        if not dropped:
+            return None
+        return ("%(dropped)d lines of remote output not shown, output could not keep up\n" %
+                {'dropped' : dropped})
+
+
+    @staticmethod
+    def __render__():
+        while True:
+            timeout = None
+            if OutputRenderer.__status_view:
+                timeout = const.STATUS_VIEW_REFRESH
+            try:
+                message = OutputRenderer.__msg_q.get(timeout=timeout)
+            except Queue.Empty:
+                message = None
+            stop = message is OutputRenderer.__stop_msg
+            if stop:
+                message = None
+            messages = [m for m in (OutputRenderer.__get_dropped__(), message) if m]
+            if not OutputRenderer.__status_view:
+                for message in messages:
+                    OutputRenderer.__write__(message)
+            else:
+                for message in messages:
+                    OutputRenderer.__recent.extend(message.strip().splitlines())
+                OutputRenderer.__draw_status__()
+            if stop:
+                return
+
+
+    @staticmethod
+    def __draw_status__():
+        now = time.time()
+        with OutputRenderer.__lock:
+            phases = OutputRenderer.__phases.items()
+            last_lines = dict(OutputRenderer.__last_lines)
+        counts = collections.Counter([phase for hostname, (phase, start) in phases])
+        lines = ['nodes: ' + ', '.join(["%(phase)s %(count)d" % {'phase' : phase, 'count' : count}
+                                       for phase, count in sorted(counts.items())])]
+        in_flight = sorted([(start, hostname, phase) for hostname, (phase, start) in phases
+                            if phase != const.PHASE_DONE])
+        for start, hostname, phase in in_flight[:const.STATUS_VIEW_MAX_NODES]:
+            lines.append("  %(hostname)-20s %(phase)-16s %(elapsed)6ds  %(last_line)s" %
+                         {'hostname'  : hostname,
+                          'phase'     : phase,
+                          'elapsed'   : now - start,
+                          'last_line' : last_lines.get(hostname, '')[:const.STATUS_VIEW_LINE_WIDTH]})
+        if len(in_flight) > const.STATUS_VIEW_MAX_NODES:
+            lines.append("  ... %(more)d more" %
+                         {'more' : len(in_flight) - const.STATUS_VIEW_MAX_NODES})
+        lines.append('')
+        lines.extend(OutputRenderer.__recent)
+
+        output = ''
+        if OutputRenderer.__drawn_lines:
+            # move cursor to the start of the previous drawing and clear it
+            output = '\x1b[%dA\r\x1b[J' % OutputRenderer.__drawn_lines
+        OutputRenderer.__write__(output + '\n'.join(lines) + '\n')
+        OutputRenderer.__drawn_lines = len(lines)
@@ -0,0 +1,89 @@
+import threading
+import constants as const
+
+
+class PackageRelay(object):
+    """
+    Book keeping for tree fan-out distribution of ivs packages.
+    The setup node seeds the first nodes, every node which has
+    the packages then serves them to later nodes. Each source,
+    including the setup node, serves at most PACKAGE_RELAY_FANOUT
+    nodes at a time, so distribution bandwidth grows with the
+    number of nodes that already finished.
+    """
+
+    # source key of the setup node
+    SETUP_NODE = None
+
+    __cond = threading.Condition()
+
+    # source hostname -> number of nodes it is currently serving
+    __in_use = {SETUP_NODE : 0}
+
+    # hostname -> node of every node running a relay server
+    __seeders = {}
+
+
+    @staticmethod
+    def acquire():
+        """
+        Block until a source has a free slot and return it,
+        nodes are preferred over the setup node.
+        """
+        with PackageRelay.__cond:
+            while True:
+                seeder = None
+                for hostname, in_use in PackageRelay.__in_use.iteritems():
+                    if (hostname == PackageRelay.SETUP_NODE
+                        or in_use >= const.PACKAGE_RELAY_FANOUT):
+                        continue
+                    if (seeder is None
+                        or in_use < PackageRelay.__in_use[seeder]):
+                        seeder = hostname
+                if seeder is not None:
+                    PackageRelay.__in_use[seeder] += 1
+                    return seeder
+                if (PackageRelay.__in_use[PackageRelay.SETUP_NODE]
+                    < const.PACKAGE_RELAY_FANOUT):
+                    PackageRelay.__in_use[PackageRelay.SETUP_NODE] += 1
+                    return PackageRelay.SETUP_NODE
+                PackageRelay.__cond.wait()
+
+
+    @staticmethod
+    def release(source):
+        with PackageRelay.__cond:
+            if source in PackageRelay.__in_use:
+                PackageRelay.__in_use[source] -= 1
+            PackageRelay.__cond.notify_all()
+
+
+    @staticmethod
+    def add_seeder(node):
+        with PackageRelay.__cond:
+            PackageRelay.__seeders[node.hostname] = node
+            PackageRelay.__in_use.setdefault(node.hostname, 0)
+            PackageRelay.__cond.notify_all()
+
+
+    @staticmethod
+    def remove_seeder(hostname):
+        """
+        Stop handing out a seeder which failed to serve,
+        its relay server is still stopped at teardown.
+        """
+        with PackageRelay.__cond:
+            PackageRelay.__in_use.pop(hostname, None)
+            PackageRelay.__cond.notify_all()
+
+
+    @staticmethod
+    def pop_seeders():
+        """
+        Return all nodes running a relay server and forget them.
+        """
+        with PackageRelay.__cond:
+            seeders = PackageRelay.__seeders.values()
+            PackageRelay.__seeders = {}
+            PackageRelay.__in_use = {PackageRelay.SETUP_NODE : 0}
+            return seeders
@@ -0,0 +1,116 @@
+import re
+import socket
+import constants as const
+from helper import Helper
+from tracer import Tracer
+from transport import Transport, TransportTimeout
+
+
+class Preflight(object):
+    """
+    Check all nodes bosi is about to deploy at the same time,
+    before packages are downloaded or scripts rendered: ssh port
+    reachable, login and sudo working, enough free space in the
+    node's dst_dir and the os matching its configuration. Nodes
+    failing a check are skipped like any other skipped node.
+    """
+
+    @staticmethod
+    def check_node(node):
+        """
+        Return None if node passes all checks,
+        otherwise why it does not.
+        """
+        try:
+            sock = socket.create_connection((node.hostname, const.SSH_PORT),
+                                            const.PREFLIGHT_TIMEOUT)
+            sock.close()
+        except (socket.error, socket.timeout) as e:
+            return ("ssh port %(port)d unreachable: %(e)s" %
+                   {'port' : const.SSH_PORT, 'e' : e})
+
+        user, passwd = Helper.get_login(node)
+        check_cmd = (r'''df -Pk %(dst_dir)s; echo %(separator)s; cat /etc/os-release''' %
+                    {'dst_dir'   : node.dst_dir,
+                     'separator' : const.PROBE_SEPARATOR})
+        try:
+            code, output, errors = Transport.get().run(node.hostname, user, passwd, check_cmd,
+                                                       timeout=const.PREFLIGHT_TIMEOUT)
+        except TransportTimeout:
+            return "login timed out"
+        if not output or const.PROBE_SEPARATOR not in output:
+            return "login failed, exit code %(code)s" % {'code' : code}
+        df_output, os_release = output.split(const.PROBE_SEPARATOR, 1)
+
+        match = re.search(const.DF_EXPRESSION, df_output, re.MULTILINE)
+        if not match:
+            if user:
+                return "sudo failed"
+            return ("cannot read free space of %(dst_dir)s" %
+                   {'dst_dir' : node.dst_dir})
+        free_mb = int(match.group(1)) / 1024
+        if free_mb < const.PREFLIGHT_MIN_DISK_MB:
+            return ("%(free)dMB free in %(dst_dir)s, %(min)dMB needed" %
+                   {'free'    : free_mb,
+                    'dst_dir' : node.dst_dir,
+                    'min'     : const.PREFLIGHT_MIN_DISK_MB})
+
+        release = dict(re.findall(const.OS_RELEASE_EXPRESSION, os_release, re.MULTILINE))
+        if 'ID' not in release or 'VERSION_ID' not in release:
+            return "cannot read /etc/os-release"
+        os_version = release['VERSION_ID'].split('.')[0]
+        if release['ID'].lower() != node.os or os_version != node.os_version:
+            return ("runs %(os)s %(os_version)s, configured as %(node_os)s %(node_os_version)s" %
+                   {'os'              : release['ID'],
+                    'os_version'      : os_version,
+                    'node_os'         : node.os,
+                    'node_os_version' : node.os_version})
+        return None
+
+
+    @staticmethod
+    def run(node_dic):
+        """
+        Check all nodes to be deployed concurrently, skip the
+        failing ones and print a go/no-go table of all nodes.
+        Return False if there were nodes to check and none passed.
+        """
+        hostnames = [hostname for hostname, node in node_dic.iteritems()
+                     if not node.skip and node.tag == node.env_tag]
+        Helper.safe_print("Pre-flight checks of %(count)d nodes\n" %
+                         {'count' : len(hostnames)})
+        def check(hostname):
+            with Tracer.span(hostname, const.PHASE_PREFLIGHT):
+                return Preflight.check_node(node_dic[hostname])
+        results = Helper.run_concurrently(hostnames, check,
+                                          const.MAX_PREFLIGHT_WORKERS)
+
+        rows = []
+        passed = 0
+        for hostname, node in node_dic.iteritems():
+            if node.tag != node.env_tag:
+                continue
+            if node.skip:
+                rows.append((1, hostname, 'skip', node.error))
+                continue
+            if hostname not in results:
+                reason = "check failed"
+            else:
+                reason = results[hostname]
+            if reason:
+                node.skip = True
+                node.error = "pre-flight: %(reason)s" % {'reason' : reason}
+                rows.append((0, hostname, 'no-go', reason))
+            else:
+                passed += 1
+                rows.append((2, hostname, 'go', ''))
+
+        lines = ["%(hostname)-20s %(result)-6s %(reason)s" %
+                 {'hostname' : 'node', 'result' : 'result', 'reason' : 'reason'}]
+        for order, hostname, result, reason in sorted(rows):
+            lines.append("%(hostname)-20s %(result)-6s %(reason)s" %
+                         {'hostname' : hostname, 'result' : result, 'reason' : reason or ''})
+        lines.append("%(passed)d go, %(failed)d no-go" %
+                     {'passed' : passed, 'failed' : len(hostnames) - passed})
+        Helper.safe_print('\n'.join(lines) + '\n')
+        return passed > 0 or not hostnames
@@ -0,0 +1,46 @@
+import threading
+import collections
+import constants as const
+from output import OutputRenderer
+
+
+class RemoteOutput(object):
+    """
+    Lines streamed back from scripts running on nodes. Each node
+    keeps only its last STREAM_BUFFER_LINES lines, so memory does
+    not grow with the length of the scripts or the number of nodes.
+    Lines are printed tagged with hostname and phase, dropped if
+    the output thread falls behind, or, with the status view,
+    shown as the last line of each node.
+    """
+
+    __lock = threading.Lock()
+
+    # hostname -> deque of (phase, line)
+    __buffers = {}
+
+
+    @staticmethod
+    def append(hostname, phase, line):
+        with RemoteOutput.__lock:
+            if hostname not in RemoteOutput.__buffers:
+                RemoteOutput.__buffers[hostname] = collections.deque(
+                    maxlen=const.STREAM_BUFFER_LINES)
+            RemoteOutput.__buffers[hostname].append((phase, line))
+        if OutputRenderer.is_status_view():
+            OutputRenderer.set_last_line(hostname, line)
+        else:
+            OutputRenderer.write("[%(hostname)s %(phase)s] %(line)s\n" %
+                                {'hostname' : hostname,
+                                 'phase'    : phase,
+                                 'line'     : line},
+                                droppable=True)
+
+
+    @staticmethod
+    def get_tail(hostname):
+        """
+        Return the buffered (phase, line) of a node, oldest first.
+        """
+        with RemoteOutput.__lock:
+            return list(RemoteOutput.__buffers.get(hostname, []))
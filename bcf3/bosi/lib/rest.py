@@ -1,13 +1,100 @@
+import os
 import json
+import time
+import Queue
+import socket
 import httplib
+import threading
 import constants as const
+from log_sink import LogSink
+from run_stats import RunStats
 from membership_rule import MembershipRule
 
 
 class RestLib(object):
+
+    # host -> idle keep-alive connections to that controller
+    __pool_lock = threading.Lock()
+    __pools = {}
+
+    # controllers given to get_active_bcf_controller, the active
+    # one and hosts requests moved away from after a failover
+    __controller_lock = threading.Lock()
+    # held while probing controllers, so that only one thread
+    # fails over and requests are not blocked by the probes
+    __failover_lock = threading.Lock()
+    __controllers = None
+    __active = None
+    __replaced = set()
+
+
+    @staticmethod
+    def __get_connection__(host, timeout):
+        """
+        Return an idle connection to host and whether it was
+        reused, open a new one if there is none.
+        """
+        with RestLib.__pool_lock:
+            pool = RestLib.__pools.setdefault(host, [])
+            if pool:
+                connection = pool.pop()
+                connection.timeout = timeout
+                if connection.sock:
+                    connection.sock.settimeout(timeout)
+                return connection, True
+        return httplib.HTTPSConnection(host, timeout=timeout), False
+
+
+    @staticmethod
+    def __put_connection__(host, connection):
+        with RestLib.__pool_lock:
+            pool = RestLib.__pools.setdefault(host, [])
+            if len(pool) < const.BCF_MAX_CONNECTIONS:
+                pool.append(connection)
+                return
+        connection.close()
+
+
+    @staticmethod
+    def close_connections():
+        with RestLib.__pool_lock:
+            pools = RestLib.__pools
+            RestLib.__pools = {}
+        for pool in pools.itervalues():
+            for connection in pool:
+                connection.close()
+
+
     @staticmethod
     def request(url, prefix="/api/v1/data/controller/", method='GET',
-                data='', hashPath=None, host="127.0.0.1:8443", cookie=None):
+                data='', hashPath=None, host="127.0.0.1:8443", cookie=None,
+                timeout=const.BCF_REQUEST_TIMEOUT, failover=True):
+        """
+        Send a request to a controller. With failover, a request
+        to the active controller which fails because it is no
+        longer active is sent again to the new active controller.
+        """
+        if failover:
+            host, cookie = RestLib.__get_active_host__(host, cookie)
+        try:
+            ret = RestLib.__send__(url, prefix, method, data, hashPath, host,
+                                   cookie, timeout)
+        except Exception:
+            if not (failover and RestLib.__fail_over__(host)):
+                raise
+        else:
+            if not (failover and ret[0] in const.BCF_FAILOVER_STATUS
+                    and RestLib.__fail_over__(host)):
+                return ret
+        # host lost its active role or our session, send the
+        # request to the active controller with a fresh cookie
+        host, cookie = RestLib.__get_active_host__(host, cookie)
+        return RestLib.__send__(url, prefix, method, data, hashPath, host,
+                                cookie, timeout)
+
+
+    @staticmethod
+    def __send__(url, prefix, method, data, hashPath, host, cookie, timeout):
         headers = {'Content-type': 'application/json'}
 
         if cookie:
@@ -16,21 +103,47 @@ class RestLib(object):
         if hashPath:
             headers[const.HASH_HEADER] = hashPath
 
-        connection = httplib.HTTPSConnection(host)
-
+        RunStats.increment(const.STAT_REST_CALLS)
+        start = time.time()
         try:
-            connection.request(method, prefix + url, data, headers)
-            response = connection.getresponse()
-            ret = (response.status, response.reason, response.read(),
-                   response.getheader(const.HASH_HEADER))
-            with open(const.LOG_FILE, "a") as log_file:
-                log_file.write('Controller REQUEST: %s %s:body=%r' %
-                              (method, host + prefix + url, data))
-                log_file.write('Controller RESPONSE: status=%d reason=%r, data=%r,'
-                               'hash=%r' % ret)
+            connection, reused = RestLib.__get_connection__(host, timeout)
+            try:
+                connection.request(method, prefix + url, data, headers)
+                response = connection.getresponse()
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                if not reused:
+                    raise
+                # the controller closed an idle connection, retry
+                # once on a fresh one
+                connection = httplib.HTTPSConnection(host, timeout=timeout)
+                try:
+                    connection.request(method, prefix + url, data, headers)
+                    response = connection.getresponse()
+                except (httplib.HTTPException, socket.error):
+                    connection.close()
+                    raise
+            try:
+                ret = (response.status, response.reason, response.read(),
+                       response.getheader(const.HASH_HEADER))
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                RestLib.__put_connection__(host, connection)
+            LogSink.write('Controller REQUEST: %s %s:body=%r\n'
+                          'Controller RESPONSE: status=%d reason=%r, data=%r, hash=%r\n' %
+                          (method, host + prefix + url, LogSink.truncate(data),
+                           ret[0], ret[1], LogSink.truncate(ret[2]), ret[3]))
             return ret
         except Exception as e:
+            RunStats.increment(const.STAT_REST_ERRORS)
             raise Exception("Controller REQUEST exception: %s" % e)
+        finally:
+            RunStats.observe(const.STAT_REST_LATENCY, time.time() - start,
+                             const.REST_LATENCY_BUCKETS)
 
 
     @staticmethod
@@ -68,12 +181,13 @@ class RestLib(object):
 
 
     @staticmethod
-    def auth_bcf(server, username, password, port=const.BCF_CONTROLLER_PORT):
+    def auth_bcf(server, username, password, port=const.BCF_CONTROLLER_PORT,
+                 timeout=const.BCF_REQUEST_TIMEOUT):
         login = {"user": username, "password": password}
         host = "%s:%d" % (server, port)
         ret = RestLib.request("/api/v1/auth/login", prefix='',
                                method='POST', data=json.dumps(login),
-                               host=host)
+                               host=host, timeout=timeout, failover=False)
         session = json.loads(ret[2])
         if ret[0] != 200:
             raise Exception(ret)
@@ -89,19 +203,140 @@ class RestLib(object):
 
 
     @staticmethod
-    def get_active_bcf_controller(servers, username, password, port=const.BCF_CONTROLLER_PORT):
-        for server in servers:
+    def is_active_bcf_controller(server, cookie, port=const.BCF_CONTROLLER_PORT):
+        host = "%s:%d" % (server, port)
+        ret = RestLib.request('core/controller/role', host=host, cookie=cookie,
+                              timeout=const.BCF_PROBE_TIMEOUT, failover=False)
+        return ret[0] == 200 and 'active' in ret[2]
+
+
+    @staticmethod
+    def __load_cookies__(cookie_file):
+        if not cookie_file or not os.path.isfile(cookie_file):
+            return {}
+        try:
+            with open(cookie_file, "r") as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+
+    @staticmethod
+    def __save_cookies__(cookie_file, cookies):
+        if not cookie_file:
+            return
+        fd = os.open(cookie_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(cookies, f)
+
+
+    @staticmethod
+    def __find_active__(servers, username, password, port, cookie_file):
+        """
+        Probe all controllers at the same time and return the
+        first active one with its cookie. A cached cookie is used
+        if the controller still accepts it, otherwise log in.
+        """
+        cookies = RestLib.__load_cookies__(cookie_file)
+        result_q = Queue.Queue()
+
+        def probe(server):
+            cookie = cookies.get(server)
+            try:
+                if cookie and RestLib.is_active_bcf_controller(server, cookie, port):
+                    result_q.put((server, cookie, True))
+                    return
+            except Exception:
+                pass
             try:
-                cookie = RestLib.auth_bcf(server, username, password, port)
-                url = 'core/controller/role'
-                res = RestLib.get(cookie, url, server, port)[2]
-                if 'active' in res:
-                    return server, cookie
-            except Exception as e:
-                continue
+                cookie = RestLib.auth_bcf(server, username, password, port,
+                                          timeout=const.BCF_PROBE_TIMEOUT)
+                result_q.put((server, cookie,
+                              RestLib.is_active_bcf_controller(server, cookie, port)))
+            except Exception:
+                result_q.put((server, None, False))
+
+        for server in servers:
+            t = threading.Thread(target=probe, args=(server,))
+            t.daemon = True
+            t.start()
+        for i in range(len(servers)):
+            server, cookie, active = result_q.get()
+            if cookie:
+                cookies[server] = cookie
+            if active:
+                RestLib.__save_cookies__(cookie_file, cookies)
+                return server, cookie
+        RestLib.__save_cookies__(cookie_file, cookies)
         return None, None
 
 
+    @staticmethod
+    def get_active_bcf_controller(servers, username, password, port=const.BCF_CONTROLLER_PORT,
+                                  cookie_file=None):
+        """
+        Return the active controller and a session cookie for it,
+        and remember the controllers for failover.
+        """
+        server, cookie = RestLib.__find_active__(servers, username, password, port,
+                                                 cookie_file)
+        with RestLib.__controller_lock:
+            RestLib.__controllers = (servers, username, password, port, cookie_file)
+            RestLib.__active = None
+            if server:
+                RestLib.__active = ("%s:%d" % (server, port), cookie)
+            RestLib.__replaced = set()
+        return server, cookie
+
+
+    @staticmethod
+    def __get_active_host__(host, cookie):
+        """
+        Redirect requests aimed at a controller which lost
+        its active role to the current active controller.
+        """
+        with RestLib.__controller_lock:
+            if host in RestLib.__replaced and RestLib.__active:
+                return RestLib.__active
+        return host, cookie
+
+
+    @staticmethod
+    def __fail_over__(host):
+        """
+        Called after a request to host failed. If host was the
+        active controller and is not anymore, or does not accept
+        the session any more, switch to the active controller with
+        a new session. Return True if requests to host should be
+        sent again.
+        """
+        with RestLib.__failover_lock:
+            with RestLib.__controller_lock:
+                if not RestLib.__controllers or not RestLib.__active:
+                    return False
+                active_host, cookie = RestLib.__active
+                if host != active_host:
+                    # another thread already moved away from host
+                    return host in RestLib.__replaced
+                servers, username, password, port, cookie_file = RestLib.__controllers
+            server = host.split(':')[0]
+            try:
+                if RestLib.is_active_bcf_controller(server, cookie, port):
+                    return False
+            except Exception:
+                pass
+            new_server, new_cookie = RestLib.__find_active__(servers, username, password,
+                                                             port, cookie_file)
+            if not new_server or new_cookie == cookie:
+                return False
+            with RestLib.__controller_lock:
+                RestLib.__active = ("%s:%d" % (new_server, port), new_cookie)
+                RestLib.__replaced.add(host)
+        LogSink.write("BCF controller %s failed a request, continue with %s\n" %
+                      (server, new_server))
+        return True
+
+
     @staticmethod
     def get_os_mgmt_segments(server, cookie, tenant, port=const.BCF_CONTROLLER_PORT):
         url = (r'''applications/bcf/info/endpoint-manager/segment[tenant="%(tenant)s"]''' %
@@ -117,51 +352,212 @@ class RestLib(object):
         return segments
 
 
+    @staticmethod
+    def get_segment_url(tenant, segment):
+        return (r'''applications/bcf/tenant[name="%(tenant)s"]/segment[name="%(segment)s"]''' %
+               {'tenant' : tenant, 'segment' : segment})
+
+
+    @staticmethod
+    def get_switch_port_rule_url(tenant, segment, interface, switch, vlan):
+        return (r'''%(segment_url)s/switch-port-membership-rule[interface="%(interface)s"][switch="%(switch)s"][vlan=%(vlan)d]''' %
+               {'segment_url' : RestLib.get_segment_url(tenant, segment),
+                'interface'   : interface,
+                'switch'      : switch,
+                'vlan'        : vlan})
+
+
+    @staticmethod
+    def get_port_group_rule_url(tenant, segment, pg, vlan):
+        return (r'''%(segment_url)s/port-group-membership-rule[port-group="%(pg)s"][vlan=%(vlan)d]''' %
+               {'segment_url' : RestLib.get_segment_url(tenant, segment),
+                'pg'          : pg,
+                'vlan'        : vlan})
+
+
     @staticmethod
     def program_segment_and_membership_rule(server, cookie, rule, tenant, port=const.BCF_CONTROLLER_PORT):
-        segment_url = (r'''applications/bcf/tenant[name="%(tenant)s"]/segment[name="%(segment)s"]''' %
-                      {'tenant' : tenant, 'segment' : rule.br_key})
+        segment_url = RestLib.get_segment_url(tenant, rule.br_key)
         segment_data = {"name": rule.br_key}
         ret = RestLib.put(cookie, segment_url, server, port, json.dumps(segment_data))
         if ret[0] != 204:
             raise Exception(ret)
 
-        if rule.br_vlan:
-            vlan = int(rule.br_vlan)
-        else:
-            vlan = -1
-
-        intf_rule_url = (r'''applications/bcf/tenant[name="%(tenant)s"]/segment[name="%(segment)s"]/switch-port-membership-rule[interface="%(interface)s"][switch="%(switch)s"][vlan=%(vlan)d]''' %
-                       {'tenant'    : tenant,
-                        'segment'   : rule.br_key,
-                        'interface' : const.ANY,
-                        'switch'    : const.ANY,
-                        'vlan'      : vlan})
-        rule_data = {"interface" : const.ANY, "switch" : const.ANY, "vlan" : vlan}
-        ret = RestLib.put(cookie, intf_rule_url, server, port, json.dumps(rule_data))
-        if ret[0] != 204:
-            raise Exception(ret)
+        for interface, switch, vlan in rule.get_switch_port_rules():
+            intf_rule_url = RestLib.get_switch_port_rule_url(tenant, rule.br_key,
+                                                             interface, switch, vlan)
+            rule_data = {"interface" : interface, "switch" : switch, "vlan" : vlan}
+            ret = RestLib.put(cookie, intf_rule_url, server, port, json.dumps(rule_data))
+            if ret[0] != 204:
+                raise Exception(ret)
 
-        pg_rule_url = (r'''applications/bcf/tenant[name="%(tenant)s"]/segment[name="%(segment)s"]/port-group-membership-rule[port-group="%(pg)s"][vlan=%(vlan)d]''' %
-                       {'tenant'    : tenant,
-                        'segment'   : rule.br_key,
-                        'pg'        : const.ANY,
-                        'vlan'      : vlan})
-        rule_data = {"port-group" : const.ANY, "vlan" : vlan}
-        ret = RestLib.put(cookie, pg_rule_url, server, port, json.dumps(rule_data))
-        if ret[0] != 204:
+        for pg, vlan in rule.get_port_group_rules():
+            pg_rule_url = RestLib.get_port_group_rule_url(tenant, rule.br_key, pg, vlan)
+            rule_data = {"port-group" : pg, "vlan" : vlan}
+            ret = RestLib.put(cookie, pg_rule_url, server, port, json.dumps(rule_data))
+            if ret[0] != 204:
+                raise Exception(ret)
+
+
+    @staticmethod
+    def __run_concurrently__(items, func):
+        """
+        Call func on every item with at most BCF_MAX_CONNECTIONS
+        calls in flight. Raise the first error after all items
+        are attempted.
+        """
+        item_q = Queue.Queue()
+        for item in items:
+            item_q.put(item)
+        errors = []
+
+        def worker():
+            while True:
+                try:
+                    item = item_q.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    func(item)
+                except Exception as e:
+                    errors.append(e)
+
+        threads = []
+        for i in range(min(const.BCF_MAX_CONNECTIONS, item_q.qsize())):
+            t = threading.Thread(target=worker)
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+
+
+    @staticmethod
+    def program_membership_rules(server, cookie, rules, tenant, port=const.BCF_CONTROLLER_PORT):
+        """
+        Program segments and membership rules of all rules,
+        several rules at a time.
+        """
+        RestLib.__run_concurrently__(rules,
+            lambda rule: RestLib.program_segment_and_membership_rule(server, cookie, rule,
+                                                                     tenant, port))
+
+
+    @staticmethod
+    def get_config_hash(server, cookie, tenant, port=const.BCF_CONTROLLER_PORT):
+        """
+        Return the controller's config hash (the BCF-SETUP
+        response header) for the tenant, None if the controller
+        does not send one.
+        """
+        url = (r'''applications/bcf/tenant[name="%(tenant)s"]''' %
+              {'tenant' : tenant})
+        ret = RestLib.get(cookie, url, server, port, hashPath=url)
+        if ret[0] != 200:
             raise Exception(ret)
+        return ret[3]
 
-        specific_rule_url = (r'''applications/bcf/tenant[name="%(tenant)s"]/segment[name="%(segment)s"]/switch-port-membership-rule[interface="%(interface)s"][switch="%(switch)s"][vlan=%(vlan)d]''' %
-                       {'tenant'    : tenant,
-                        'segment'   : rule.br_key,
-                        'interface' : rule.br_key,
-                        'switch'    : const.ANY,
-                        'vlan'      : -1})
-        rule_data = {"interface" : rule.br_key, "switch" : const.ANY, "vlan" : -1}
-        ret = RestLib.put(cookie, specific_rule_url, server, port, json.dumps(rule_data))
-        if ret[0] != 204:
+
+    @staticmethod
+    def get_segments(server, cookie, tenant, port=const.BCF_CONTROLLER_PORT):
+        """
+        Read all segments of a tenant with their membership rules
+        in one request. Return a dictionary from segment name to
+        (switch port rules, port group rules), the rules in the
+        format of MembershipRule.get_*_rules.
+        """
+        url = (r'''applications/bcf/tenant[name="%(tenant)s"]/segment''' %
+              {'tenant' : tenant})
+        ret = RestLib.get(cookie, url, server, port)
+        if ret[0] != 200:
             raise Exception(ret)
+        segments = {}
+        for segment in json.loads(ret[2]):
+            switch_port_rules = set()
+            for rule in segment.get('switch-port-membership-rule', []):
+                switch_port_rules.add((rule.get('interface'), rule.get('switch'),
+                                       int(rule.get('vlan', -1))))
+            port_group_rules = set()
+            for rule in segment.get('port-group-membership-rule', []):
+                port_group_rules.add((rule.get('port-group'), int(rule.get('vlan', -1))))
+            segments[segment['name']] = (switch_port_rules, port_group_rules)
+        return segments
+
+
+    @staticmethod
+    def get_membership_rule_changes(segments, rules, tenant):
+        """
+        Compare the segments read by get_segments with the
+        segments and rules bosi wants, return a list of changes,
+        one list per segment so that a segment is created before
+        its rules. Each change is (method, url, data, description).
+        Segments bosi does not manage are left alone, stale rules
+        in managed segments are deleted.
+        """
+        segment_changes = []
+        for rule in rules:
+            changes = []
+            if rule.br_key not in segments:
+                changes.append(('PUT', RestLib.get_segment_url(tenant, rule.br_key),
+                                {"name" : rule.br_key},
+                                "create segment %(segment)s" % {'segment' : rule.br_key}))
+            switch_port_rules, port_group_rules = segments.get(rule.br_key, (set(), set()))
+
+            wanted = set(rule.get_switch_port_rules())
+            for interface, switch, vlan in sorted(wanted - switch_port_rules):
+                changes.append(('PUT',
+                                RestLib.get_switch_port_rule_url(tenant, rule.br_key, interface, switch, vlan),
+                                {"interface" : interface, "switch" : switch, "vlan" : vlan},
+                                "create switch-port-membership-rule %(interface)s/%(switch)s/%(vlan)d in segment %(segment)s" %
+                                {'interface' : interface, 'switch' : switch, 'vlan' : vlan, 'segment' : rule.br_key}))
+            for interface, switch, vlan in sorted(switch_port_rules - wanted):
+                changes.append(('DELETE',
+                                RestLib.get_switch_port_rule_url(tenant, rule.br_key, interface, switch, vlan),
+                                None,
+                                "delete switch-port-membership-rule %(interface)s/%(switch)s/%(vlan)d in segment %(segment)s" %
+                                {'interface' : interface, 'switch' : switch, 'vlan' : vlan, 'segment' : rule.br_key}))
+
+            wanted = set(rule.get_port_group_rules())
+            for pg, vlan in sorted(wanted - port_group_rules):
+                changes.append(('PUT',
+                                RestLib.get_port_group_rule_url(tenant, rule.br_key, pg, vlan),
+                                {"port-group" : pg, "vlan" : vlan},
+                                "create port-group-membership-rule %(pg)s/%(vlan)d in segment %(segment)s" %
+                                {'pg' : pg, 'vlan' : vlan, 'segment' : rule.br_key}))
+            for pg, vlan in sorted(port_group_rules - wanted):
+                changes.append(('DELETE',
+                                RestLib.get_port_group_rule_url(tenant, rule.br_key, pg, vlan),
+                                None,
+                                "delete port-group-membership-rule %(pg)s/%(vlan)d in segment %(segment)s" %
+                                {'pg' : pg, 'vlan' : vlan, 'segment' : rule.br_key}))
+            if changes:
+                segment_changes.append(changes)
+        return segment_changes
 
 
+    @staticmethod
+    def __apply_changes__(server, cookie, changes, port):
+        for method, url, data, description in changes:
+            if method == 'PUT':
+                ret = RestLib.put(cookie, url, server, port, json.dumps(data))
+            else:
+                ret = RestLib.delete(cookie, url, server, port)
+            if ret[0] != 204:
+                raise Exception(ret)
 
+
+    @staticmethod
+    def reconcile_membership_rules(server, cookie, rules, tenant, port=const.BCF_CONTROLLER_PORT):
+        """
+        Read the tenant's segments and rules, apply only the
+        changes needed to match rules and return the descriptions
+        of the applied changes.
+        """
+        segments = RestLib.get_segments(server, cookie, tenant, port)
+        segment_changes = RestLib.get_membership_rule_changes(segments, rules, tenant)
+        RestLib.__run_concurrently__(segment_changes,
+            lambda changes: RestLib.__apply_changes__(server, cookie, changes, port))
+        return [description for changes in segment_changes
+                for method, url, data, description in changes]
@@ -0,0 +1,55 @@
+import bisect
+import threading
+
+
+class RunStats(object):
+    """
+    Counters shared by all threads of a deployment run,
+    e.g. bytes sent to nodes and timed out commands,
+    and histograms like controller request latency.
+    """
+
+    __lock = threading.Lock()
+    __counters = {}
+    # name -> (bucket upper bounds, count per bucket, sum, count)
+    __histograms = {}
+
+
+    @staticmethod
+    def increment(name, value=1):
+        with RunStats.__lock:
+            RunStats.__counters[name] = RunStats.__counters.get(name, 0) + value
+
+
+    @staticmethod
+    def get(name):
+        with RunStats.__lock:
+            return RunStats.__counters.get(name, 0)
+
+
+    @staticmethod
+    def observe(name, value, buckets):
+        """
+        Add value to histogram name, buckets are the sorted upper
+        bounds of its buckets, values above the last go to +Inf.
+        """
+        with RunStats.__lock:
+            if name not in RunStats.__histograms:
+                RunStats.__histograms[name] = (list(buckets), [0] * (len(buckets) + 1), 0.0, 0)
+            bounds, counts, total, count = RunStats.__histograms[name]
+            counts[bisect.bisect_left(bounds, value)] += 1
+            RunStats.__histograms[name] = (bounds, counts, total + value, count + 1)
+
+
+    @staticmethod
+    def get_histogram(name):
+        """
+        Return (bucket upper bounds, count per bucket, sum, count)
+        of histogram name, None if nothing was observed.
+        """
+        with RunStats.__lock:
+            histogram = RunStats.__histograms.get(name)
+            if not histogram:
+                return None
+            bounds, counts, total, count = histogram
+            return list(bounds), list(counts), total, count
@@ -0,0 +1,171 @@
+import time
+import Queue
+import threading
+import constants as const
+
+
+class Task(object):
+    def __init__(self, name, func, deps, journaled=True, limited=True, noop=None):
+        self.name       = name
+        self.journaled  = journaled
+        self.limited    = limited
+        self.noop       = noop
+        self.phase      = name.split(':')[0]
+        self.func       = func
+        self.deps       = deps
+        self.dependents = []
+        self.pending    = len(deps)
+        self.state      = const.TASK_PENDING
+        self.error      = None
+
+    def __str__(self):
+        return (r'''{name : %(name)s, state : %(state)s, error : %(error)s}''' %
+               {'name' : self.name, 'state' : self.state, 'error' : self.error})
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class Scheduler(object):
+    """
+    Run tasks with a pool of worker threads. A task starts as soon
+    as all tasks it depends on are done, so there is no global
+    barrier between stages. If a task raises, every task depending
+    on it is skipped. An optional ConcurrencyLimiter caps how many
+    of the worker threads run remote tasks at the same time and
+    measures their latency. With a Journal,
+    tasks finished by a previous run are not run again and every
+    finished task is recorded.
+    """
+    def __init__(self, num_workers=const.MAX_WORKERS, limiter=None, journal=None):
+        self.num_workers = num_workers
+        self.limiter     = limiter
+        self.journal     = journal
+        self.tasks       = {}
+        self.task_q      = Queue.Queue()
+        self.lock        = threading.Lock()
+
+
+    @staticmethod
+    def task_name(phase, hostname):
+        return (r'''%(phase)s:%(hostname)s''' %
+               {'phase' : phase, 'hostname' : hostname})
+
+
+    def add_task(self, name, func, deps=None, journaled=True, limited=True, noop=None):
+        """
+        Add a task, func is called without arguments.
+        Tasks in deps must be added before this task.
+        Tasks which are not journaled run on every run,
+        for those producing in-memory state. Tasks which are
+        not limited, e.g. local ones, and tasks for which noop
+        returns True when they start bypass the limiter.
+        """
+        if name in self.tasks:
+            raise Exception("Task %(name)s already exists" % {'name' : name})
+        deps = deps or []
+        for dep in deps:
+            if dep not in self.tasks:
+                raise Exception("Task %(name)s depends on unknown task %(dep)s" %
+                                {'name' : name, 'dep' : dep})
+        task = Task(name, func, deps, journaled, limited, noop)
+        for dep in deps:
+            self.tasks[dep].dependents.append(task)
+        self.tasks[name] = task
+        return task
+
+
+    def __skip__(self, task, reason):
+        task.state = const.TASK_SKIPPED
+        task.error = reason
+        for dependent in task.dependents:
+            if dependent.state == const.TASK_PENDING:
+                self.__skip__(dependent, reason)
+
+
+    def __run_task__(self, task):
+        # tasks which do no remote work would skew the
+        # limiter's latency and take a slot for nothing
+        limited = (self.limiter and task.limited
+                   and not (task.noop and task.noop()))
+        if limited:
+            self.limiter.acquire()
+        start = time.time()
+        try:
+            task.func()
+            success = True
+        except Exception as e:
+            success = False
+            task.error = e
+        if limited:
+            self.limiter.release(task.phase, time.time() - start, success)
+        if success and self.journal and task.journaled:
+            self.journal.mark_done(task.name)
+        return success
+
+
+    def __worker__(self):
+        while True:
+            task = self.task_q.get()
+            if task is None:
+                self.task_q.task_done()
+                return
+            if (self.journal and task.journaled
+                and self.journal.is_done(task.name)):
+                success = True
+            else:
+                success = self.__run_task__(task)
+            with self.lock:
+                if success:
+                    task.state = const.TASK_DONE
+                    for dependent in task.dependents:
+                        dependent.pending -= 1
+                        if (dependent.pending == 0
+                            and dependent.state == const.TASK_PENDING):
+                            dependent.state = const.TASK_READY
+                            self.task_q.put(dependent)
+                else:
+                    task.state = const.TASK_FAILED
+                    for dependent in task.dependents:
+                        self.__skip__(dependent,
+                                      "%(name)s failed" % {'name' : task.name})
+            self.task_q.task_done()
+
+
+    def get_counts(self):
+        """
+        Return the number of tasks per (phase, state)
+        and the number of tasks queued for a worker.
+        """
+        counts = {}
+        with self.lock:
+            for task in self.tasks.itervalues():
+                key = (task.phase, task.state)
+                counts[key] = counts.get(key, 0) + 1
+        return counts, self.task_q.qsize()
+
+
+    def run(self):
+        """
+        Run all tasks and block until every task is done,
+        failed or skipped. Return the failed and skipped tasks.
+        """
+        with self.lock:
+            for task in self.tasks.itervalues():
+                if task.pending == 0 and task.state == const.TASK_PENDING:
+                    task.state = const.TASK_READY
+                    self.task_q.put(task)
+        threads = []
+        for i in range(self.num_workers):
+            t = threading.Thread(target=self.__worker__)
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        # dependents are queued before their prerequisite is marked
+        # done, so the queue only drains when all tasks are finished
+        self.task_q.join()
+        for t in threads:
+            self.task_q.put(None)
+        return [task for task in self.tasks.itervalues()
+                if task.state in (const.TASK_FAILED, const.TASK_SKIPPED)]
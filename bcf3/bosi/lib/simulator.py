@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import random
+import resource
+import tempfile
+import threading
+import constants as const
+from helper import Helper
+from tracer import Tracer
+from log_sink import LogSink
+from node_selector import NodeSelector
+from transport import Transport
+
+
+class SimulatedTransport(Transport):
+    """
+    Stand in for the nodes of a simulation. The first command or
+    copy a node runs within a phase span waits for a latency of
+    that phase sampled from the trace, divided by speedup, later
+    ones in the same span return at once. Commands succeed with
+    no output, stdin is written to /dev/null, so bundles are still
+    packed and counted. Waits end early on the cancel event.
+    """
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.__lock    = threading.Lock()
+        # spans which already waited for their phase latency
+        self.__replayed = set()
+
+
+    def __replay__(self, command):
+        span = Tracer.get_current_span()
+        with self.__lock:
+            if not span or span in self.__replayed:
+                return
+            self.__replayed.add(span)
+        latency = self.simulator.sample(span.phase)
+        cancel_event = Transport.get_cancel_event()
+        if cancel_event:
+            cancel_event.wait(latency)
+        else:
+            time.sleep(latency)
+        Transport.check_deadline(command, None, cancel_event)
+
+
+    def run(self, hostname, user, passwd, command, timeout=None, log=None,
+            line_func=None, stdin_func=None, sudo=True):
+        self.__replay__(command)
+        if stdin_func:
+            with open(os.devnull, "wb") as sink:
+                stdin_func(sink)
+        return 0, '', ''
+
+
+    def put(self, hostname, user, passwd, src_file, dst_file, log=None,
+            timeout=None):
+        self.__replay__(src_file)
+        return 0
+
+
+    def get_file(self, hostname, user, passwd, src_file, dst_file, log=None,
+                 timeout=None):
+        self.__replay__(src_file)
+        return 0
+
+
+    def close(self):
+        pass
+
+
+class Simulator(object):
+    """
+    Replay the per-phase latencies of a trace written with
+    --trace-file on synthetic nodes. The nodes are loaded and
+    deployed like real ones, through add_deploy_tasks, the real
+    Scheduler, ConcurrencyLimiter, rendering and Helper, only the
+    Transport is simulated. This measures the scheduler, the
+    concurrency limits and the setup node's cpu at any number of
+    nodes without a cluster. Generated scripts, placeholder
+    packages and the log go to a scratch directory.
+    """
+    def __init__(self, trace_file, speedup=const.SIMULATION_SPEEDUP,
+                 seed=const.SIMULATION_SEED):
+        self.speedup = speedup
+        self.random  = random.Random(seed)
+        self.lock    = threading.Lock()
+
+        # phase -> recorded durations in seconds
+        self.latencies = {}
+        # bytes sent by recorded uploads
+        self.upload_bytes = []
+        with open(trace_file, "r") as f:
+            trace = json.load(f)
+        for event in trace.get('traceEvents', []):
+            if event.get('ph') != 'X':
+                continue
+            self.latencies.setdefault(event['name'], []).append(event['dur'] / 1000000.0)
+            if event['name'] == const.PHASE_UPLOAD:
+                self.upload_bytes.append(event.get('args', {}).get('bytes', 0))
+
+        # share of deployed nodes which also got a dhcp agent
+        deployed = len(self.latencies.get(const.PHASE_BASH, []))
+        self.dhcp_ratio = 0
+        if deployed:
+            self.dhcp_ratio = (len(self.latencies.get(const.PHASE_DHCP_AGENT, []))
+                               / float(deployed))
+
+
+    def sample(self, phase):
+        """
+        Return a recorded latency of phase divided by speedup,
+        0 if the trace has none.
+        """
+        durations = self.latencies.get(phase)
+        if not durations:
+            return 0
+        with self.lock:
+            return self.random.choice(durations) / self.speedup
+
+
+    def __prepare_scratch_dir__(self, env):
+        """
+        Point env's setup node dir and the log to a scratch
+        directory with the templates of the real setup node dir
+        and placeholder packages of the recorded upload size.
+        """
+        scratch_dir = tempfile.mkdtemp(prefix=const.SIMULATION_DIR_PREFIX)
+        for deploy_mode in (const.T5, const.T6):
+            template_dir = os.path.join(env.setup_node_dir, deploy_mode)
+            if os.path.isdir(template_dir):
+                os.symlink(template_dir, os.path.join(scratch_dir, deploy_mode))
+        os.mkdir(os.path.join(scratch_dir, const.GENERATED_SCRIPT_DIR))
+
+        pkgs = [pkg for pkg in env.ivs_pkg_map.values() if pkg]
+        size = 0
+        if pkgs and self.upload_bytes:
+            size = sum(self.upload_bytes) / len(self.upload_bytes) / len(pkgs)
+        for pkg in pkgs:
+            with open(os.path.join(scratch_dir, pkg), "wb") as pkg_file:
+                pkg_file.truncate(size)
+
+        env.setup_node_dir = scratch_dir
+        LogSink.set_path(os.path.join(scratch_dir, os.path.basename(const.LOG_FILE)))
+        return scratch_dir
+
+
+    def load_nodes(self, env, num_nodes):
+        """
+        Return num_nodes synthetic nodes with env's defaults, the
+        first one is the openstack controller. Nodes are not probed,
+        the same share of them as in the trace gets a dhcp agent.
+        """
+        scratch_dir = self.__prepare_scratch_dir__(env)
+        Helper.safe_print("Simulation scripts, packages and log in %(dir)s\n" %
+                         {'dir' : scratch_dir})
+        node_yaml_config_map = {}
+        for i in range(num_nodes):
+            hostname = "sim-%05d" % i
+            role = const.ROLE_COMPUTE
+            if i == 0:
+                role = const.ROLE_NEUTRON_SERVER
+            node_yaml_config_map[hostname] = {
+                'hostname'          : hostname,
+                'name'              : hostname,
+                'role'              : role,
+                'tag'               : env.tag,
+                'deploy_mode'       : const.T6,
+                'deploy_dhcp_agent' : 0 < i < self.dhcp_ratio * num_nodes}
+        return Helper.load_nodes_from_yaml(node_yaml_config_map, env, NodeSelector(env.tag))
+
+
+    def run(self, scheduler, limiter):
+        """
+        Run the tasks of the synthetic nodes over the simulated
+        transport and print how long it took.
+        """
+        Transport.install(SimulatedTransport(self))
+        Helper.safe_print("Simulating %(tasks)d tasks, %(speedup)gx faster than recorded\n" %
+                         {'tasks'   : len(scheduler.tasks),
+                          'speedup' : self.speedup})
+        start = time.time()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        unfinished_tasks = scheduler.run()
+        elapsed = time.time() - start
+        end_usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu = ((end_usage.ru_utime - usage.ru_utime)
+               + (end_usage.ru_stime - usage.ru_stime))
+        Helper.safe_print("Simulated deployment took %(elapsed).1fs, %(real).1fs at recorded speed, "
+                          "%(unfinished)d tasks unfinished, setup node cpu %(cpu).1fs, "
+                          "final worker concurrency %(limit)d\n" %
+                         {'elapsed'    : elapsed,
+                          'real'       : elapsed * self.speedup,
+                          'unfinished' : len(unfinished_tasks),
+                          'cpu'        : cpu,
+                          'limit'      : limiter.limit})
+        return unfinished_tasks
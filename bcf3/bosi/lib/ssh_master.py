@@ -0,0 +1,115 @@
+import os
+import tempfile
+import threading
+import constants as const
+import subprocess32 as subprocess
+from run_stats import RunStats
+
+
+class SshMaster(object):
+    """
+    Keep one multiplexed ssh connection (ControlMaster) per node
+    for the lifetime of a deployment. Every ssh/scp issued by
+    Helper reuses it instead of paying a fresh handshake.
+    """
+
+    # protects the bookkeeping below
+    __lock = threading.Lock()
+
+    # directory holding the control sockets of this run
+    __control_dir = None
+
+    # control path -> target ([user@]hostname) of established masters
+    __masters = {}
+
+    # control paths we failed to establish, do not retry those
+    __failed = set()
+
+    # per control path locks, so that only one thread opens a master
+    __path_locks = {}
+
+
+    @staticmethod
+    def __get_control_dir__():
+        with SshMaster.__lock:
+            if not SshMaster.__control_dir:
+                SshMaster.__control_dir = tempfile.mkdtemp(
+                    prefix=const.SSH_CONTROL_DIR_PREFIX)
+            return SshMaster.__control_dir
+
+
+    @staticmethod
+    def __get_path_lock__(control_path):
+        with SshMaster.__lock:
+            if control_path not in SshMaster.__path_locks:
+                SshMaster.__path_locks[control_path] = threading.Lock()
+            return SshMaster.__path_locks[control_path]
+
+
+    @staticmethod
+    def get_control_path(hostname, user=None):
+        return (r'''%(control_dir)s/%(user)s@%(hostname)s''' %
+               {'control_dir' : SshMaster.__get_control_dir__(),
+                'user'        : user if user else 'key',
+                'hostname'    : hostname})
+
+
+    @staticmethod
+    def get_ssh_options(hostname, user=None, passwd=None):
+        """
+        Return the ssh/scp options to reuse the master connection
+        to hostname, establish the master first if needed.
+        If the master cannot be established, ssh falls back to
+        a direct connection.
+        """
+        control_path = SshMaster.get_control_path(hostname, user)
+        with SshMaster.__get_path_lock__(control_path):
+            if (not os.path.exists(control_path)
+                and control_path not in SshMaster.__failed):
+                SshMaster.__open__(control_path, hostname, user, passwd)
+        return (r'''-o ControlMaster=no -o ControlPath=%(control_path)s''' %
+               {'control_path' : control_path})
+
+
+    @staticmethod
+    def __open__(control_path, hostname, user, passwd):
+        target = hostname
+        if user:
+            target = (r'''%(user)s@%(hostname)s''' %
+                     {'user' : user, 'hostname' : hostname})
+        master_cmd = (r'''ssh -fNM -oStrictHostKeyChecking=no -o LogLevel=quiet -o ConnectTimeout=%(connect_timeout)d -o ControlPath=%(control_path)s -o ControlPersist=%(persist)d %(target)s < /dev/null > /dev/null 2>&1''' %
+                     {'connect_timeout' : const.SSH_CONNECT_TIMEOUT,
+                      'control_path'    : control_path,
+                      'persist'         : const.SSH_CONTROL_PERSIST,
+                      'target'          : target})
+        if passwd:
+            master_cmd = (r'''sshpass -p %(pwd)s %(master_cmd)s''' %
+                         {'pwd' : passwd, 'master_cmd' : master_cmd})
+        RunStats.increment(const.STAT_SSH_HANDSHAKES)
+        code = subprocess.call(master_cmd, shell=True)
+        with SshMaster.__lock:
+            if code == 0:
+                SshMaster.__masters[control_path] = target
+            else:
+                SshMaster.__failed.add(control_path)
+
+
+    @staticmethod
+    def close_all():
+        """
+        Tear down all master connections opened during this run.
+        """
+        with SshMaster.__lock:
+            masters = SshMaster.__masters.items()
+            SshMaster.__masters = {}
+            SshMaster.__failed = set()
+            SshMaster.__path_locks = {}
+            control_dir = SshMaster.__control_dir
+            SshMaster.__control_dir = None
+        for control_path, target in masters:
+            subprocess.call(r'''ssh -O exit -o ControlPath=%(control_path)s %(target)s > /dev/null 2>&1''' %
+                           {'control_path' : control_path, 'target' : target},
+                            shell=True)
+        if control_dir:
+            subprocess.call("rm -rf %(control_dir)s" %
+                           {'control_dir' : control_dir}, shell=True)
@@ -0,0 +1,176 @@
+import math
+import time
+import bisect
+import threading
+import constants as const
+from output import OutputRenderer
+from transport import Transport
+
+
+class Straggler(object):
+    """
+    Track the latency of every phase across nodes during a run.
+    A node still in a phase after STRAGGLER_MULTIPLE times the
+    phase's STRAGGLER_PERCENTILE latency is flagged as a straggler.
+    With retry enabled, a straggling phase listed as idempotent is
+    aborted through its transport cancel event and run again after
+    an exponential backoff.
+    """
+
+    __lock = threading.Lock()
+    __thread = None
+    __stopped = False
+
+    __percentile = const.STRAGGLER_PERCENTILE
+    __multiple = const.STRAGGLER_MULTIPLE
+    __retry = False
+    __retry_phases = const.STRAGGLER_RETRY_PHASES
+    __max_retries = const.STRAGGLER_MAX_RETRIES
+
+    # phase -> sorted durations of successful phases of all nodes
+    __latencies = {}
+    # (hostname, phase) -> (start time, cancel event)
+    __running = {}
+    # (hostname, phase, start time) of flagged phases
+    __flagged = set()
+    # hostname -> list of (phase, elapsed seconds) of straggling phases
+    __stragglers = {}
+    # hostname -> list of phases retried
+    __retries = {}
+
+
+    @staticmethod
+    def configure(percentile, multiple, retry, retry_phases, max_retries):
+        with Straggler.__lock:
+            Straggler.__percentile = percentile
+            Straggler.__multiple = multiple
+            Straggler.__retry = retry
+            Straggler.__retry_phases = retry_phases
+            Straggler.__max_retries = max_retries
+
+
+    @staticmethod
+    def __get_threshold__(phase):
+        """
+        Seconds after which a node in phase is a straggler,
+        None while too few nodes finished the phase.
+        Call with the lock held.
+        """
+        latencies = Straggler.__latencies.get(phase, [])
+        if len(latencies) < const.STRAGGLER_MIN_SAMPLES:
+            return None
+        index = int(math.ceil(Straggler.__percentile / 100.0 * len(latencies))) - 1
+        latency = latencies[min(max(index, 0), len(latencies) - 1)]
+        return max(latency * Straggler.__multiple, const.STRAGGLER_MIN_SECONDS)
+
+
+    @staticmethod
+    def run(hostname, phase, func):
+        """
+        Run func as phase of hostname and return its result.
+        If the phase is aborted as a straggler, it is retried
+        up to max_retries times, then it fails.
+        """
+        attempt = 0
+        while True:
+            cancel_event = threading.Event()
+            start = time.time()
+            with Straggler.__lock:
+                Straggler.__running[(hostname, phase)] = (start, cancel_event)
+                if not Straggler.__thread:
+                    Straggler.__thread = threading.Thread(target=Straggler.__watch__)
+                    Straggler.__thread.daemon = True
+                    Straggler.__thread.start()
+            Transport.set_cancel_event(cancel_event)
+            try:
+                result = func()
+            except Exception:
+                if not cancel_event.is_set():
+                    raise
+            finally:
+                Transport.set_cancel_event(None)
+                with Straggler.__lock:
+                    Straggler.__running.pop((hostname, phase), None)
+            if not cancel_event.is_set():
+                with Straggler.__lock:
+                    bisect.insort(Straggler.__latencies.setdefault(phase, []),
+                                  time.time() - start)
+                return result
+
+            attempt += 1
+            with Straggler.__lock:
+                Straggler.__retries.setdefault(hostname, []).append(phase)
+            if attempt > Straggler.__max_retries:
+                raise Exception("%(phase)s of %(hostname)s aborted as a straggler %(attempt)d times" %
+                                {'phase' : phase, 'hostname' : hostname, 'attempt' : attempt})
+            backoff = const.STRAGGLER_BACKOFF * 2 ** (attempt - 1)
+            OutputRenderer.write("Retry %(phase)s of %(hostname)s in %(backoff)ds\n" %
+                                 {'phase' : phase, 'hostname' : hostname, 'backoff' : backoff})
+            time.sleep(backoff)
+
+
+    @staticmethod
+    def __watch__():
+        while not Straggler.__stopped:
+            time.sleep(const.STRAGGLER_CHECK_INTERVAL)
+            now = time.time()
+            messages = []
+            with Straggler.__lock:
+                for (hostname, phase), (start, cancel_event) in Straggler.__running.items():
+                    threshold = Straggler.__get_threshold__(phase)
+                    if (threshold is None or now - start < threshold
+                        or (hostname, phase, start) in Straggler.__flagged):
+                        continue
+                    Straggler.__flagged.add((hostname, phase, start))
+                    Straggler.__stragglers.setdefault(hostname, []).append((phase, now - start))
+                    message = ("%(hostname)s is a straggler, %(phase)s running for %(elapsed)ds, "
+                               "%(multiple)gx the p%(percentile)d of %(count)d nodes" %
+                              {'hostname'   : hostname,
+                               'phase'      : phase,
+                               'elapsed'    : now - start,
+                               'multiple'   : Straggler.__multiple,
+                               'percentile' : Straggler.__percentile,
+                               'count'      : len(Straggler.__latencies[phase])})
+                    if Straggler.__retry and phase in Straggler.__retry_phases:
+                        cancel_event.set()
+                        message += ", abort it"
+                    messages.append(message + "\n")
+            for message in messages:
+                OutputRenderer.write(message)
+
+
+    @staticmethod
+    def stop():
+        Straggler.__stopped = True
+
+
+    @staticmethod
+    def get_counts():
+        """
+        Return the number of straggling phases and of retries.
+        """
+        with Straggler.__lock:
+            return (sum([len(phases) for phases in Straggler.__stragglers.itervalues()]),
+                    sum([len(phases) for phases in Straggler.__retries.itervalues()]))
+
+
+    @staticmethod
+    def get_summary():
+        """
+        Return a table of the nodes which straggled or needed
+        retries, an empty string if there are none.
+        """
+        with Straggler.__lock:
+            hostnames = sorted(set(Straggler.__stragglers) | set(Straggler.__retries))
+            if not hostnames:
+                return ''
+            lines = ["%(hostname)-20s %(stragglers)-30s %(retries)s" %
+                     {'hostname' : 'straggling nodes', 'stragglers' : 'phases',
+                      'retries' : 'retried'}]
+            for hostname in hostnames:
+                lines.append("%(hostname)-20s %(stragglers)-30s %(retries)s" %
+                             {'hostname'   : hostname,
+                              'stragglers' : ', '.join(["%s %ds" % (phase, elapsed) for phase, elapsed
+                                                        in Straggler.__stragglers.get(hostname, [])]),
+                              'retries'    : ', '.join(Straggler.__retries.get(hostname, []))})
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,166 @@
+import json
+import time
+import threading
+import constants as const
+from output import OutputRenderer
+
+
+class Span(object):
+    """
+    Time one phase of one node, use as a context manager.
+    """
+    def __init__(self, hostname, phase):
+        self.hostname = hostname
+        self.phase    = phase
+        self.start    = None
+        self.end      = None
+        self.bytes    = 0
+        self.success  = True
+
+    def __enter__(self):
+        self.start = time.time()
+        OutputRenderer.set_phase(self.hostname, self.phase)
+        Tracer.begin_span(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time.time()
+        if exc_type:
+            self.success = False
+        Tracer.add_span(self)
+        return False
+
+    def add_bytes(self, size):
+        self.bytes += size
+
+    def get_duration(self):
+        return self.end - self.start
+
+
+class Tracer(object):
+    """
+    Collect per-node, per-phase spans of a run, export them as a
+    json trace (chrome://tracing, Perfetto) and summarize the
+    slowest nodes and phases.
+    """
+
+    __lock = threading.Lock()
+    __spans = []
+    # phase -> number of spans of that phase not finished yet
+    __in_flight = {}
+    # span the calling thread is in
+    __local = threading.local()
+
+
+    @staticmethod
+    def span(hostname, phase):
+        return Span(hostname, phase)
+
+
+    @staticmethod
+    def begin_span(span):
+        with Tracer.__lock:
+            Tracer.__in_flight[span.phase] = Tracer.__in_flight.get(span.phase, 0) + 1
+        Tracer.__local.span = span
+
+
+    @staticmethod
+    def add_span(span):
+        with Tracer.__lock:
+            Tracer.__spans.append(span)
+            if Tracer.__in_flight.get(span.phase):
+                Tracer.__in_flight[span.phase] -= 1
+        Tracer.__local.span = None
+
+
+    @staticmethod
+    def get_current_span():
+        """
+        Return the span the calling thread is in, None if none.
+        """
+        return getattr(Tracer.__local, 'span', None)
+
+
+    @staticmethod
+    def get_in_flight():
+        """
+        Return the number of nodes currently in each phase.
+        """
+        with Tracer.__lock:
+            return dict(Tracer.__in_flight)
+
+
+    @staticmethod
+    def get_spans():
+        with Tracer.__lock:
+            return list(Tracer.__spans)
+
+
+    @staticmethod
+    def export(path):
+        """
+        Write all spans as a json trace in the trace event format,
+        one trace row per node.
+        """
+        spans = Tracer.get_spans()
+        if not spans:
+            return
+        run_start = min([span.start for span in spans])
+        hostnames = sorted(set([span.hostname for span in spans]))
+        tids = dict([(hostname, i + 1) for i, hostname in enumerate(hostnames)])
+        events = []
+        for hostname in hostnames:
+            events.append({'name' : 'thread_name',
+                           'ph'   : 'M',
+                           'pid'  : 1,
+                           'tid'  : tids[hostname],
+                           'args' : {'name' : hostname}})
+        for span in spans:
+            events.append({'name' : span.phase,
+                           'cat'  : 'bosi',
+                           'ph'   : 'X',
+                           'pid'  : 1,
+                           'tid'  : tids[span.hostname],
+                           'ts'   : int((span.start - run_start) * 1000000),
+                           'dur'  : int(span.get_duration() * 1000000),
+                           'args' : {'hostname' : span.hostname,
+                                     'bytes'    : span.bytes,
+                                     'success'  : span.success}})
+        with open(path, "w") as trace_file:
+            json.dump({'traceEvents' : events, 'displayTimeUnit' : 'ms'}, trace_file)
+
+
+    @staticmethod
+    def get_summary():
+        """
+        Return a table of the slowest phases and nodes.
+        """
+        spans = Tracer.get_spans()
+        if not spans:
+            return ''
+        phases = {}
+        nodes = {}
+        for span in spans:
+            phases.setdefault(span.phase, []).append(span)
+            nodes[span.hostname] = nodes.get(span.hostname, 0) + span.get_duration()
+
+        lines = ["%(phase)-16s %(count)6s %(total)10s %(mean)8s %(max)8s  %(slowest)s" %
+                 {'phase' : 'phase', 'count' : 'nodes', 'total' : 'total(s)',
+                  'mean' : 'mean(s)', 'max' : 'max(s)', 'slowest' : 'slowest node'}]
+        phase_rows = []
+        for phase, phase_spans in phases.iteritems():
+            durations = [span.get_duration() for span in phase_spans]
+            slowest = max(phase_spans, key=lambda span: span.get_duration())
+            phase_rows.append((sum(durations), phase, len(durations),
+                               sum(durations) / len(durations),
+                               slowest.get_duration(), slowest.hostname))
+        for total, phase, count, mean, longest, hostname in sorted(phase_rows, reverse=True):
+            lines.append("%(phase)-16s %(count)6d %(total)10.1f %(mean)8.1f %(max)8.1f  %(slowest)s" %
+                         {'phase' : phase, 'count' : count, 'total' : total,
+                          'mean' : mean, 'max' : longest, 'slowest' : hostname})
+        lines.append('')
+        lines.append("%(hostname)-20s %(total)10s" % {'hostname' : 'slowest nodes', 'total' : 'total(s)'})
+        slowest_nodes = sorted(nodes.items(), key=lambda item: item[1], reverse=True)
+        for hostname, total in slowest_nodes[:const.TRACE_SUMMARY_NODES]:
+            lines.append("%(hostname)-20s %(total)10.1f" % {'hostname' : hostname, 'total' : total})
+        return '\n'.join(lines) + '\n'
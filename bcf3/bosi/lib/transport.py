@@ -0,0 +1,469 @@
+import time
+import socket
+import threading
+import constants as const
+import subprocess32 as subprocess
+from log_sink import LogSink
+from run_stats import RunStats
+from ssh_master import SshMaster
+
+# paramiko is optional, without it bosi uses the ssh cli
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
+
+
+class TransportTimeout(Exception):
+    pass
+
+
+class TransportCancelled(TransportTimeout):
+    pass
+
+
+class Transport(object):
+    """
+    How bosi runs commands on nodes and copies files to and from
+    them. user and passwd are None for fuel nodes, which take the
+    setup node's key. Otherwise bosi logs in as user and commands
+    run through sudo, which reads passwd from stdin.
+    Backends keep ssh's semantics of a tty session, stderr of a
+    command is part of its output.
+    A thread can set a cancel event, commands it runs are stopped
+    soon after the event is set and raise TransportCancelled.
+    """
+
+    __lock = threading.Lock()
+    __active = None
+    __local = threading.local()
+
+
+    @staticmethod
+    def select(name):
+        """
+        Make the backend called name the one get returns, the
+        ssh cli is used when paramiko is not installed.
+        Return the name of the selected backend.
+        """
+        if name == const.TRANSPORT_PARAMIKO and paramiko is not None:
+            transport = ParamikoTransport()
+        else:
+            name = const.TRANSPORT_CLI
+            transport = CliTransport()
+        Transport.install(transport)
+        return name
+
+
+    @staticmethod
+    def install(transport):
+        """
+        Make the backend instance transport the one get returns.
+        """
+        with Transport.__lock:
+            if Transport.__active:
+                Transport.__active.close()
+            Transport.__active = transport
+
+
+    @staticmethod
+    def get():
+        with Transport.__lock:
+            if not Transport.__active:
+                Transport.__active = CliTransport()
+            return Transport.__active
+
+
+    @staticmethod
+    def set_cancel_event(event):
+        """
+        Stop commands of the calling thread once event is set,
+        None stops watching.
+        """
+        Transport.__local.cancel_event = event
+
+
+    @staticmethod
+    def get_cancel_event():
+        return getattr(Transport.__local, 'cancel_event', None)
+
+
+    @staticmethod
+    def check_deadline(command, deadline, cancel_event):
+        """
+        Raise if command ran past deadline or was cancelled.
+        """
+        if cancel_event and cancel_event.is_set():
+            raise TransportCancelled("Cancelled command %s." % command)
+        if deadline and time.time() >= deadline:
+            raise TransportTimeout("Timed out waiting for command %s to finish." % command)
+
+
+    @staticmethod
+    def get_wait(deadline, cancel_event):
+        """
+        Seconds to block before checking the deadline and the
+        cancel event again, None to block until done.
+        """
+        wait = None
+        if cancel_event:
+            wait = const.TRANSPORT_POLL_INTERVAL
+        if deadline:
+            remaining = max(deadline - time.time(), 0.01)
+            wait = min(wait or remaining, remaining)
+        return wait
+
+
+    def run(self, hostname, user, passwd, command, timeout=None, log=None,
+            line_func=None, stdin_func=None, sudo=True):
+        """
+        Run command on hostname and return (exit code, output,
+        errors). Output is appended to the local file log instead
+        if given, every line of it is passed to line_func if given.
+        stdin_func is called with a file to write the command's
+        stdin to. Raise TransportTimeout if command does not
+        finish within timeout seconds.
+        """
+        raise NotImplementedError()
+
+
+    def put(self, hostname, user, passwd, src_file, dst_file, log=None,
+            timeout=None):
+        """
+        Copy the local src_file to dst_file on hostname,
+        return the exit code.
+        """
+        raise NotImplementedError()
+
+
+    def get_file(self, hostname, user, passwd, src_file, dst_file, log=None,
+                 timeout=None):
+        """
+        Copy src_file on hostname to the local dst_file,
+        return the exit code.
+        """
+        raise NotImplementedError()
+
+
+    def close(self):
+        """
+        Close all connections opened by this backend.
+        """
+        raise NotImplementedError()
+
+
+class CliTransport(Transport):
+    """
+    Fork ssh, scp and sshpass for every command, over the
+    multiplexed master connection SshMaster keeps per node.
+    """
+
+    @staticmethod
+    def __get_target__(hostname, user, passwd):
+        if user:
+            return (r'''%(user)s@%(hostname)s''' %
+                   {'user' : user, 'hostname' : hostname})
+        return hostname
+
+
+    @staticmethod
+    def __with_passwd__(local_cmd, passwd):
+        if passwd:
+            return (r'''sshpass -p %(pwd)s %(local_cmd)s''' %
+                   {'pwd' : passwd, 'local_cmd' : local_cmd})
+        return local_cmd
+
+
+    @staticmethod
+    def __with_log__(local_cmd, log):
+        if log:
+            return (r'''%(local_cmd)s >> %(log)s 2>&1''' %
+                   {'local_cmd' : local_cmd, 'log' : log})
+        return local_cmd
+
+
+    @staticmethod
+    def __communicate__(local_cmd, timeout):
+        cancel_event = Transport.get_cancel_event()
+        deadline = None
+        if timeout:
+            deadline = time.time() + timeout
+        p = subprocess.Popen(local_cmd, shell=True, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, close_fds=True)
+        while True:
+            try:
+                output, errors = p.communicate(timeout=Transport.get_wait(deadline, cancel_event))
+                return p.returncode, output, errors
+            except subprocess.TimeoutExpired:
+                try:
+                    Transport.check_deadline(local_cmd, deadline, cancel_event)
+                except TransportTimeout:
+                    p.terminate()
+                    p.communicate()
+                    raise
+
+
+    def run(self, hostname, user, passwd, command, timeout=None, log=None,
+            line_func=None, stdin_func=None, sudo=True):
+        if user and sudo:
+            command = (r'''echo %(pwd)s | sudo -S %(command)s''' %
+                      {'pwd' : passwd, 'command' : command})
+        local_cmd = (r'''ssh %(tty)s-oStrictHostKeyChecking=no -o LogLevel=quiet %(ssh_opts)s %(target)s "%(remote_cmd)s"''' %
+                    {'tty'        : '' if stdin_func else '-t ',
+                     'ssh_opts'   : SshMaster.get_ssh_options(hostname, user, passwd),
+                     'target'     : CliTransport.__get_target__(hostname, user, passwd),
+                     'remote_cmd' : command})
+        local_cmd = CliTransport.__with_log__(CliTransport.__with_passwd__(local_cmd, passwd), log)
+        if not line_func and not stdin_func:
+            return CliTransport.__communicate__(local_cmd, timeout)
+
+        # streamed input or output, a watcher thread enforces
+        # the timeout and the cancel event
+        cancel_event = Transport.get_cancel_event()
+        deadline = None
+        if timeout:
+            deadline = time.time() + timeout
+        p = subprocess.Popen(local_cmd, shell=True,
+                             stdin=subprocess.PIPE if stdin_func else None,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                             close_fds=True)
+        done = threading.Event()
+        stopped = []
+        def watch():
+            while not done.wait(Transport.get_wait(deadline, cancel_event)):
+                try:
+                    Transport.check_deadline(local_cmd, deadline, cancel_event)
+                except TransportTimeout as e:
+                    stopped.append(e)
+                    p.terminate()
+                    return
+        watcher = None
+        if deadline or cancel_event:
+            watcher = threading.Thread(target=watch)
+            watcher.daemon = True
+            watcher.start()
+        if stdin_func:
+            stdin_func(p.stdin)
+            try:
+                p.stdin.close()
+            except IOError:
+                pass
+        output = []
+        for line in iter(p.stdout.readline, ''):
+            if line_func:
+                line_func(line.rstrip('\r\n'))
+            else:
+                output.append(line)
+        code = p.wait()
+        done.set()
+        if watcher:
+            watcher.join()
+        if stopped:
+            raise stopped[0]
+        return code, ''.join(output), ''
+
+
+    def put(self, hostname, user, passwd, src_file, dst_file, log=None,
+            timeout=None):
+        scp_cmd = (r'''scp -oStrictHostKeyChecking=no -o LogLevel=quiet %(ssh_opts)s -r %(src_file)s %(target)s:%(dst_file)s''' %
+                  {'ssh_opts' : SshMaster.get_ssh_options(hostname, user, passwd),
+                   'target'   : CliTransport.__get_target__(hostname, user, passwd),
+                   'src_file' : src_file,
+                   'dst_file' : dst_file})
+        scp_cmd = CliTransport.__with_log__(CliTransport.__with_passwd__(scp_cmd, passwd), log)
+        return CliTransport.__communicate__(scp_cmd, timeout)[0]
+
+
+    def get_file(self, hostname, user, passwd, src_file, dst_file, log=None,
+                 timeout=None):
+        scp_cmd = (r'''scp -oStrictHostKeyChecking=no -o LogLevel=quiet %(ssh_opts)s %(target)s:%(src_file)s %(dst_file)s''' %
+                  {'ssh_opts' : SshMaster.get_ssh_options(hostname, user, passwd),
+                   'target'   : CliTransport.__get_target__(hostname, user, passwd),
+                   'src_file' : src_file,
+                   'dst_file' : dst_file})
+        scp_cmd = CliTransport.__with_log__(CliTransport.__with_passwd__(scp_cmd, passwd), log)
+        return CliTransport.__communicate__(scp_cmd, timeout)[0]
+
+
+    def close(self):
+        SshMaster.close_all()
+
+
+class ParamikoTransport(Transport):
+    """
+    Keep one in-process ssh connection per node and run every
+    command on a new channel of it. No process or thread is
+    created per command, timeouts are socket timeouts, and sudo
+    gets the password on stdin instead of the command line. Like
+    ssh -t, commands without input run on a pty, for sudoers
+    with requiretty.
+    """
+    def __init__(self):
+        self.__lock         = threading.Lock()
+        # (hostname, user) -> connected paramiko.SSHClient
+        self.__clients      = {}
+        # (hostname, user) -> lock, so that only one thread connects
+        self.__client_locks = {}
+
+
+    def __get_client__(self, hostname, user, passwd):
+        key = (hostname, user)
+        with self.__lock:
+            client_lock = self.__client_locks.setdefault(key, threading.Lock())
+        with client_lock:
+            client = self.__clients.get(key)
+            if (client and client.get_transport()
+                and client.get_transport().is_active()):
+                return client
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            RunStats.increment(const.STAT_SSH_HANDSHAKES)
+            client.connect(hostname, username=user, password=passwd,
+                           timeout=const.SSH_CONNECT_TIMEOUT)
+            client.get_transport().set_keepalive(const.SSH_KEEPALIVE_INTERVAL)
+            self.__clients[key] = client
+            return client
+
+
+    def __drop_client__(self, hostname, user, client):
+        """
+        Forget a broken client, so that the next
+        command on the node connects again.
+        """
+        with self.__lock:
+            if self.__clients.get((hostname, user)) is client:
+                del self.__clients[(hostname, user)]
+        client.close()
+
+
+    @staticmethod
+    def __write_log__(log, message):
+        # log is bosi's own log, which LogSink keeps open
+        if log:
+            LogSink.write(message)
+
+
+    def run(self, hostname, user, passwd, command, timeout=None, log=None,
+            line_func=None, stdin_func=None, sudo=True):
+        # on a pty the password would be echoed if sent before
+        # sudo turns echo off, which it does before its prompt
+        pty = user and sudo and not stdin_func
+        prompt = const.TRANSPORT_SUDO_PROMPT if pty else ''
+        if user and sudo:
+            command = (r'''sudo -S -p '%(prompt)s' %(command)s''' %
+                      {'prompt' : prompt, 'command' : command})
+        client = None
+        try:
+            client = self.__get_client__(hostname, user, passwd)
+            channel = client.get_transport().open_session()
+        except (paramiko.SSHException, socket.error) as e:
+            if client:
+                self.__drop_client__(hostname, user, client)
+            # same exit code as ssh failing to connect
+            error = "Failed to connect to %(hostname)s: %(e)s\n" % {'hostname' : hostname, 'e' : e}
+            ParamikoTransport.__write_log__(log, error)
+            return 255, '', error
+
+        cancel_event = Transport.get_cancel_event()
+        deadline = None
+        if timeout:
+            deadline = time.time() + timeout
+        output = []
+        pending = ''
+        try:
+            channel.settimeout(timeout)
+            channel.set_combine_stderr(True)
+            if pty:
+                channel.get_pty()
+            channel.exec_command(command)
+            if user and sudo and not pty:
+                channel.sendall(passwd + '\n')
+            if stdin_func:
+                stdin = channel.makefile('wb')
+                stdin_func(stdin)
+                stdin.flush()
+            if not pty:
+                channel.shutdown_write()
+            while True:
+                Transport.check_deadline(command, deadline, cancel_event)
+                channel.settimeout(Transport.get_wait(deadline, cancel_event))
+                try:
+                    data = channel.recv(const.TRANSPORT_RECV_SIZE)
+                except socket.timeout:
+                    continue
+                if not data:
+                    break
+                if prompt and prompt in data:
+                    data = data.replace(prompt, '')
+                    channel.sendall(passwd + '\n')
+                ParamikoTransport.__write_log__(log, data)
+                if line_func:
+                    lines = (pending + data).split('\n')
+                    pending = lines.pop()
+                    for line in lines:
+                        line_func(line.rstrip('\r'))
+                if not log and not line_func:
+                    output.append(data)
+            if pending and line_func:
+                line_func(pending.rstrip('\r'))
+            return channel.recv_exit_status(), ''.join(output), ''
+        except socket.timeout:
+            raise TransportTimeout("Timed out waiting for command %(command)s on %(hostname)s to finish." %
+                                   {'command' : command, 'hostname' : hostname})
+        except (paramiko.SSHException, socket.error) as e:
+            # e.g. the connection dropped, same exit code as ssh
+            self.__drop_client__(hostname, user, client)
+            error = "Lost connection to %(hostname)s: %(e)s\n" % {'hostname' : hostname, 'e' : e}
+            ParamikoTransport.__write_log__(log, error)
+            return 255, ''.join(output), error
+        finally:
+            channel.close()
+
+
+    def __sftp__(self, hostname, user, passwd, func, log, timeout):
+        client = None
+        try:
+            client = self.__get_client__(hostname, user, passwd)
+            sftp = client.open_sftp()
+        except (paramiko.SSHException, socket.error) as e:
+            if client:
+                self.__drop_client__(hostname, user, client)
+            ParamikoTransport.__write_log__(log, "Failed to connect to %(hostname)s: %(e)s\n" %
+                                            {'hostname' : hostname, 'e' : e})
+            return 255
+        try:
+            sftp.get_channel().settimeout(timeout)
+            func(sftp)
+            return 0
+        except socket.timeout:
+            raise TransportTimeout("Timed out copying files with %(hostname)s." %
+                                   {'hostname' : hostname})
+        except (IOError, OSError, paramiko.SSHException) as e:
+            if isinstance(e, paramiko.SSHException):
+                self.__drop_client__(hostname, user, client)
+            ParamikoTransport.__write_log__(log, "Failed to copy files with %(hostname)s: %(e)s\n" %
+                                            {'hostname' : hostname, 'e' : e})
+            return 1
+        finally:
+            sftp.close()
+
+
+    def put(self, hostname, user, passwd, src_file, dst_file, log=None,
+            timeout=None):
+        return self.__sftp__(hostname, user, passwd,
+                             lambda sftp: sftp.put(src_file, dst_file), log, timeout)
+
+
+    def get_file(self, hostname, user, passwd, src_file, dst_file, log=None,
+                 timeout=None):
+        return self.__sftp__(hostname, user, passwd,
+                             lambda sftp: sftp.get(src_file, dst_file), log, timeout)
+
+
+    def close(self):
+        with self.__lock:
+            clients = self.__clients.values()
+            self.__clients = {}
+            self.__client_locks = {}
+        for client in clients:
+            client.close()